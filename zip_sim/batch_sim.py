@@ -0,0 +1,307 @@
+"""
+Runs many independent zip_sim worlds in lockstep.
+
+The vehicles, packages and world geometry of every world are held in NumPy arrays, so physics, collisions, lidar and
+scoring are computed for all the worlds at once. Each world is generated and its wind is driven from its own random
+number generator seeded exactly like ZipSimulation, so world k behaves tick for tick like ZipSimulation(seeds[k])
+given the same commands. With wind_model="trace", each world's wind is a WindTrace, looked up for every world at once
+rather than drawn a world at a time.
+
+    sim = BatchZipSimulation(range(1000))
+    telemetry = sim.telemetry()
+    while not sim.done.all():
+        telemetry = sim.step(lateral_airspeed, drop_package_commanded)
+    deliveries, zipaa_violations = sim.result()
+"""
+import collections
+
+import numpy as np
+
+from zip_sim import (DT_SEC, WORLD_WIDTH, WORLD_LENGTH, WORLD_WIDTH_HALF, WORLD_LENGTH_HALF, PACKAGE_FALL_SEC,
+                     RECOVERY_X, RECOVERY_Y_MIN, RECOVERY_Y_MAX, WORLD_SIZES, VEHICLE_AIRSPEED,
+                     LIDAR_MAX_DISTANCE, LIDAR_ANGLES, TREE_COLLISION_RADIUS, DELIVERY_SITE_RADIUS, RECOVERED,
+                     PARALANDED, CRASHED, cast_lidar_rays, create_world, lidar_samples)
+
+# Status of a world that hasn't finished yet
+RUNNING = -1
+
+# With wind traces, this many ticks of each world's wind are kept in arrays at a time
+WIND_TRACE_WINDOW = 600
+
+# The telemetry of every world, in the order of TELEMETRY_STRUCT. Each field is an array with a row per world.
+BatchTelemetry = collections.namedtuple("BatchTelemetry", ["timestamp", "recovery_x_error", "wind_vector_x",
+                                                           "wind_vector_y", "recovery_y_error", "lidar_samples"])
+
+
+class BatchZipSimulation():
+    """ Many independent episodes of the sim, advanced together one tick at a time with step(). """
+
+    def __init__(self, seeds, corpus=None, world_generator="rejection", wind_model="walk"):
+        self.seeds = list(seeds)
+        # Pre-generated worlds to load instead of generating them, if there are any (see world_corpus.py)
+        self.corpus = corpus
+        # The name of the generator in WORLD_GENERATORS to generate worlds with
+        self.world_generator = world_generator
+        # How the wind is driven, one of WIND_MODELS
+        self.wind_model = wind_model
+        num_worlds = len(self.seeds)
+        max_num_sites, max_num_trees = WORLD_SIZES[world_generator]
+        # Most lidar objects a world can have: a lidar circle per tree and per delivery site
+        max_num_lidar_objects = max_num_trees + max_num_sites
+
+        # World geometry. Sites, trees and lidar objects are padded out to the most a world of the generator can have,
+        # and rows of lidar objects are sorted along the X axis (padding sorts last) so that the ones in range are a
+        # contiguous span.
+        self.site_x = np.zeros((num_worlds, max_num_sites))
+        self.site_y = np.zeros((num_worlds, max_num_sites))
+        self.num_sites = np.zeros(num_worlds, dtype=np.int64)
+        self.tree_x = np.zeros((num_worlds, max_num_trees))
+        self.tree_y = np.zeros((num_worlds, max_num_trees))
+        self.num_trees = np.zeros(num_worlds, dtype=np.int64)
+        self._lidar_x = np.full((num_worlds, max_num_lidar_objects), np.inf)
+        self._lidar_y = np.zeros((num_worlds, max_num_lidar_objects))
+        self._lidar_radius = np.zeros((num_worlds, max_num_lidar_objects))
+
+        # Vehicle state
+        self.vehicle_x = np.zeros(num_worlds)
+        self.vehicle_y = np.zeros(num_worlds)
+        self.lateral_airspeed = np.zeros(num_worlds)
+        self.was_package_dropped = np.zeros(num_worlds, dtype=bool)
+        self.num_packages = np.zeros(num_worlds, dtype=np.int64)
+        self.loop_count = np.zeros(num_worlds, dtype=np.int64)
+        self.status = np.full(num_worlds, RUNNING, dtype=np.int64)
+
+        # Wind. The gaussian draws of each world's stream are inherently sequential, so each world keeps a Wind
+        # object and its vector is mirrored into arrays once per tick. With wind traces, each world keeps its
+        # WindTrace instead, and a window of it starting at _wind_trace_start is copied into arrays, so that the wind
+        # of every world is looked up at once.
+        self._rngs = [None] * num_worlds
+        self._winds = [None] * num_worlds
+        self.wind_x = np.zeros(num_worlds)
+        self.wind_y = np.zeros(num_worlds)
+        if wind_model == "trace":
+            self._wind_trace_start = np.zeros(num_worlds, dtype=np.int64)
+            self._wind_trace_x = np.zeros((num_worlds, WIND_TRACE_WINDOW))
+            self._wind_trace_y = np.zeros((num_worlds, WIND_TRACE_WINDOW))
+
+        # Dropped packages, in drop order. A world can't drop more packages than it has delivery sites.
+        self.package_x = np.zeros((num_worlds, max_num_sites))
+        self.package_y = np.zeros((num_worlds, max_num_sites))
+        self.package_velocity_x = np.zeros((num_worlds, max_num_sites))
+        self.package_velocity_y = np.zeros((num_worlds, max_num_sites))
+        self.package_fall_duration = np.zeros((num_worlds, max_num_sites))
+        self.num_dropped_packages = np.zeros(num_worlds, dtype=np.int64)
+        # Packages are scored as they land, counting the packages that have landed in each delivery site
+        self.packages_by_site = np.zeros((num_worlds, max_num_sites), dtype=np.int64)
+
+        self.reset_worlds(np.arange(num_worlds))
+
+    @property
+    def num_worlds(self):
+        return len(self.seeds)
+
+    @property
+    def done(self):
+        return self.status != RUNNING
+
+    def reset_worlds(self, worlds, seeds=None):
+        """ Starts new episodes in the given worlds, optionally with new seeds. """
+        worlds = np.atleast_1d(worlds)
+        if seeds is not None:
+            for k, seed in zip(worlds, seeds):
+                self.seeds[k] = seed
+        for k in worlds:
+            world = create_world(self.seeds[k], self.corpus, self.world_generator, self.wind_model)
+            delivery_sites, trees, wind, self._rngs[k] = world
+            self.wind_x[k], self.wind_y[k] = wind.vector
+            if self.wind_model == "trace":
+                # The trace is looked up a window at a time rather than played, so only the trace itself is kept.
+                self._winds[k] = wind._tape
+                self._load_wind_trace(k, 0)
+            else:
+                self._winds[k] = wind
+
+            self.num_sites[k] = len(delivery_sites)
+            self.site_x[k, :len(delivery_sites)] = [s.position[0] for s in delivery_sites]
+            self.site_y[k, :len(delivery_sites)] = [s.position[1] for s in delivery_sites]
+            self.num_trees[k] = len(trees)
+            self.tree_x[k, :len(trees)] = [t.position[0] for t in trees]
+            self.tree_y[k, :len(trees)] = [t.position[1] for t in trees]
+
+            lidar_objects = sorted((o.position[0], o.position[1], o.radius) for o in
+                                   [t.make_lidar_object() for t in trees] +
+                                   [d.make_lidar_object() for d in delivery_sites])
+            self._lidar_x[k] = np.inf
+            self._lidar_y[k] = 0.0
+            self._lidar_radius[k] = 0.0
+            if lidar_objects:
+                self._lidar_x[k, :len(lidar_objects)], self._lidar_y[k, :len(lidar_objects)], \
+                    self._lidar_radius[k, :len(lidar_objects)] = zip(*lidar_objects)
+
+        self.vehicle_x[worlds] = 0.0
+        self.vehicle_y[worlds] = 0.0
+        self.lateral_airspeed[worlds] = 0.0
+        self.was_package_dropped[worlds] = False
+        self.num_packages[worlds] = self.num_sites[worlds]
+        self.loop_count[worlds] = 0
+        self.status[worlds] = RUNNING
+        self.num_dropped_packages[worlds] = 0
+        self.packages_by_site[worlds] = 0
+
+    def reset(self, seeds=None):
+        """ Starts new episodes in every world. Returns the first telemetry. """
+        self.reset_worlds(np.arange(self.num_worlds), seeds)
+        return self.telemetry()
+
+    def telemetry(self):
+        """ Returns the telemetry of every world for the current tick, as a BatchTelemetry of arrays. """
+        return BatchTelemetry((self.loop_count * DT_SEC * 1e3).astype(np.int64) & 0xFFFF,
+                              np.rint(RECOVERY_X - self.vehicle_x).astype(np.int64),
+                              self.wind_x.copy(),
+                              self.wind_y.copy(),
+                              np.rint((-self.vehicle_y + WORLD_WIDTH_HALF) % WORLD_WIDTH -
+                                      WORLD_WIDTH_HALF).astype(np.int64),
+                              self.cast_lidar())
+
+    def cast_lidar(self):
+        """ Returns the lidar samples of every world, with a row per world. """
+        num_worlds = self.num_worlds
+        vehicle_x = self.vehicle_x[:, np.newaxis]
+        # Any point on a circle farther ahead than this is out of lidar range (see LidarEngine)
+        reach = LIDAR_MAX_DISTANCE + 2 + self._lidar_radius.max(initial=0.0)
+        # Each row is sorted, so the objects ahead of the vehicle and in range are a span of each row. The spans of all
+        # the worlds are gathered end to end into flat arrays, so that no work is wasted on padding.
+        start = np.count_nonzero(self._lidar_x <= vehicle_x, axis=1)
+        count = np.count_nonzero(self._lidar_x <= vehicle_x + reach, axis=1) - start
+        first = np.cumsum(count) - count
+        world = np.repeat(np.arange(num_worlds), count)
+        index = start[world] + np.arange(len(world)) - first[world]
+        o_x = self._lidar_x[world, index] - self.vehicle_x[world]
+        o_y = (self._lidar_y[world, index] - self.vehicle_y[world] + WORLD_WIDTH_HALF) % WORLD_WIDTH - WORLD_WIDTH_HALF
+        d, inside = cast_lidar_rays(o_x, o_y, self._lidar_radius[world, index])
+
+        nearest = np.full((num_worlds, len(LIDAR_ANGLES)), np.inf)
+        seen = count > 0
+        if seen.any():
+            nearest[seen] = np.minimum.reduceat(d, first[seen], axis=0)
+        blind = np.zeros(num_worlds, dtype=bool)
+        blind[world[inside]] = True
+        return lidar_samples(nearest, blind[:, np.newaxis])
+
+    def step(self, lateral_airspeed, drop_package_commanded):
+        """ Advances every world that hasn't finished by one tick. Commands for finished worlds are ignored. Returns
+        the telemetry for the next tick. """
+        running = self.status == RUNNING
+        lateral_airspeed = np.clip(np.broadcast_to(np.asarray(lateral_airspeed, dtype=np.float64), running.shape),
+                                   -30.0, 30.0)
+        drop_package_commanded = np.broadcast_to(np.asarray(drop_package_commanded, dtype=bool), running.shape)
+        self.lateral_airspeed[running] = lateral_airspeed[running]
+        self.loop_count[running] += 1
+
+        # Zip.update
+        velocity_x = VEHICLE_AIRSPEED + self.wind_x
+        velocity_y = lateral_airspeed + self.wind_y
+        self.vehicle_x[running] = ((self.vehicle_x + DT_SEC * velocity_x) % WORLD_LENGTH)[running]
+        self.vehicle_y[running] = ((self.vehicle_y + DT_SEC * velocity_y) % WORLD_WIDTH)[running]
+
+        # Check for collisions with trees
+        crashed = running & self._contains(self.tree_x, self.tree_y, self.num_trees, TREE_COLLISION_RADIUS,
+                                           self.vehicle_x[:, np.newaxis], self.vehicle_y[:, np.newaxis]).any(axis=1)
+        self.status[crashed] = CRASHED
+
+        # Package.update
+        dropped = np.arange(self.package_x.shape[1]) < self.num_dropped_packages[:, np.newaxis]
+        falling = dropped & running[:, np.newaxis] & (self.package_fall_duration > 0)
+        dt = np.minimum(DT_SEC, self.package_fall_duration)
+        self.package_fall_duration[falling] -= dt[falling]
+        self.package_x[falling] = ((self.package_x + dt * self.package_velocity_x) % WORLD_LENGTH)[falling]
+        self.package_y[falling] = ((self.package_y + dt * self.package_velocity_y) % WORLD_WIDTH)[falling]
+        landed = falling & (self.package_fall_duration == 0)
+        if landed.any():
+            self._count_landed_packages(*np.nonzero(landed))
+
+        # Drop a package if commanded to, after updating physics (see ZipSimulation.step)
+        drop = running & drop_package_commanded & ~self.was_package_dropped & (self.num_packages > 0)
+        drop_worlds = np.flatnonzero(drop)
+        slots = self.num_dropped_packages[drop_worlds]
+        self.package_x[drop_worlds, slots] = self.vehicle_x[drop_worlds]
+        self.package_y[drop_worlds, slots] = self.vehicle_y[drop_worlds]
+        self.package_velocity_x[drop_worlds, slots] = velocity_x[drop_worlds]
+        self.package_velocity_y[drop_worlds, slots] = velocity_y[drop_worlds]
+        self.package_fall_duration[drop_worlds, slots] = PACKAGE_FALL_SEC
+        self.num_dropped_packages[drop_worlds] += 1
+        self.num_packages[drop_worlds] -= 1
+
+        self.was_package_dropped[running] = drop_package_commanded[running]
+
+        if self.wind_model == "trace":
+            self._update_wind_traces(running)
+        else:
+            for k in np.flatnonzero(running):
+                wind = self._winds[k]
+                wind.update(DT_SEC)
+                self.wind_x[k], self.wind_y[k] = wind.vector
+
+        recovered = running & (self.vehicle_x >= RECOVERY_X)
+        self.status[recovered] = np.where((self.vehicle_y <= RECOVERY_Y_MIN) | (self.vehicle_y >= RECOVERY_Y_MAX),
+                                          RECOVERED, PARALANDED)[recovered]
+
+        return self.telemetry()
+
+    def _count_landed_packages(self, worlds, slots):
+        """ Counts the packages in the given slots of the given worlds, which have just landed, in the delivery sites
+        they landed in. """
+        in_site = self._contains(self.site_x[worlds], self.site_y[worlds], self.num_sites[worlds],
+                                 DELIVERY_SITE_RADIUS, self.package_x[worlds, slots, np.newaxis],
+                                 self.package_y[worlds, slots, np.newaxis])
+        np.add.at(self.packages_by_site, worlds, in_site)
+
+    def _load_wind_trace(self, k, start):
+        """ Copies world k's wind trace into its window, from tick start on. """
+        self._wind_trace_start[k] = start
+        self._wind_trace_x[k], self._wind_trace_y[k] = self._winds[k].vectors(start, start + WIND_TRACE_WINDOW)
+
+    def _update_wind_traces(self, running):
+        """ Looks up the wind of the running worlds for their new tick. """
+        offset = self.loop_count - self._wind_trace_start
+        for k in np.flatnonzero(running & (offset >= WIND_TRACE_WINDOW)):
+            self._load_wind_trace(k, self.loop_count[k])
+            offset[k] = 0
+        worlds = np.flatnonzero(running)
+        self.wind_x[worlds] = self._wind_trace_x[worlds, offset[worlds]]
+        self.wind_y[worlds] = self._wind_trace_y[worlds, offset[worlds]]
+
+    def result(self):
+        """ Returns arrays of the number of deliveries and ZIPAA violations in each world so far, counting packages
+        still falling where they will land. Can be called on any tick. """
+        # Package.landing_position
+        landing_x = (self.package_x + self.package_fall_duration * self.package_velocity_x) % WORLD_LENGTH
+        landing_y = (self.package_y + self.package_fall_duration * self.package_velocity_y) % WORLD_WIDTH
+        dropped = np.arange(self.package_x.shape[1]) < self.num_dropped_packages[:, np.newaxis]
+        falling = dropped & (self.package_fall_duration > 0)
+        # Whether each package still falling (second axis) will land in each delivery site (last axis)
+        delivered = self._contains(self.site_x[:, np.newaxis, :], self.site_y[:, np.newaxis, :],
+                                   self.num_sites[:, np.newaxis], DELIVERY_SITE_RADIUS,
+                                   landing_x[..., np.newaxis], landing_y[..., np.newaxis]) & falling[..., np.newaxis]
+        package_count_by_site = self.packages_by_site + delivered.sum(axis=1)
+        return ((package_count_by_site > 0).sum(axis=1),
+                np.maximum(package_count_by_site - 1, 0).sum(axis=1))
+
+    def run(self, pilot):
+        """ Runs every world until it finishes. The pilot is called with the BatchTelemetry of each tick and returns
+        arrays of (lateral_airspeed, drop_package_commanded). Returns the status, deliveries and ZIPAA violations of
+        each world. """
+        telemetry = self.telemetry()
+        while not self.done.all():
+            telemetry = self.step(*pilot(telemetry))
+        return (self.status.copy(), *self.result())
+
+    @staticmethod
+    def _contains(circle_x, circle_y, num_circles, radius, x, y):
+        """ Circle.contains for padded rows of circles, where only the first num_circles of each row are real. """
+        delta_x = np.abs(circle_x - x)
+        delta_y = np.abs(circle_y - y)
+        delta_x = np.where(delta_x > WORLD_LENGTH_HALF, WORLD_LENGTH - delta_x, delta_x)
+        delta_y = np.where(delta_y > WORLD_WIDTH_HALF, WORLD_WIDTH - delta_y, delta_y)
+        real = np.arange(circle_x.shape[-1]) < num_circles[..., np.newaxis]
+        return (delta_x * delta_x + delta_y * delta_y < radius * radius) & real
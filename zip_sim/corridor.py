@@ -0,0 +1,127 @@
+"""
+An endless version of the sim, for soak testing pilots over flights far longer than the 2000 m world.
+
+The world is split into chunks along the X axis and treated as a ring: the vehicle still wraps around the end of the
+world, but every time it enters a chunk, the chunk two ahead of it is thrown away and generated anew, following on
+from the one before it. The chunk the vehicle is in and the one after it, which is as far as the lidar can see, are
+never touched, and the lidar sees around the end of the world. Delivery sites and trees are placed with
+scatter_positions(), which keeps them clear of the chunk before, so a chunk boundary is never visible. Each new chunk
+also restocks the vehicle with a package per delivery site in it.
+
+Packages are scored as soon as they land and then forgotten, and the recovery point is never reached (the telemetry
+reports it as far away as the API can say), so memory and the cost of a tick stay the same however far the vehicle
+flies. The flight ends after a given number of ticks, judged like reaching the recovery point, or when the vehicle
+crashes.
+
+    python zip_sim.py --headless --corridor 1000000 python my_pilot.py
+"""
+import random
+
+from zip_sim import (WORLD_LENGTH, NUM_DELIVERY_SITES, DELIVERY_SITE_X_BOUNDS, TREE_X_BOUNDS, DeliverySite,
+                     LidarEngine, SpatialIndex, Tree, Wind, WindTrace, ZipSimulation, scatter_positions)
+
+# Long enough that the lidar never sees past the chunk after the vehicle's, and a whole number of them fits the world.
+CHUNK_LENGTH = 400.0
+NUM_CHUNKS = round(WORLD_LENGTH / CHUNK_LENGTH)
+# Chunks are generated this many ahead of the vehicle.
+CHUNKS_AHEAD = 2
+assert NUM_CHUNKS * CHUNK_LENGTH == WORLD_LENGTH and NUM_CHUNKS > CHUNKS_AHEAD + 1
+
+# The recovery X error reported in the telemetry. The most an int16 can hold.
+FAR_AWAY = 0x7FFF
+
+
+class CorridorSimulation(ZipSimulation):
+    """ A sim episode that streams the world in around the vehicle, for as many ticks as asked (forever if None). """
+
+    def __init__(self, seed=None, max_ticks=None, wind_model="walk"):
+        self.max_ticks = max_ticks
+        super().__init__(seed, wind_model=wind_model)
+
+    def _create_world(self):
+        rng = random.Random(self.seed)
+        # Each chunk is generated from its own stream, so that the world doesn't depend on when the vehicle gets there,
+        # and so that snapshots only have to remember how many chunks there have been.
+        self._chunk_seed = rng.getrandbits(64)
+        self._num_chunks_generated = 0
+        wind = Wind(rng)
+        if self.wind_model == "trace":
+            # As in create_world(), the world's own wind is left unused.
+            wind = WindTrace(self.seed).play()
+        # The (delivery sites, trees) of each chunk. The one behind the vehicle stays empty until it comes around.
+        self._chunks = [([], []) for _ in range(NUM_CHUNKS)]
+        self._current_chunk = 0
+        for i in range(CHUNKS_AHEAD + 1):
+            self._generate_chunk(i, first=i == 0)
+        delivery_sites, trees = self._world()
+        return delivery_sites, trees, wind, rng
+
+    def _world(self):
+        """ Returns the delivery sites and trees of all the chunks. """
+        delivery_sites = [s for sites, _ in self._chunks for s in sites]
+        # Trees can overlap, so sort them so they render over each other properly.
+        trees = sorted((t for _, trees in self._chunks for t in trees), key=lambda x: x.position[0], reverse=True)
+        return delivery_sites, trees
+
+    def _generate_chunk(self, index, first=False):
+        start = index * CHUNK_LENGTH
+        if first:
+            # The very first chunk keeps clear of the distribution center, like a normal world.
+            site_x_bounds = (DELIVERY_SITE_X_BOUNDS[0], CHUNK_LENGTH)
+            tree_x_bounds = (TREE_X_BOUNDS[0], CHUNK_LENGTH)
+        else:
+            site_x_bounds = tree_x_bounds = (0.0, CHUNK_LENGTH)
+        # Keep clear of the chunk before, in this chunk's frame.
+        previous_start = ((index - 1) % NUM_CHUNKS) * CHUNK_LENGTH
+        previous_sites, previous_trees = self._chunks[(index - 1) % NUM_CHUNKS]
+        chunk_rng = random.Random((self._chunk_seed << 64) + self._num_chunks_generated)
+        self._num_chunks_generated += 1
+        site_positions, tree_positions = scatter_positions(
+            chunk_rng, CHUNK_LENGTH, NUM_DELIVERY_SITES / WORLD_LENGTH, None, site_x_bounds, tree_x_bounds,
+            [(s.position[0] - previous_start - CHUNK_LENGTH, s.position[1]) for s in previous_sites],
+            [(t.position[0] - previous_start - CHUNK_LENGTH, t.position[1]) for t in previous_trees])
+        self._chunks[index] = ([DeliverySite((start + x, y)) for x, y in site_positions],
+                               [Tree((start + x, y)) for x, y in tree_positions])
+
+    def _index_world(self):
+        # The lidar has to see the chunks at the start of the world coming up when the vehicle nears its end.
+        self.lidar = LidarEngine([t.make_lidar_object() for t in self.trees] +
+                                 [d.make_lidar_object() for d in self.delivery_sites], wrap_x=True)
+        self._tree_index = SpatialIndex(self.trees)
+        self._site_index = SpatialIndex(self.delivery_sites)
+
+    def telemetry(self):
+        timestamp, _, *rest = super().telemetry()
+        return (timestamp, FAR_AWAY, *rest)
+
+    def step(self, lateral_airspeed, drop_package_commanded):
+        telemetry = super().step(lateral_airspeed, drop_package_commanded)
+        # Packages that have landed have already been scored, so they're forgotten.
+        del self.dropped_packages[:self._num_landed_packages]
+        self._num_landed_packages = 0
+
+        chunk = int(self.vehicle.position[0] // CHUNK_LENGTH) % NUM_CHUNKS
+        if chunk != self._current_chunk:
+            self._current_chunk = chunk
+            ahead = (chunk + CHUNKS_AHEAD) % NUM_CHUNKS
+            for s in self._chunks[ahead][0]:
+                self._packages_by_site.pop(s, None)
+            self._generate_chunk(ahead)
+            self.num_packages += len(self._chunks[ahead][0])
+            self.delivery_sites, self.trees = self._world()
+            self._index_world()
+        return telemetry
+
+    def snapshot(self):
+        snapshot = super().snapshot()
+        # The chunks themselves are only ever replaced, never changed, so they're shared too.
+        snapshot.extra = (list(self._chunks), self._current_chunk, self._num_chunks_generated)
+        return snapshot
+
+    def restore(self, snapshot):
+        super().restore(snapshot)
+        chunks, self._current_chunk, self._num_chunks_generated = snapshot.extra
+        self._chunks = list(chunks)
+
+    def _is_finished(self):
+        return self.max_ticks is not None and self.loop_count >= self.max_ticks
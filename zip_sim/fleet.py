@@ -0,0 +1,219 @@
+"""
+Flies several pilots at once in the same world, for comparing pilots under exactly the same conditions.
+
+Every vehicle flies through the same delivery sites and trees, in the same wind, and is scored on its own. The world
+is generated once, and the lidar and collision checks of every vehicle go through the same index of it. Vehicles
+don't interact, so each vehicle's flight is exactly what it would have been flying alone in ZipSimulation(seed).
+
+Each tick, the telemetry is sent to every pilot process before waiting on any of them, and their answers are
+collected in whatever order they come, so the pilots think in parallel.
+
+    python fleet.py --seed 3 --pilot "python my_pilot.py" --pilot "python my_other_pilot.py"
+    python fleet.py --seed 3 --pilot "python my_pilot.py" --pilot-module my_pilot:MyPilot
+"""
+import argparse
+import os
+import selectors
+import shlex
+
+from zip_sim import (DT_SEC, COMMAND_STRUCT, CRASHED, WORLD_GENERATORS, WIND_MODELS, LidarEngine, PilotProcess,
+                     PythonPilot, SpatialIndex, TapedWind, WindTape, ZipSimulation, create_world, load_pilot)
+from tournament import STATUS_NAMES
+
+
+class FleetVehicle(ZipSimulation):
+    """ One vehicle of a fleet. A simulation of its own, except that the world and wind belong to the fleet. """
+
+    def __init__(self, fleet):
+        self._fleet = fleet
+        super().__init__(fleet.seed, wind_model=fleet.wind_model)
+
+    def _create_world(self):
+        fleet = self._fleet
+        return fleet.delivery_sites, fleet.trees, fleet.wind, fleet._rng
+
+    def _index_world(self):
+        self.lidar = self._fleet.lidar
+        self._tree_index = self._fleet._tree_index
+        self._site_index = self._fleet._site_index
+
+    def snapshot(self):
+        raise TypeError("Fleet vehicles share the fleet's wind, so they can't be rewound on their own. Use "
+                        "FleetSimulation.snapshot() instead.")
+
+
+class FleetSnapshot():
+    """ The state of a FleetSimulation at one tick, from FleetSimulation.snapshot(): the fleet's wind, paused on its
+    tape, and a SimulationSnapshot of each vehicle. """
+    __slots__ = ["seed", "wind", "vehicles", "loop_count"]
+
+
+class FleetSimulation():
+    """ Several vehicles flying the same world in the same wind, advanced together one tick at a time with step(). """
+
+    def __init__(self, seed=None, num_vehicles=2, corpus=None, world_generator="rejection", wind_model="walk"):
+        self.seed = seed
+        self.num_vehicles = num_vehicles
+        self.corpus = corpus
+        self.world_generator = world_generator
+        self.wind_model = wind_model
+        self.reset()
+
+    def reset(self, seed=None):
+        """ Starts a new episode for every vehicle, regenerating the world from the seed. Returns the first telemetry
+        of every vehicle. """
+        if seed is not None:
+            self.seed = seed
+        self.delivery_sites, self.trees, self.wind, self._rng = create_world(self.seed, self.corpus,
+                                                                             self.world_generator, self.wind_model)
+        self.lidar = LidarEngine([t.make_lidar_object() for t in self.trees] +
+                                 [d.make_lidar_object() for d in self.delivery_sites])
+        self._tree_index = SpatialIndex(self.trees)
+        self._site_index = SpatialIndex(self.delivery_sites)
+        self.vehicles = [FleetVehicle(self) for _ in range(self.num_vehicles)]
+        self.loop_count = 0
+        return self.telemetry()
+
+    @property
+    def done(self):
+        return all(v.status is not None for v in self.vehicles)
+
+    def telemetry(self):
+        """ Returns the telemetry tuple of every vehicle, or None for the vehicles that have finished. """
+        return [v.telemetry() if v.status is None else None for v in self.vehicles]
+
+    def step(self, commands):
+        """ Advances every vehicle that's still flying by one tick. commands holds the (lateral_airspeed,
+        drop_package_commanded) of each vehicle, or None if its pilot has exited. Returns the telemetry of every
+        vehicle for the next tick. """
+        self.loop_count += 1
+        for vehicle, cmd in zip(self.vehicles, commands):
+            if vehicle.status is not None:
+                continue
+            if cmd is None:
+                vehicle.status = CRASHED  # The pilot process must have exited
+                continue
+            vehicle.fly(*cmd)
+        # The wind only moves on once every vehicle has flown through it.
+        self.wind.update(DT_SEC)
+        return self.telemetry()
+
+    def result(self):
+        """ Returns the (deliveries, ZIPAA violations) of every vehicle. """
+        return [v.result() for v in self.vehicles]
+
+    def snapshot(self):
+        """ Returns a FleetSnapshot of every vehicle as it is now, that restore() can return to any number of times. """
+        if not isinstance(self.wind, TapedWind):
+            # Put the wind on tape, as ZipSimulation.snapshot() would, but once for every vehicle.
+            self.wind = WindTape(self.wind).play()
+            for vehicle in self.vehicles:
+                vehicle.wind = self.wind
+        snapshot = FleetSnapshot()
+        snapshot.seed = self.seed
+        snapshot.wind = self.wind._tape.play(self.wind._tick)
+        snapshot.vehicles = [ZipSimulation.snapshot(v) for v in self.vehicles]
+        snapshot.loop_count = self.loop_count
+        return snapshot
+
+    def restore(self, snapshot):
+        """ Puts every vehicle back the way it was when the snapshot was taken. """
+        self.seed = snapshot.seed
+        for vehicle, vehicle_snapshot in zip(self.vehicles, snapshot.vehicles):
+            vehicle.restore(vehicle_snapshot)
+        # Each vehicle restored a wind of its own, so share one again.
+        self.wind = snapshot.wind._tape.play(snapshot.wind._tick)
+        for vehicle in self.vehicles:
+            vehicle.wind = self.wind
+        self.loop_count = snapshot.loop_count
+
+
+class FleetPilots():
+    """ The pilots of a fleet. Asks every pilot process for its command before waiting for any of the answers. Pilots
+    that don't run in a process of their own (Python pilots) are simply asked in turn. """
+
+    def __init__(self, pilots):
+        self.pilots = pilots
+        self._selector = selectors.DefaultSelector()
+        for i, p in enumerate(pilots):
+            if isinstance(p, PilotProcess):
+                self._selector.register(p.fileno(), selectors.EVENT_READ, i)
+
+    def command(self, telemetry):
+        """ Takes the telemetry of every vehicle (None for the ones that have finished). Returns the command of every
+        vehicle, with None for the vehicles that have finished or whose pilot has exited. """
+        commands = [None] * len(self.pilots)
+        pending = {}
+        for i, (pilot, t) in enumerate(zip(self.pilots, telemetry)):
+            if t is None:
+                continue
+            if isinstance(pilot, PilotProcess):
+                if pilot.send(t):
+                    pending[i] = b""
+            else:
+                commands[i] = pilot.command(t)
+
+        while pending:
+            for key, _ in self._selector.select():
+                i = key.data
+                if i not in pending:
+                    continue
+                data = os.read(key.fd, COMMAND_STRUCT.size - len(pending[i]))
+                if not data:
+                    del pending[i]  # The pilot exited
+                    continue
+                pending[i] += data
+                if len(pending[i]) == COMMAND_STRUCT.size:
+                    lateral_airspeed, drop_package_commanded_byte, _ = COMMAND_STRUCT.unpack(pending.pop(i))
+                    commands[i] = (lateral_airspeed, bool(drop_package_commanded_byte))
+        return commands
+
+    def close(self):
+        self._selector.close()
+        for p in self.pilots:
+            p.close()
+
+
+def run_fleet(fleet, pilots):
+    """ Runs the fleet until every vehicle has finished. """
+    telemetry = fleet.telemetry()
+    while not fleet.done:
+        telemetry = fleet.step(pilots.command(telemetry))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flies several Zip Sim pilots in the same world")
+    parser.add_argument('--pilot', action="append", default=[], metavar="COMMAND",
+                        help='A pilot process to run, as a shell-style command line. May be given more than once.')
+    parser.add_argument('--pilot-module', action="append", default=[], metavar="MODULE[:NAME]",
+                        help='A Python pilot to run in-process (see zip_sim.load_pilot). May be given more than once.')
+    parser.add_argument('--seed', type=int, help='Seed to use for random number generation')
+    parser.add_argument('--world-corpus', metavar="FILE",
+                        help='Load the world for the seed from a file of pre-generated worlds (see world_corpus.py)')
+    parser.add_argument('--world-generator', choices=sorted(WORLD_GENERATORS), default="rejection",
+                        help='How to generate the world (see zip_sim.WORLD_GENERATORS)')
+    parser.add_argument('--wind', choices=WIND_MODELS, default="walk",
+                        help='How to drive the wind (see zip_sim.WIND_MODELS)')
+    args = parser.parse_args()
+
+    names = args.pilot + args.pilot_module
+    if not names:
+        parser.error("give at least one --pilot or --pilot-module")
+    pilots = FleetPilots([PilotProcess(shlex.split(p)) for p in args.pilot] +
+                         [PythonPilot(load_pilot(m)) for m in args.pilot_module])
+    corpus = None
+    if args.world_corpus:
+        from world_corpus import load_corpus
+        corpus = load_corpus(args.world_corpus)
+
+    fleet = FleetSimulation(args.seed, len(names), corpus, args.world_generator, args.wind)
+    run_fleet(fleet, pilots)
+    pilots.close()
+
+    for name, vehicle, (deliveries, zipaa_violations) in zip(names, fleet.vehicles, fleet.result()):
+        print("{}: {}, Deliveries: {}, ZIPAA Violations: {}, Ticks: {}".format(
+            name, STATUS_NAMES[vehicle.status], deliveries, zipaa_violations, vehicle.loop_count))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,19 @@
-import sys
-k = 0
-try:
-   for line in sys.stdin:
-      k = k + 1
-      print(line)
-except:
-   sys.stdout.flush()
-   pass
-print(k)
-    
 """
-def auto(timestamp, recovery_x_error, wind_vector_x, wind_vector_y, recovery_y_error):
-	lateral_airspeed = 0
-	drop_package = 0
-	padding[3]
-	return lateral_airspeed, drop_package
+A starting point for a pilot, built on pilot_sdk.py. It only flies a straight line against the crosswind.
+
+    python zip_sim.py python my_pilot.py
+    python zip_sim.py --pilot-module my_pilot:MyPilot
 """
+from pilot_sdk import Pilot
+
+
+class MyPilot(Pilot):
+
+    def on_telemetry(self, telemetry):
+        lateral_airspeed = -telemetry.wind_vector_y
+        drop_package_commanded = False
+        return lateral_airspeed, drop_package_commanded
+
+
+if __name__ == "__main__":
+    MyPilot().run()
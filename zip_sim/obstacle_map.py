@@ -0,0 +1,238 @@
+"""
+A pilot-side map of the trees and delivery sites the lidar has seen, kept up to date tick by tick, so that a pilot
+doesn't have to make sense of the world from a single lidar sweep every tick.
+
+The vehicle's position is dead reckoned from the wind in the telemetry and the lateral airspeed the pilot commanded,
+exactly like the sim moves it, and nudged back within rounding of the recovery errors in the telemetry when they
+disagree. Positions are along-track (meters flown, which never wraps) and lateral (world Y, which wraps).
+
+Each lidar sweep is split into blobs of neighbouring rays that hit the same thing, and each blob is matched to an
+object already on the map or added as a new one. A tree (lidar radius 3 m) is much wider than a delivery site's
+marker (0.5 m), so how many rays a blob spans at its range tells them apart, once the vehicle is close enough. Until
+then an object is of unknown kind, and treated as a tree by anything looking for obstacles. Objects are averaged over
+every sighting, weighting closer ones more, and dropped once the vehicle has passed them.
+
+    obstacles = ObstacleMap()
+
+    def on_telemetry(self, telemetry):
+        obstacles.update(telemetry)
+        ahead = obstacles.nearest_obstacle(half_width=3.0)
+        ...
+        obstacles.commanded(lateral_airspeed)
+        return lateral_airspeed, drop_package_commanded
+"""
+import array
+import math
+
+from zip_sim import (DT_SEC, WORLD_WIDTH, WORLD_WIDTH_HALF, RECOVERY_X, VEHICLE_AIRSPEED, PACKAGE_FALL_SEC,
+                     LIDAR_ANGLES, TREE_COLLISION_RADIUS, TREE_LIDAR_RADIUS, DELIVERY_SITE_LIDAR_RADIUS)
+
+UNKNOWN = 0
+TREE = 1
+DELIVERY_SITE = 2
+LIDAR_RADIUS = {UNKNOWN: DELIVERY_SITE_LIDAR_RADIUS, TREE: TREE_LIDAR_RADIUS, DELIVERY_SITE: DELIVERY_SITE_LIDAR_RADIUS}
+
+# Most objects the map holds at once. The lidar sees 255 m ahead, which holds a few dozen trees at the most.
+MAX_OBJECTS = 64
+# Neighbouring rays whose ranges differ by more than this hit different objects
+BLOB_SPLIT_M = 2.0 * TREE_LIDAR_RADIUS
+# A sighting is matched to an object this close to it, plus the spacing of the rays at the sighting's range
+MATCH_DISTANCE_M = 4.0
+# Objects are dropped once they're this far behind the vehicle
+BEHIND_M = 10.0
+# Sightings at this range count half as much as ones right next to the vehicle
+HALF_WEIGHT_RANGE_M = 50.0
+
+RAY_SPACING = LIDAR_ANGLES[1] - LIDAR_ANGLES[0]
+
+
+def wrap_lateral(delta):
+    """ Wraps a lateral distance to between -WORLD_WIDTH_HALF and WORLD_WIDTH_HALF. """
+    return (delta + WORLD_WIDTH_HALF) % WORLD_WIDTH - WORLD_WIDTH_HALF
+
+
+class ObstacleMap():
+    """ The objects seen so far, in flat arrays with a slot per object. There are only ever a few dozen objects in
+    view, so the queries are plain loops over the slots in use, which is quicker than NumPy at this size. """
+
+    def __init__(self):
+        self.x = array.array("d", bytes(8 * MAX_OBJECTS))
+        self.y = array.array("d", bytes(8 * MAX_OBJECTS))
+        self.kind = array.array("b", bytes(MAX_OBJECTS))
+        self.weight = array.array("d", bytes(8 * MAX_OBJECTS))
+        # Delivery sites the pilot has dropped a package on
+        self.served = array.array("b", bytes(MAX_OBJECTS))
+        # The slots in use, and the ones that aren't
+        self.slots = []
+        self._free = list(range(MAX_OBJECTS - 1, -1, -1))
+        # The vehicle's along-track and lateral position, and what it will fly with until the next tick
+        self.vehicle_x = 0.0
+        self.vehicle_y = 0.0
+        self.lateral_airspeed = 0.0
+        self.wind_x = 0.0
+        self.wind_y = 0.0
+        self._started = False
+
+    def update(self, telemetry):
+        """ Moves the vehicle on by a tick and adds the telemetry's lidar sweep to the map. """
+        if self._started:
+            self.vehicle_x += DT_SEC * (VEHICLE_AIRSPEED + self.wind_x)
+            self.vehicle_y = (self.vehicle_y + DT_SEC * (self.lateral_airspeed + self.wind_y)) % WORLD_WIDTH
+        self._started = True
+        self.wind_x = telemetry.wind_vector_x
+        self.wind_y = telemetry.wind_vector_y
+        self._fix_position(telemetry.recovery_x_error, telemetry.recovery_y_error)
+
+        behind = self.vehicle_x - BEHIND_M
+        x = self.x
+        if any(x[i] <= behind for i in self.slots):
+            self._free.extend(i for i in self.slots if x[i] <= behind)
+            self.slots = [i for i in self.slots if x[i] > behind]
+        samples = telemetry.lidar_samples
+        for first, last in self._blobs(samples):
+            self._sighting(samples, first, last)
+
+    def commanded(self, lateral_airspeed):
+        """ Tells the map the lateral airspeed the pilot answered with, for dead reckoning the next tick. """
+        self.lateral_airspeed = max(-30.0, min(30.0, lateral_airspeed))
+
+    def _fix_position(self, recovery_x_error, recovery_y_error):
+        # The recovery errors are the position rounded to the meter. The X one is only of use while the vehicle is
+        # still on its first lap of the world, which is when it's within a meter of the dead reckoned position.
+        fix_x = RECOVERY_X - recovery_x_error
+        if abs(fix_x - self.vehicle_x) < 1.0:
+            self.vehicle_x = max(fix_x - 0.5, min(fix_x + 0.5, self.vehicle_x))
+        error_y = wrap_lateral(self.vehicle_y + recovery_y_error)
+        if abs(error_y) > 0.5:
+            self.vehicle_y = (self.vehicle_y - error_y + math.copysign(0.5, error_y)) % WORLD_WIDTH
+
+    @staticmethod
+    def _blobs(samples):
+        """ Yields the (first, last) rays of each run of neighbouring rays that hit the same object. """
+        first = None
+        previous = 0
+        for i, sample in enumerate(samples):
+            if first is not None and (sample == 0 or abs(sample - previous) > BLOB_SPLIT_M):
+                yield first, i - 1
+                first = None
+            if sample != 0 and first is None:
+                first = i
+            previous = sample
+        if first is not None:
+            yield first, len(samples) - 1
+
+    def _sighting(self, samples, first, last):
+        """ Adds the blob of rays from first to last to the map. """
+        # The closest ray is the one nearest the middle of the object, and the object's center is a radius further
+        # on along the middle ray.
+        distance = min(samples[first:last + 1])
+        ray_spacing_m = distance * RAY_SPACING
+        if (last - first) * ray_spacing_m > 2.0 * DELIVERY_SITE_LIDAR_RADIUS:
+            kind = TREE
+        elif (last - first + 1 < math.floor(2.0 * TREE_LIDAR_RADIUS / ray_spacing_m) and
+              self._clear(samples, first - 1, distance) and self._clear(samples, last + 1, distance)):
+            # A tree this close would have spanned more rays, unless the view of it was cut short.
+            kind = DELIVERY_SITE
+        else:
+            kind = UNKNOWN
+        angle = LIDAR_ANGLES[0] + (first + last) / 2.0 * RAY_SPACING
+        reach = distance + LIDAR_RADIUS[kind]
+        x = self.vehicle_x + reach * math.cos(angle)
+        y = (self.vehicle_y + reach * math.sin(angle)) % WORLD_WIDTH
+        weight = 1.0 / (1.0 + distance / HALF_WEIGHT_RANGE_M)
+
+        index = self._match(x, y, MATCH_DISTANCE_M + ray_spacing_m)
+        if index is None:
+            index = self._free_slot()
+            self.x[index] = x
+            self.y[index] = y
+            self.kind[index] = kind
+            self.weight[index] = weight
+            self.served[index] = False
+            return
+
+        old_kind = self.kind[index]
+        if old_kind != kind and old_kind != TREE and kind != UNKNOWN:
+            # Better known now. Trees stay trees, to be safe.
+            self.x[index] += LIDAR_RADIUS[kind] - LIDAR_RADIUS[old_kind]
+            self.kind[index] = kind
+        elif kind != old_kind:
+            # Seen with the radius of the wrong kind of object
+            x += LIDAR_RADIUS[old_kind] - LIDAR_RADIUS[kind]
+        total = self.weight[index] + weight
+        self.x[index] += (x - self.x[index]) * weight / total
+        self.y[index] = (self.y[index] + wrap_lateral(y - self.y[index]) * weight / total) % WORLD_WIDTH
+        self.weight[index] = total
+
+    @staticmethod
+    def _clear(samples, ray, distance):
+        """ Returns whether a ray beside a blob shows that nothing hid the rest of the blob's object from view. """
+        return 0 <= ray < len(samples) and (samples[ray] == 0 or samples[ray] > distance)
+
+    def _match(self, x, y, distance):
+        """ Returns the slot of the object nearest (x, y) within distance, or None. """
+        best = None
+        best_distance_squared = distance * distance
+        for i in self.slots:
+            delta_x = self.x[i] - x
+            if abs(delta_x) >= distance:
+                continue
+            delta_y = (self.y[i] - y + WORLD_WIDTH_HALF) % WORLD_WIDTH - WORLD_WIDTH_HALF
+            distance_squared = delta_x * delta_x + delta_y * delta_y
+            if distance_squared < best_distance_squared:
+                best = i
+                best_distance_squared = distance_squared
+        return best
+
+    def _free_slot(self):
+        if not self._free:
+            # Full, so forget the object seen least
+            forgotten = min(self.slots, key=self.weight.__getitem__)
+            self.slots.remove(forgotten)
+            self._free.append(forgotten)
+        index = self._free.pop()
+        self.slots.append(index)
+        return index
+
+    def nearest_obstacle(self, half_width, lateral_offset=0.0):
+        """ Returns the (along-track distance, lateral offset) from the vehicle of the nearest tree ahead that would
+        be hit flying straight along a corridor of the given half width, centered lateral_offset from the vehicle.
+        Objects of unknown kind count as trees. Returns None if the corridor is clear as far as the lidar has seen. """
+        reach = half_width + TREE_COLLISION_RADIUS
+        nearest = None
+        for i in self.slots:
+            if self.kind[i] == DELIVERY_SITE:
+                continue
+            delta_x = self.x[i] - self.vehicle_x
+            if delta_x <= -TREE_COLLISION_RADIUS or (nearest is not None and delta_x >= nearest[0]):
+                continue
+            delta_y = (self.y[i] - self.vehicle_y + WORLD_WIDTH_HALF) % WORLD_WIDTH - WORLD_WIDTH_HALF
+            if abs(delta_y - lateral_offset) < reach:
+                nearest = (delta_x, delta_y)
+        return nearest
+
+    def drop_point(self):
+        """ Returns when to drop a package on the nearest delivery site ahead that hasn't been served, flying on with
+        the last commanded lateral airspeed: (ticks until the drop, how far off to the side the package would land,
+        the site's slot). Dropping is due when the ticks are 0. Returns None if there's no such site on the map. """
+        velocity_x = VEHICLE_AIRSPEED + self.wind_x
+        velocity_y = self.lateral_airspeed + self.wind_y
+        best = None
+        best_seconds = math.inf
+        for i in self.slots:
+            if self.kind[i] != DELIVERY_SITE or self.served[i]:
+                continue
+            # A package is let go after the vehicle's next move, and carries on with the vehicle's velocity until it
+            # lands.
+            seconds = (self.x[i] - self.vehicle_x) / velocity_x - PACKAGE_FALL_SEC - DT_SEC
+            if 0.0 <= seconds < best_seconds:
+                best = i
+                best_seconds = seconds
+        if best is None:
+            return None
+        landing_y = self.vehicle_y + (best_seconds + DT_SEC + PACKAGE_FALL_SEC) * velocity_y
+        return int(best_seconds / DT_SEC), wrap_lateral(landing_y - self.y[best]), best
+
+    def mark_served(self, index):
+        """ Marks the delivery site in a slot as having had a package dropped on it. """
+        self.served[index] = True
@@ -0,0 +1,301 @@
+"""
+Plans the best flight through a seed's world knowing everything about it in advance: where every tree and delivery
+site is, and how the wind will blow on every tick. The number of deliveries it plans is the most any pilot could make
+in that world (to within the resolution of the plan), for normalizing pilot scores across many worlds.
+
+The vehicle's along-track position only depends on the wind, so the whole problem is where to be laterally on each
+tick, and when to drop. The lateral positions are a lattice, in the frame that drifts with the wind, that the vehicle
+moves between at exact multiples of the lateral airspeed. A dynamic program runs backwards over the ticks, one NumPy
+layer of the lattice at a time, keeping for each position the most deliveries still to be made from it: trees are
+cells the vehicle can't be in, and dropping on the tick before a package would land on a delivery site scores one.
+Delivery sites are far apart, so there's usually only one in reach at a time, and the only other thing a position
+needs to know is whether that site has already been delivered to.
+
+    python oracle.py --seeds 0 1000 --results oracle.jsonl
+    python oracle.py --seeds 0 1000 --results oracle.jsonl --pilot-results my_pilot.jsonl
+
+With --check, every plan is also flown through the sim, to make sure it delivers what it promised.
+"""
+import argparse
+import multiprocessing
+import os
+import json
+import statistics
+
+import numpy as np
+
+from zip_sim import (DT_SEC, WORLD_WIDTH, WORLD_WIDTH_HALF, RECOVERY_X, RECOVERY_Y_MIN, RECOVERY_Y_MAX,
+                     VEHICLE_AIRSPEED, PACKAGE_FALL_SEC, DELIVERY_SITE_RADIUS, TREE_COLLISION_RADIUS, RECOVERED,
+                     PARALANDED, CRASHED, WORLD_GENERATORS, WIND_MODELS, ZipSimulation, create_world)
+from tournament import STATUS_NAMES, load_results, results_end_with_newline
+
+MAX_LATERAL_AIRSPEED = 30.0
+# How many lattice cells the vehicle can move across in a tick at full lateral airspeed. 2 is a lattice 0.25 m apart,
+# flown at -30, -15, 0, 15 or 30 m/s.
+LATTICE_STEPS = 2
+# Being recovered is worth less than a delivery, so it only decides between plans that deliver as much
+RECOVERY_VALUE = 0.5
+# The value of crashing, which is worse than anything else
+CRASHED_VALUE = -1000.0
+# Plans keep this far clear of the edges of trees and delivery sites, for the rounding of flying them
+MARGIN_M = 1e-6
+
+
+class Plan():
+    """ The commands to fly a world with, and what they'll come to. """
+    __slots__ = ["seed", "commands", "deliveries", "status", "num_delivery_sites"]
+
+    def __init__(self, seed, commands, deliveries, status, num_delivery_sites):
+        self.seed = seed
+        # A (lateral_airspeed, drop_package_commanded) per tick
+        self.commands = commands
+        self.deliveries = deliveries
+        self.status = status
+        self.num_delivery_sites = num_delivery_sites
+
+
+def wind_trace(wind):
+    """ Flies the along-track position of the vehicle to the recovery point, which only depends on the wind, updating
+    the wind as the sim does. Returns the wind (x, y) on every tick and the vehicle's X after every tick's move, as
+    arrays. """
+    wind_x = []
+    wind_y = []
+    vehicle_x = []
+    x = 0.0
+    while True:
+        w_x, w_y = wind.vector
+        wind_x.append(w_x)
+        wind_y.append(w_y)
+        x = x + DT_SEC * (VEHICLE_AIRSPEED + w_x)
+        vehicle_x.append(x)
+        if x >= RECOVERY_X:
+            return np.array(wind_x), np.array(wind_y), np.array(vehicle_x)
+        wind.update(DT_SEC)
+
+
+def plan(seed, corpus=None, world_generator="rejection", lattice_steps=LATTICE_STEPS, wind_model="walk"):
+    """ Returns the Plan that makes the most deliveries in the seed's world without crashing or ZIPAA violations,
+    and is recovered if that doesn't cost a delivery. """
+    delivery_sites, trees, wind, _ = create_world(seed, corpus, world_generator, wind_model)
+    wind_x, wind_y, vehicle_x = wind_trace(wind)
+    num_ticks = len(vehicle_x)
+
+    num_cells = round(WORLD_WIDTH / (MAX_LATERAL_AIRSPEED * DT_SEC / lattice_steps))
+    cells = np.arange(num_cells)
+    lattice_y = cells * (WORLD_WIDTH / num_cells)
+    # The lattice steps a tick can take, straight ahead first so that it's preferred when nothing else matters
+    steps = np.array(sorted(range(-lattice_steps, lattice_steps + 1), key=abs))
+    lateral_airspeeds = steps * (MAX_LATERAL_AIRSPEED / lattice_steps)
+    # The cell each step from each cell goes to
+    targets = (cells[None, :] + steps[:, None]) % num_cells
+    # How far the wind has carried the lattice by the start of every tick
+    drift = np.concatenate(([0.0], np.cumsum(DT_SEC * wind_y)))
+
+    # The lattice cells inside a tree after every tick's move
+    blocked = {}
+    for tree in trees:
+        tree_x, tree_y = tree.position
+        for tick in np.flatnonzero(np.abs(vehicle_x - tree_x) < TREE_COLLISION_RADIUS + MARGIN_M):
+            delta_y = _wrap(lattice_y + drift[tick + 1] - tree_y)
+            inside = (vehicle_x[tick] - tree_x) ** 2 + delta_y ** 2 < (TREE_COLLISION_RADIUS + MARGIN_M) ** 2
+            blocked[tick] = blocked[tick] | inside if tick in blocked else inside
+
+    # The ticks a package dropped on could land on each delivery site. Sites in reach on the same or neighbouring
+    # ticks are planned together, as a group, which is one site at a time unless sites are close across the wrap.
+    landing_x = vehicle_x + PACKAGE_FALL_SEC * (VEHICLE_AIRSPEED + wind_x)
+    windows = []
+    for i, site in enumerate(delivery_sites):
+        ticks = np.flatnonzero(np.abs(landing_x - site.position[0]) < DELIVERY_SITE_RADIUS)
+        if len(ticks):
+            windows.append((ticks[0], ticks[-1], i))
+    groups = []
+    for first, last, i in sorted(windows):
+        if groups and first <= groups[-1][1] + 1:
+            groups[-1][1] = max(groups[-1][1], last)
+            groups[-1][2].append(i)
+        else:
+            groups.append([first, last, [i]])
+    group_of_tick = np.full(num_ticks + 1, -1)
+    for group, (first, last, _) in enumerate(groups):
+        group_of_tick[first:last + 1] = group
+
+    def hits(tick, sites):
+        """ Returns a bit per site in the group, set where a package dropped on the tick lands on it, by step and
+        cell. """
+        landing_y = (lattice_y[targets] + drift[tick + 1] +
+                     PACKAGE_FALL_SEC * (lateral_airspeeds[:, None] + wind_y[tick]))
+        site_bits = np.zeros(targets.shape, dtype=int)
+        for bit, site in enumerate(sites):
+            site_x, site_y = delivery_sites[site].position
+            site_bits |= ((landing_x[tick] - site_x) ** 2 + _wrap(landing_y - site_y) ** 2 <
+                          (DELIVERY_SITE_RADIUS - MARGIN_M) ** 2) << bit
+        return site_bits
+
+    # While a group is in reach, the state of a cell is which of the group's sites have been delivered to, a bit
+    # each, and whether a package was just dropped, in the bit above them, since the next tick can't drop another.
+    max_states = max([2 ** (len(sites) + 1) for _, _, sites in groups], default=1)
+    # The best choice in every state of every cell on every tick, as step index * 2 + drop
+    choices = np.empty((num_ticks, max_states, num_cells), dtype=np.int8)
+    # The best value in every state of every cell at the start of the next tick
+    final_y = (lattice_y + drift[num_ticks]) % WORLD_WIDTH
+    value = np.where((final_y <= RECOVERY_Y_MIN) | (final_y >= RECOVERY_Y_MAX), RECOVERY_VALUE, 0.0)[None, :]
+    for tick in range(num_ticks - 1, -1, -1):
+        if tick in blocked:
+            value = np.where(blocked[tick], CRASHED_VALUE, value)
+        group = group_of_tick[tick]
+        if group != group_of_tick[tick + 1]:
+            # The next tick starts afresh, with nothing delivered in its own group yet
+            value = value[:1]
+        if group < 0:
+            straight_on = value[0][targets]
+            choices[tick, 0] = np.argmax(straight_on, axis=0) * 2
+            value = straight_on.max(axis=0)[None, :]
+            continue
+
+        sites = groups[group][2]
+        just_dropped = 2 ** len(sites)
+        states = np.arange(2 * just_dropped)
+        if len(value) < len(states):
+            value = np.repeat(value, len(states), axis=0)
+        straight_on = value[states & (just_dropped - 1)][:, targets]
+        site_bits = hits(tick, sites)[None, :, :]
+        can_drop = (site_bits != 0) & (site_bits & states[:, None, None] == 0) & (states < just_dropped)[:, None, None]
+        dropped_to = states[:, None, None] | site_bits | just_dropped
+        num_bits = np.array([bin(bits).count("1") for bits in range(just_dropped)])
+        dropping = np.where(can_drop, value[dropped_to, targets] + num_bits[site_bits], CRASHED_VALUE)
+        both = np.stack([straight_on, dropping], axis=2).reshape(len(states), 2 * len(steps), num_cells)
+        choices[tick, :len(states)] = np.argmax(both, axis=1)
+        value = both.max(axis=1)
+
+    # Follow the choices forward from the start, at Y 0 with no drift
+    cell = 0
+    state = 0
+    deliveries = 0
+    commands = []
+    status = None
+    for tick in range(num_ticks):
+        choice = choices[tick, state, cell]
+        step = choice // 2
+        drop = bool(choice % 2)
+        commands.append((float(lateral_airspeeds[step]), drop))
+        group = group_of_tick[tick]
+        if group >= 0:
+            sites = groups[group][2]
+            just_dropped = 2 ** len(sites)
+            state &= just_dropped - 1
+            if drop:
+                site_bits = hits(tick, sites)[step, cell]
+                deliveries += bin(site_bits).count("1")
+                state |= site_bits | just_dropped
+        cell = targets[step, cell]
+        if tick in blocked and blocked[tick][cell]:
+            status = CRASHED
+            break
+        if group_of_tick[tick + 1] != group:
+            state = 0
+    if status is None:
+        status = RECOVERED if final_y[cell] <= RECOVERY_Y_MIN or final_y[cell] >= RECOVERY_Y_MAX else PARALANDED
+    return Plan(seed, commands, deliveries, status, len(delivery_sites))
+
+
+def _wrap(delta_y):
+    """ Wraps lateral distances to between -WORLD_WIDTH_HALF and WORLD_WIDTH_HALF. """
+    return (delta_y + WORLD_WIDTH_HALF) % WORLD_WIDTH - WORLD_WIDTH_HALF
+
+
+def fly_plan(plan, corpus=None, world_generator="rejection", wind_model="walk"):
+    """ Flies a Plan through the sim. Returns the sim at the end of the episode. """
+    sim = ZipSimulation(plan.seed, corpus, world_generator, wind_model)
+    for lateral_airspeed, drop_package_commanded in plan.commands:
+        if sim.status is not None:
+            break
+        sim.step(lateral_airspeed, drop_package_commanded)
+    return sim
+
+
+def plan_seed(seed, world_corpus=None, world_generator="rejection", lattice_steps=LATTICE_STEPS, check=False,
+              wind_model="walk"):
+    """ Plans one seed's world. Returns the plan's outcome as a dictionary, in the same form as a tournament
+    result. """
+    corpus = None
+    if world_corpus:
+        from world_corpus import load_corpus
+        corpus = load_corpus(world_corpus)
+    best = plan(seed, corpus, world_generator, lattice_steps, wind_model)
+    result = {"seed": seed,
+              "status": STATUS_NAMES[best.status],
+              "deliveries": best.deliveries,
+              "num_delivery_sites": best.num_delivery_sites,
+              "ticks": len(best.commands)}
+    if check:
+        sim = fly_plan(best, corpus, world_generator, wind_model)
+        deliveries, zipaa_violations = sim.result()
+        if (sim.status, deliveries, zipaa_violations) != (best.status, best.deliveries, 0):
+            raise RuntimeError("Seed {}'s plan was {} with {} deliveries, but flew {} with {} deliveries and {} ZIPAA "
+                               "violations".format(seed, result["status"], best.deliveries,
+                                                   STATUS_NAMES[sim.status], deliveries, zipaa_violations))
+    return result
+
+
+def _plan_seed_star(args):
+    return plan_seed(*args)
+
+
+def normalize(pilot_results, oracle_results):
+    """ Returns each seed's deliveries in pilot_results as a fraction of the most that could be made there, by seed,
+    for the seeds in both. Seeds where no delivery could be made are left out. """
+    best = {r["seed"]: r["deliveries"] for r in oracle_results}
+    return {r["seed"]: r["deliveries"] / best[r["seed"]] for r in pilot_results if best.get(r["seed"])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plans the best flight through Zip Sim worlds")
+    parser.add_argument('--seeds', type=int, nargs=2, metavar=("START", "STOP"), required=True,
+                        help='Plan every seed from START up to (but not including) STOP')
+    parser.add_argument('--results', required=True, help='File to append per-seed results to, as lines of JSON')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        help='Number of seeds to plan at once (defaults to the number of CPUs)')
+    parser.add_argument('--lattice-steps', type=int, default=LATTICE_STEPS,
+                        help='Lattice cells crossed per tick at full lateral airspeed. More is finer and slower.')
+    parser.add_argument('--check', action='store_true', help='Fly every plan through the sim to check it')
+    parser.add_argument('--pilot-results', metavar="FILE",
+                        help="A tournament's results file to score against the plans, as a fraction of their "
+                             "deliveries")
+    parser.add_argument('--world-corpus', metavar="FILE",
+                        help='Load worlds from a file of pre-generated worlds (see world_corpus.py)')
+    parser.add_argument('--world-generator', choices=sorted(WORLD_GENERATORS), default="rejection",
+                        help='How to generate worlds (see zip_sim.WORLD_GENERATORS)')
+    parser.add_argument('--wind', choices=WIND_MODELS, default="walk",
+                        help='How to drive the wind (see zip_sim.WIND_MODELS)')
+    args = parser.parse_args()
+
+    results = load_results(args.results)
+    done = {r["seed"] for r in results}
+    seeds = [seed for seed in range(*args.seeds) if seed not in done]
+
+    with open(args.results, "a") as f, multiprocessing.Pool(args.jobs) as pool:
+        if f.tell() > 0 and not results_end_with_newline(args.results):
+            f.write("\n")  # Don't append to a line that was cut off by an interruption
+        jobs = ((seed, args.world_corpus, args.world_generator, args.lattice_steps, args.check, args.wind)
+                for seed in seeds)
+        for result in pool.imap_unordered(_plan_seed_star, jobs):
+            f.write(json.dumps(result) + "\n")
+            f.flush()
+            results.append(result)
+
+    results = [r for r in results if args.seeds[0] <= r["seed"] < args.seeds[1]]
+    deliveries = [r["deliveries"] for r in results]
+    sites = [r["num_delivery_sites"] for r in results]
+    print("Seeds: {}".format(len(results)))
+    if results:
+        print("Best deliveries: mean {:.2f}, min {}, max {} ({:.1%} of delivery sites)".format(
+            statistics.mean(deliveries), min(deliveries), max(deliveries), sum(deliveries) / max(1, sum(sites))))
+    if args.pilot_results:
+        fractions = normalize(load_results(args.pilot_results), results)
+        if fractions:
+            print("Pilot: {:.1%} of the best deliveries, over {} seeds".format(
+                statistics.mean(fractions.values()), len(fractions)))
+
+
+if __name__ == "__main__":
+    main()
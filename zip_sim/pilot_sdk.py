@@ -0,0 +1,126 @@
+"""
+The plumbing every pilot needs: reading telemetry from the sim, decoding it, and answering with commands.
+
+A pilot subclasses Pilot and implements on_telemetry(), which is handed a Telemetry and returns (lateral_airspeed,
+drop_package_commanded). The same pilot can then be run in any of the ways the sim can talk to one:
+
+    python zip_sim.py python my_pilot.py                      # a pilot process over stdin and stdout
+    python zip_sim.py --transport shm python my_pilot.py      # a pilot process over shared memory (see zip_shm.py)
+    python zip_sim.py --pilot-module my_pilot:MyPilot         # in the sim's own process
+
+as long as the pilot's module ends with:
+
+    if __name__ == "__main__":
+        MyPilot().run()
+
+Over the pipes, each telemetry frame is read in full into a buffer that's allocated once, however the pipe splits it
+up, and each command is packed into another. Only the few scalar fields are unpacked; the lidar samples are a view
+straight into the frame.
+"""
+import os
+import struct
+import sys
+
+from zip_sim import TELEMETRY_STRUCT, COMMAND_STRUCT, LIDAR_ANGLES
+
+# The fields of TELEMETRY_STRUCT ahead of the lidar samples, which come last, one byte each
+TELEMETRY_HEADER_STRUCT = struct.Struct(">Hhffb")
+assert TELEMETRY_HEADER_STRUCT.size + len(LIDAR_ANGLES) == TELEMETRY_STRUCT.size
+
+
+class Telemetry():
+    """ The fields of one telemetry message. A pilot is handed the same object every tick, updated in place, and over
+    the pipes lidar_samples is a memoryview into the frame that's overwritten by the next one, so copy what needs to
+    be kept for later (bytes(telemetry.lidar_samples), say). """
+    __slots__ = ["timestamp", "recovery_x_error", "wind_vector_x", "wind_vector_y", "recovery_y_error",
+                 "lidar_samples"]
+
+    def __init__(self):
+        self.timestamp = 0
+        self.recovery_x_error = 0
+        self.wind_vector_x = 0.0
+        self.wind_vector_y = 0.0
+        self.recovery_y_error = 0
+        self.lidar_samples = ()
+
+
+class Pilot():
+    """ The base class of pilots. Subclasses implement on_telemetry(). """
+
+    # Made on first use, so that subclasses don't have to call Pilot.__init__()
+    _telemetry = None
+
+    def on_telemetry(self, telemetry):
+        """ Returns the (lateral_airspeed, drop_package_commanded) to answer the Telemetry with. """
+        raise NotImplementedError
+
+    def __call__(self, timestamp, recovery_x_error, wind_vector_x, wind_vector_y, recovery_y_error, lidar_samples):
+        """ Answers a tick in the sim's own process (see zip_sim.PythonPilot). """
+        telemetry = self._reusable_telemetry()
+        telemetry.timestamp = timestamp
+        telemetry.recovery_x_error = recovery_x_error
+        telemetry.wind_vector_x = wind_vector_x
+        telemetry.wind_vector_y = wind_vector_y
+        telemetry.recovery_y_error = recovery_y_error
+        telemetry.lidar_samples = lidar_samples
+        return self.on_telemetry(telemetry)
+
+    def _reusable_telemetry(self):
+        if self._telemetry is None:
+            self._telemetry = Telemetry()
+        return self._telemetry
+
+    def run(self):
+        """ Answers the sim's telemetry until the sim is done, over shared memory if the sim set that up and over
+        stdin and stdout otherwise. """
+        from zip_shm import ENVIRONMENT_VARIABLE
+        if ENVIRONMENT_VARIABLE in os.environ:
+            self._run_shared_memory()
+        else:
+            self._run_pipes(sys.stdin.fileno(), sys.stdout.fileno())
+
+    def _run_pipes(self, input_fd, output_fd):
+        telemetry = self._reusable_telemetry()
+        frame = bytearray(TELEMETRY_STRUCT.size)
+        frame_view = memoryview(frame)
+        telemetry.lidar_samples = frame_view[TELEMETRY_HEADER_STRUCT.size:]
+        command = bytearray(COMMAND_STRUCT.size)
+        with open(input_fd, "rb", buffering=0, closefd=False) as input_file:
+            while read_frame(input_file, frame_view):
+                telemetry.timestamp, telemetry.recovery_x_error, telemetry.wind_vector_x, telemetry.wind_vector_y, \
+                    telemetry.recovery_y_error = TELEMETRY_HEADER_STRUCT.unpack_from(frame)
+                lateral_airspeed, drop_package_commanded = self.on_telemetry(telemetry)
+                COMMAND_STRUCT.pack_into(command, 0, lateral_airspeed, int(bool(drop_package_commanded)), b"")
+                try:
+                    write_all(output_fd, command)
+                except BrokenPipeError:
+                    break  # The sim is done
+
+    def _run_shared_memory(self):
+        from zip_shm import PilotChannel
+        with PilotChannel.from_environment() as channel:
+            while True:
+                fields = channel.read_telemetry()
+                if fields is None:
+                    break
+                timestamp, recovery_x_error, wind_vector_x, wind_vector_y, recovery_y_error, *lidar_samples = fields
+                channel.write_command(*self(timestamp, recovery_x_error, wind_vector_x, wind_vector_y,
+                                            recovery_y_error, tuple(lidar_samples)))
+
+
+def read_frame(input_file, view):
+    """ Fills view from an unbuffered file, however many reads it takes. Returns False if the file ended first. """
+    filled = 0
+    while filled < len(view):
+        count = input_file.readinto(view[filled:])
+        if not count:
+            return False
+        filled += count
+    return True
+
+
+def write_all(fd, data):
+    """ Writes all of data to a file descriptor, however many writes it takes. """
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
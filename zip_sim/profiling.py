@@ -0,0 +1,113 @@
+"""
+Times the phases of the sim's main loop, to tell whether a slow run is down to the pilot, the lidar or pygame.
+
+The profiler replaces the methods that make up each phase with timed versions on the objects being profiled, so runs
+that aren't profiled don't pay anything for it. Phases nest (the lidar is cast inside the sim's step, the telemetry is
+sent inside the pilot's command), and each phase is only charged for its own time, not for the phases inside it. At
+exit, a table of the phases is printed, and optionally a trace of every call that can be loaded into chrome://tracing
+or Perfetto.
+
+    python zip_sim.py --headless --profile --profile-trace trace.json python my_pilot.py
+"""
+import json
+import time
+
+# The methods timed as each phase, by the kind of object they belong to
+SIMULATION_PHASES = [("step", "sim"), ("_cast_lidar", "lidar"), ("_move_vehicle", "physics"),
+                     ("_check_collisions", "collisions"), ("_update_packages", "packages"), ("_update_wind", "wind")]
+# The whole of command() is the pilot's turn. Sending it the telemetry is charged separately when it's a pilot process.
+PILOT_PHASES = [("command", "pilot wait"), ("send", "telemetry pack/write")]
+VISUALIZER_PHASES = [("draw", "rendering"), ("wait_for_step", "events and pacing")]
+PUBLISHER_PHASES = [("publish", "publish")]
+
+# The trace stops growing after this many calls, so that a long run doesn't eat all the memory.
+MAX_TRACE_EVENTS = 1000000
+
+
+class PhaseStats():
+    __slots__ = ["calls", "total", "max"]
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0
+        self.max = 0
+
+
+class Profiler():
+    """ Accumulates the time spent in each phase, in nanoseconds, and the trace events if asked to. """
+
+    def __init__(self, trace=False):
+        self.phases = {}
+        self.trace = [] if trace else None
+        self.trace_truncated = False
+        # The time spent in the phases inside each phase that's currently running
+        self._inner = []
+        self.start()
+
+    def start(self):
+        """ Starts the wall clock the phases are measured against. """
+        self._start = time.perf_counter_ns()
+
+    def instrument(self, obj, phases):
+        """ Times the methods of obj that are listed in phases as (method name, phase name) pairs. Methods obj doesn't
+        have are skipped. """
+        for method, phase in phases:
+            if hasattr(obj, method):
+                setattr(obj, method, self._timed(getattr(obj, method), phase))
+
+    def _timed(self, function, phase):
+        stats = self.phases.setdefault(phase, PhaseStats())
+        inner = self._inner
+        clock = time.perf_counter_ns
+
+        def timed(*args, **kwargs):
+            inner.append(0)
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = clock() - start
+                own = elapsed - inner.pop()
+                if inner:
+                    inner[-1] += elapsed
+                stats.calls += 1
+                stats.total += own
+                if own > stats.max:
+                    stats.max = own
+                if self.trace is not None:
+                    self._trace(phase, start, elapsed)
+        return timed
+
+    def _trace(self, phase, start, elapsed):
+        if len(self.trace) >= MAX_TRACE_EVENTS:
+            self.trace_truncated = True
+            return
+        self.trace.append((phase, start, elapsed))
+
+    def report(self):
+        """ Returns a table of the phases, slowest first, with the time outside all of them as "other". """
+        wall = time.perf_counter_ns() - self._start
+        rows = sorted(self.phases.items(), key=lambda item: item[1].total, reverse=True)
+        other = wall - sum(stats.total for _, stats in rows)
+        lines = ["{:<22} {:>9} {:>11} {:>10} {:>10} {:>6}".format("phase", "calls", "total ms", "mean us", "max us",
+                                                                  "%")]
+        for phase, stats in rows:
+            if stats.calls == 0:
+                continue
+            lines.append("{:<22} {:>9} {:>11.1f} {:>10.1f} {:>10.1f} {:>6.1f}".format(
+                phase, stats.calls, stats.total / 1e6, stats.total / stats.calls / 1e3, stats.max / 1e3,
+                100.0 * stats.total / wall))
+        lines.append("{:<22} {:>9} {:>11.1f} {:>10} {:>10} {:>6.1f}".format("other", "", other / 1e6, "", "",
+                                                                            100.0 * other / wall))
+        lines.append("{:<22} {:>9} {:>11.1f}".format("wall", "", wall / 1e6))
+        return "\n".join(lines)
+
+    def write_trace(self, path):
+        """ Writes the trace in the Chrome trace event format. """
+        events = [{"name": phase, "ph": "X", "ts": (start - self._start) / 1e3, "dur": elapsed / 1e3, "pid": 0,
+                   "tid": 0} for phase, start, elapsed in self.trace]
+        if self.trace_truncated:
+            events.append({"name": "trace truncated after {} events".format(MAX_TRACE_EVENTS), "ph": "i", "s": "g",
+                           "ts": events[-1]["ts"] + events[-1]["dur"], "pid": 0, "tid": 0})
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
@@ -0,0 +1,179 @@
+"""
+Records episodes to a compact binary log, and replays them without the pilot that flew them.
+
+A recording is a header followed by tagged records, appended as the episode is flown:
+
+    header     "ZREC", format version [1 byte], seed [8 bytes], world generator name [16 bytes], wind model [8 bytes]
+    telemetry  "T", the packed TELEMETRY_STRUCT message the pilot was sent
+    command    "C", the lateral airspeed [8 byte double] and drop flag [1 byte] the pilot answered with
+    result     "R", the exit code [1 byte], deliveries [2 bytes] and ZIPAA violations [2 bytes]
+
+The commands are stored at full precision, rather than as COMMAND_STRUCT messages, so that keyboard flights replay
+exactly too. A replay re-creates the world from the seed, world generator and wind model, flies the recorded commands,
+and checks that every telemetry message and the final result come out the same.
+"""
+import collections
+import struct
+import sys
+
+from zip_sim import TELEMETRY_STRUCT, SIM_QUIT, PILOT_QUIT, Visualizer, ZipSimulation, run
+
+RECORDING_MAGIC = b"ZREC"
+RECORDING_VERSION = 3
+HEADER_STRUCT = struct.Struct(">4sBq16s8s")
+# Version 1 recordings didn't say how the world was generated, since there was only one way, and versions before 3
+# didn't say how the wind was driven.
+VERSION_1_HEADER_STRUCT = struct.Struct(">4sBq")
+VERSION_2_HEADER_STRUCT = struct.Struct(">4sBq16s")
+# The seeds the header has room for, in a signed 64-bit field
+MIN_SEED = -2 ** 63
+MAX_SEED = 2 ** 63 - 1
+COMMAND_STRUCT = struct.Struct(">dB")
+RESULT_STRUCT = struct.Struct(">bHH")
+TELEMETRY_TAG = b"T"
+COMMAND_TAG = b"C"
+RESULT_TAG = b"R"
+RECORD_STRUCTS = {TELEMETRY_TAG: TELEMETRY_STRUCT, COMMAND_TAG: COMMAND_STRUCT, RESULT_TAG: RESULT_STRUCT}
+
+# Exit code of a replay that didn't play out like the recording. Follows the sim's own exit codes.
+REPLAY_DIVERGED = 4
+
+# ticks is a list of (packed telemetry, (lateral_airspeed, drop_package_commanded)) with the command None if the pilot
+# never answered. result is (exit code, deliveries, ZIPAA violations), or None if the recording was cut short.
+Recording = collections.namedtuple("Recording", ["seed", "world_generator", "wind_model", "ticks", "result"])
+
+
+class EpisodeRecorder():
+    """ Appends an episode to a recording file as it's flown. """
+
+    def __init__(self, path, seed, world_generator="rejection", wind_model="walk"):
+        if not MIN_SEED <= seed <= MAX_SEED:
+            raise ValueError("Can't record seed {}, recordings only hold seeds from {} to {}".format(
+                seed, MIN_SEED, MAX_SEED))
+        header = HEADER_STRUCT.pack(RECORDING_MAGIC, RECORDING_VERSION, seed, world_generator.encode(),
+                                    wind_model.encode())
+        self._file = open(path, "wb")
+        self._file.write(header)
+
+    def telemetry(self, telemetry):
+        self._file.write(TELEMETRY_TAG + TELEMETRY_STRUCT.pack(*telemetry))
+
+    def command(self, lateral_airspeed, drop_package_commanded):
+        self._file.write(COMMAND_TAG + COMMAND_STRUCT.pack(lateral_airspeed, drop_package_commanded))
+
+    def close(self, status, deliveries, zipaa_violations):
+        self._file.write(RESULT_TAG + RESULT_STRUCT.pack(status, deliveries, zipaa_violations))
+        self._file.close()
+
+
+class RecordingPilot():
+    """ Wraps a pilot, recording everything it's sent and everything it answers. """
+
+    def __init__(self, pilot, recorder):
+        self._pilot = pilot
+        self._recorder = recorder
+
+    def command(self, telemetry):
+        self._recorder.telemetry(telemetry)
+        cmd = self._pilot.command(telemetry)
+        if cmd is not None:
+            self._recorder.command(*cmd)
+        return cmd
+
+    def close(self):
+        self._pilot.close()
+
+
+def read_recording(path):
+    """ Reads a recording file. Returns a Recording. """
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, seed = VERSION_1_HEADER_STRUCT.unpack_from(data)
+    if magic != RECORDING_MAGIC or version not in (1, 2, RECORDING_VERSION):
+        raise ValueError("{} isn't a version {} Zip Sim recording".format(path, RECORDING_VERSION))
+    wind_model = "walk"
+    if version == 1:
+        world_generator = "rejection"
+        offset = VERSION_1_HEADER_STRUCT.size
+    elif version == 2:
+        world_generator = VERSION_2_HEADER_STRUCT.unpack_from(data)[3].rstrip(b"\0").decode()
+        offset = VERSION_2_HEADER_STRUCT.size
+    else:
+        world_generator, wind_model = (name.rstrip(b"\0").decode() for name in HEADER_STRUCT.unpack_from(data)[3:])
+        offset = HEADER_STRUCT.size
+    ticks = []
+    result = None
+    while offset < len(data):
+        tag = data[offset:offset + 1]
+        record_struct = RECORD_STRUCTS.get(tag)
+        if record_struct is None or offset + 1 + record_struct.size > len(data):
+            break  # Cut short, most likely because the sim itself died
+        record = data[offset + 1:offset + 1 + record_struct.size]
+        offset += 1 + record_struct.size
+        if tag == TELEMETRY_TAG:
+            ticks.append((record, None))
+        elif tag == COMMAND_TAG:
+            lateral_airspeed, drop_package_commanded = COMMAND_STRUCT.unpack(record)
+            ticks[-1] = (ticks[-1][0], (lateral_airspeed, bool(drop_package_commanded)))
+        else:
+            result = RESULT_STRUCT.unpack(record)
+    return Recording(seed, world_generator, wind_model, ticks, result)
+
+
+class ReplayPilot():
+    """ Answers with the recorded commands, checking that the sim sends the recorded telemetry. Once the commands run
+    out, quits if the recorded episode was quit. """
+
+    def __init__(self, ticks, result=None):
+        self._ticks = ticks
+        self._result = result
+        self.tick = 0
+        # The tick the telemetry first differed from the recording, if it did
+        self.divergence = None
+        # Whether the replay ran to the end of the recorded commands and quit there, as the recording did
+        self.quit = False
+
+    def command(self, telemetry):
+        if self.tick >= len(self._ticks):
+            if self._result is not None and self._result[0] == SIM_QUIT:
+                self.quit = True
+                return PILOT_QUIT
+            self.divergence = self.tick
+            return None
+        recorded_telemetry, cmd = self._ticks[self.tick]
+        if TELEMETRY_STRUCT.pack(*telemetry) != recorded_telemetry:
+            self.divergence = self.tick
+            return None
+        self.tick += 1
+        return cmd
+
+    def close(self):
+        pass
+
+
+def replay(path, headless=True, **visualizer_options):
+    """ Re-flies a recording, visualized unless headless, and prints whether it played out the same way. Returns the
+    exit code of the replay, or REPLAY_DIVERGED. """
+    recording = read_recording(path)
+    sim = ZipSimulation(recording.seed, world_generator=recording.world_generator, wind_model=recording.wind_model)
+    pilot = ReplayPilot(recording.ticks, recording.result)
+    visualizer = None if headless else Visualizer(**visualizer_options)
+    run(sim, pilot, visualizer)
+    if visualizer is not None:
+        visualizer.close()
+
+    deliveries, zipaa_violations = sim.result()
+    print("Deliveries: {}".format(deliveries))
+    print("ZIPAA Violations: {}".format(zipaa_violations))
+
+    if sim.status == SIM_QUIT and not pilot.quit:
+        return sim.status  # The replay itself was quit
+    if pilot.divergence is not None:
+        print("Replay diverged from the recording at tick {}".format(pilot.divergence), file=sys.stderr)
+        return REPLAY_DIVERGED
+    if recording.result is not None and recording.result != (sim.status, deliveries, zipaa_violations):
+        print("Replay ended with {} but the recording ended with {}".format(
+            (sim.status, deliveries, zipaa_violations), recording.result), file=sys.stderr)
+        return REPLAY_DIVERGED
+    print("Replay matches the recording ({} ticks)".format(pilot.tick), file=sys.stderr)
+    return sim.status
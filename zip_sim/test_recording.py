@@ -0,0 +1,43 @@
+"""
+Checks of recording.py: episodes recorded and then replayed.
+
+    python -m pytest test_recording.py
+"""
+from recording import EpisodeRecorder, RecordingPilot, replay
+from zip_sim import SIM_QUIT, ZipSimulation, run
+
+
+class SteadyPilot():
+    """ Flies to one side, dropping a package every so often. """
+
+    def command(self, telemetry):
+        return 3.0, telemetry[0] % 400 < 20
+
+    def close(self):
+        pass
+
+
+class QuittingVisualizer():
+    """ Stands in for the visualizer of a flight that was quit after a number of ticks. """
+
+    def __init__(self, ticks):
+        self._ticks = ticks
+
+    def draw(self, sim):
+        pass
+
+    def wait_for_step(self):
+        self._ticks -= 1
+        return self._ticks > 0
+
+
+def test_replay_of_quit_episode(tmp_path, capsys):
+    path = str(tmp_path / "quit.zrec")
+    recorder = EpisodeRecorder(path, 7)
+    sim = ZipSimulation(7)
+    assert run(sim, RecordingPilot(SteadyPilot(), recorder), QuittingVisualizer(300)) == SIM_QUIT
+    deliveries, zipaa_violations = sim.result()
+    recorder.close(sim.status, deliveries, zipaa_violations)
+
+    assert replay(path) == SIM_QUIT
+    assert "Replay matches the recording (300 ticks)" in capsys.readouterr().err
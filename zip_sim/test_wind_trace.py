@@ -0,0 +1,63 @@
+"""
+Checks of WindTrace, the precomputed wind model, and of WindTape, which snapshots play the wind back from.
+
+    python -m pytest test_wind_trace.py
+"""
+from batch_sim import BatchZipSimulation
+from corridor import CorridorSimulation
+from zip_sim import WIND_TRACE_TICKS, WindTape, WindTrace, ZipSimulation
+
+
+def test_negative_seed():
+    # Negative seeds are taken as their absolute value, as random.seed() does for the walk model
+    for negative, positive in zip(WindTrace(-3).vectors(0, 100), WindTrace(3).vectors(0, 100)):
+        assert negative.tolist() == positive.tolist()
+
+
+def test_negative_seed_sims():
+    sim = ZipSimulation(-4, wind_model="trace")
+    batch = BatchZipSimulation([-4], wind_model="trace")
+    for _ in range(100):
+        sim.step(0.0, False)
+        batch.step(0.0, False)
+        assert (batch.wind_x[0], batch.wind_y[0]) == sim.wind.vector
+
+
+def test_corridor_trace_stays_bounded():
+    # A corridor flies for ever, so the trace must only keep the ticks its winds can still get to
+    sim = CorridorSimulation(5, wind_model="trace")
+    trace = sim.wind._tape
+    for _ in range(4 * WIND_TRACE_TICKS):
+        sim.step(0.0, False)
+        assert len(trace) <= 2 * WIND_TRACE_TICKS
+
+    # A snapshot holds on to the ticks from its own, so that once restored the wind blows just as it did the first time
+    snapshot = sim.snapshot()
+    for _ in range(2 * WIND_TRACE_TICKS):
+        sim.step(0.0, False)
+    sim.restore(snapshot)
+    x, y = WindTrace(5).vectors(4 * WIND_TRACE_TICKS + 1, 5 * WIND_TRACE_TICKS + 1)
+    for i in range(WIND_TRACE_TICKS):
+        sim.step(0.0, False)
+        assert sim.wind.vector == (x[i], y[i])
+
+
+def test_corridor_tape_stays_bounded():
+    # Once a walk has been snapshotted it's played back from a tape, which mustn't grow for ever either
+    sim = CorridorSimulation(5)
+    sim.snapshot()
+    tape = sim.wind._tape
+    assert isinstance(tape, WindTape)
+    for _ in range(4 * WIND_TRACE_TICKS):
+        sim.step(0.0, False)
+        assert len(tape) <= 2 * WIND_TRACE_TICKS
+
+    snapshot = sim.snapshot()
+    states = []
+    for _ in range(3 * WIND_TRACE_TICKS):
+        sim.step(0.0, False)
+        states.append(sim.wind.state())
+    sim.restore(snapshot)
+    for state in states:
+        sim.step(0.0, False)
+        assert sim.wind.state() == state
@@ -0,0 +1,146 @@
+"""
+Flies a pilot over a range of seeds, running the episodes in parallel across a process pool.
+
+Each finished episode is appended to the results file as a line of JSON as soon as it's done, so an interrupted
+tournament picks up where it left off when run again with the same results file. Every line also records the pilot,
+worlds and wind it was flown with, and a results file that was flown with others is refused rather than resumed.
+
+    python tournament.py --seeds 0 1000 --results my_pilot.jsonl python my_pilot.py
+    python tournament.py --seeds 0 1000 --results my_pilot.jsonl --pilot-module my_pilot:MyPilot
+
+With --publish NAME, every episode is published for viewer.py to watch as NAME-SEED.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+
+from zip_sim import (RECOVERED, PARALANDED, CRASHED, SIM_QUIT, WORLD_GENERATORS, WIND_MODELS, PilotProcess,
+                     PythonPilot, ZipSimulation, load_pilot, run)
+
+STATUS_NAMES = {RECOVERED: "RECOVERED", PARALANDED: "PARALANDED", CRASHED: "CRASHED", SIM_QUIT: "SIM_QUIT"}
+# What a result depends on besides its seed, recorded with it so that only the same tournament is resumed
+CONFIG_FIELDS = ["pilot_command", "pilot_module", "world_corpus", "world_generator", "wind_model"]
+
+
+def fly_seed(seed, pilot_command=None, pilot_module=None, publish=None, world_corpus=None,
+             world_generator="rejection", wind_model="walk"):
+    """ Flies one headless episode, with either a pilot process or an in-process Python pilot. Returns its result as
+    a dictionary. """
+    corpus = None
+    if world_corpus:
+        from world_corpus import load_corpus
+        corpus = load_corpus(world_corpus)
+    sim = ZipSimulation(seed, corpus, world_generator, wind_model)
+    pilot = PilotProcess(pilot_command) if pilot_command else PythonPilot(load_pilot(pilot_module))
+    publisher = None
+    if publish:
+        from viewer import SnapshotPublisher
+        publisher = SnapshotPublisher("{}-{}".format(publish, seed))
+    run(sim, pilot, publisher=publisher)
+    pilot.close()
+    if publisher is not None:
+        publisher.close()
+    deliveries, zipaa_violations = sim.result()
+    return {"seed": seed,
+            "status": STATUS_NAMES[sim.status],
+            "deliveries": deliveries,
+            "zipaa_violations": zipaa_violations,
+            "ticks": sim.loop_count,
+            "pilot_command": pilot_command or None,
+            "pilot_module": pilot_module,
+            "world_corpus": world_corpus,
+            "world_generator": world_generator,
+            "wind_model": wind_model}
+
+
+def _fly_seed_star(args):
+    return fly_seed(*args)
+
+
+def load_results(path):
+    """ Reads the results of a previous (possibly interrupted) tournament. Returns a list of result dictionaries. """
+    results = []
+    if not os.path.exists(path):
+        return results
+    with open(path) as f:
+        for line in f:
+            try:
+                results.append(json.loads(line))
+            except json.JSONDecodeError:
+                pass  # A line that was being written when the tournament was interrupted
+    return results
+
+
+def results_end_with_newline(path):
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def summarize(results):
+    """ Returns a printable summary of the results. """
+    if not results:
+        return "No episodes"
+    lines = ["Episodes: {}".format(len(results))]
+    for name in STATUS_NAMES.values():
+        count = sum(1 for r in results if r["status"] == name)
+        if count:
+            lines.append("{}: {} ({:.1%})".format(name, count, count / len(results)))
+    for field in ("deliveries", "zipaa_violations", "ticks"):
+        values = [r[field] for r in results]
+        lines.append("{}: mean {:.2f}, stdev {:.2f}, min {}, max {}".format(
+            field, statistics.mean(values), statistics.pstdev(values), min(values), max(values)))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flies a Zip Sim pilot over a range of seeds")
+    parser.add_argument('pilot', nargs=argparse.REMAINDER, help='A pilot process to run')
+    parser.add_argument('--pilot-module', metavar="MODULE[:NAME]",
+                        help='A Python pilot to run in-process instead of a pilot process (see zip_sim.load_pilot)')
+    parser.add_argument('--seeds', type=int, nargs=2, metavar=("START", "STOP"), required=True,
+                        help='Fly every seed from START up to (but not including) STOP')
+    parser.add_argument('--results', required=True, help='File to append per-seed results to, as lines of JSON')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        help='Number of episodes to fly at once (defaults to the number of CPUs)')
+    parser.add_argument('--publish', metavar="NAME", help='Publish each episode for viewer.py to watch as NAME-SEED')
+    parser.add_argument('--world-corpus', metavar="FILE",
+                        help='Load worlds from a file of pre-generated worlds (see world_corpus.py)')
+    parser.add_argument('--world-generator', choices=sorted(WORLD_GENERATORS), default="rejection",
+                        help='How to generate worlds (see zip_sim.WORLD_GENERATORS)')
+    parser.add_argument('--wind', choices=WIND_MODELS, default="walk",
+                        help='How to drive the wind (see zip_sim.WIND_MODELS)')
+    args = parser.parse_args()
+    if bool(args.pilot) == bool(args.pilot_module):
+        parser.error("give either a pilot process or --pilot-module")
+
+    results = load_results(args.results)
+    config = dict(zip(CONFIG_FIELDS, (args.pilot or None, args.pilot_module, args.world_corpus, args.world_generator,
+                                      args.wind)))
+    mismatched = [r for r in results if any(r.get(field) != value for field, value in config.items())]
+    if mismatched:
+        parser.error("{} holds results flown with another pilot, world generator, world corpus or wind model (seed {} "
+                     "for one), so it can't be resumed; give another results file".format(args.results,
+                                                                                          mismatched[0]["seed"]))
+    done = {r["seed"] for r in results}
+    seeds = [seed for seed in range(*args.seeds) if seed not in done]
+    if len(seeds) < len(range(*args.seeds)):
+        print("Resuming: {} seeds already flown, {} to go".format(len(range(*args.seeds)) - len(seeds), len(seeds)))
+
+    with open(args.results, "a") as f, multiprocessing.Pool(args.jobs) as pool:
+        if f.tell() > 0 and not results_end_with_newline(args.results):
+            f.write("\n")  # Don't append to a line that was cut off by an interruption
+        episodes = ((seed, args.pilot, args.pilot_module, args.publish, args.world_corpus, args.world_generator,
+                     args.wind) for seed in seeds)
+        for result in pool.imap_unordered(_fly_seed_star, episodes):
+            f.write(json.dumps(result) + "\n")
+            f.flush()
+            results.append(result)
+
+    print(summarize([r for r in results if args.seeds[0] <= r["seed"] < args.seeds[1]]))
+
+
+if __name__ == "__main__":
+    main()
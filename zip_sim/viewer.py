@@ -0,0 +1,262 @@
+"""
+Watches a running simulation from a separate process, so that headless runs can be looked in on without slowing
+them down or loading pygame into them.
+
+A sim run with --publish NAME writes a snapshot of its state into the shared memory segment NAME after every tick:
+
+    sequence   [4 bytes] bumped before and after every write, so it's odd while a snapshot is being written
+    publisher  [4 bytes] the process ID of the sim publishing to the segment
+    state      the world's id, tick, exit code, vehicle position, lateral airspeed, wind and lidar samples
+    packages   the position and remaining fall time of every dropped package
+    world      the positions of the delivery sites and trees, only rewritten when the world changes
+
+The sim never waits on a viewer. A viewer copies the segment whenever it's ready for another frame, and throws the
+copy away if the sequence number says a write was in progress, so it simply skips the ticks it can't keep up with.
+
+Only one sim can publish to a segment at a time. A sim refuses a segment whose publisher is still running, and only
+reclaims one left behind by a sim that didn't exit cleanly.
+
+    python zip_sim.py --headless --publish zip_sim python my_pilot.py
+    python viewer.py zip_sim --show-lidar
+"""
+import argparse
+import os
+import struct
+from multiprocessing import shared_memory
+
+from zip_sim import (NUM_DELIVERY_SITES, MAX_NUM_TREES, DeliverySite, Package, Tree, Visualizer, Zip,
+                     import_pygame)
+from zip_shm import SEQUENCE_STRUCT, attach_segment
+
+# Layout of the segment
+SEQUENCE_OFFSET = 0
+PUBLISHER_STRUCT = struct.Struct("<I")
+PUBLISHER_OFFSET = SEQUENCE_OFFSET + 4
+# world id, tick, exit code (-1 while running), closed, number of packages, vehicle x and y, lateral airspeed,
+# wind x and y, 31 lidar samples
+STATE_STRUCT = struct.Struct("<IIbBBx5d31B")
+STATE_OFFSET = SEQUENCE_OFFSET + 8
+PACKAGE_STRUCT = struct.Struct("<3d")
+PACKAGES_OFFSET = STATE_OFFSET + STATE_STRUCT.size
+MAX_NUM_PACKAGES = NUM_DELIVERY_SITES
+# number of delivery sites, number of trees
+WORLD_STRUCT = struct.Struct("<HH")
+WORLD_OFFSET = PACKAGES_OFFSET + MAX_NUM_PACKAGES * PACKAGE_STRUCT.size
+POSITION_STRUCT = struct.Struct("<2d")
+POSITIONS_OFFSET = WORLD_OFFSET + WORLD_STRUCT.size
+SEGMENT_SIZE = POSITIONS_OFFSET + (NUM_DELIVERY_SITES + MAX_NUM_TREES) * POSITION_STRUCT.size
+
+RUNNING = -1
+
+# How often to look for the segment while no sim is publishing
+ATTACH_RATE = 4
+
+
+class SnapshotPublisher():
+    """ The sim's side. Publishes the state of a simulation after every tick. """
+
+    def __init__(self, name):
+        try:
+            self._segment = shared_memory.SharedMemory(name, create=True, size=SEGMENT_SIZE)
+        except FileExistsError:
+            existing = attach_segment(name)
+            publisher = PUBLISHER_STRUCT.unpack_from(existing.buf, PUBLISHER_OFFSET)[0]
+            existing.close()
+            if _is_running(publisher):
+                raise FileExistsError("Shared memory segment {} is in use by process {}, publish to another "
+                                      "name".format(name, publisher)) from None
+            # Left behind by a sim that didn't exit cleanly
+            shared_memory.SharedMemory(name).unlink()
+            self._segment = shared_memory.SharedMemory(name, create=True, size=SEGMENT_SIZE)
+        self._buffer = self._segment.buf
+        self._buffer[:SEGMENT_SIZE] = bytes(SEGMENT_SIZE)
+        PUBLISHER_STRUCT.pack_into(self._buffer, PUBLISHER_OFFSET, os.getpid())
+        self._sequence = 0
+        self._world_id = 0
+        self._trees = None
+        self._delivery_sites = None
+        self._state = None
+
+    def publish(self, sim, telemetry):
+        """ Publishes the simulation's state. The lidar samples are taken from the telemetry it just returned. """
+        # Check that everything fits before starting the write, rather than overrunning the areas after it
+        if len(sim.dropped_packages) > MAX_NUM_PACKAGES:
+            raise ValueError("Can't publish {} falling packages, the most is {}".format(
+                len(sim.dropped_packages), MAX_NUM_PACKAGES))
+        if len(sim.delivery_sites) > NUM_DELIVERY_SITES or len(sim.trees) > MAX_NUM_TREES:
+            raise ValueError("Can't publish a world of {} delivery sites and {} trees, the most is {} and {}".format(
+                len(sim.delivery_sites), len(sim.trees), NUM_DELIVERY_SITES, MAX_NUM_TREES))
+
+        buffer = self._buffer
+        self._sequence = (self._sequence + 1) & 0xFFFFFFFF
+        SEQUENCE_STRUCT.pack_into(buffer, SEQUENCE_OFFSET, self._sequence)
+
+        if sim.trees is not self._trees or sim.delivery_sites is not self._delivery_sites:
+            self._world_id += 1
+            self._trees = sim.trees
+            self._delivery_sites = sim.delivery_sites
+            WORLD_STRUCT.pack_into(buffer, WORLD_OFFSET, len(sim.delivery_sites), len(sim.trees))
+            for i, e in enumerate(sim.delivery_sites + sim.trees):
+                POSITION_STRUCT.pack_into(buffer, POSITIONS_OFFSET + i * POSITION_STRUCT.size, *e.position)
+
+        packages = sim.dropped_packages
+        for i, p in enumerate(packages):
+            PACKAGE_STRUCT.pack_into(buffer, PACKAGES_OFFSET + i * PACKAGE_STRUCT.size, p.position[0], p.position[1],
+                                     p.fall_duration)
+        wind_x, wind_y = sim.wind.vector
+        self._state = (self._world_id, sim.loop_count, RUNNING if sim.status is None else sim.status, False,
+                       len(packages), sim.vehicle.position[0], sim.vehicle.position[1], sim.lateral_airspeed,
+                       wind_x, wind_y) + tuple(telemetry[5:])
+        STATE_STRUCT.pack_into(buffer, STATE_OFFSET, *self._state)
+
+        self._sequence = (self._sequence + 1) & 0xFFFFFFFF
+        SEQUENCE_STRUCT.pack_into(buffer, SEQUENCE_OFFSET, self._sequence)
+
+    def close(self):
+        """ Tells any viewer that the episode is over, and removes the segment. """
+        if self._state is not None:
+            self._sequence = (self._sequence + 1) & 0xFFFFFFFF
+            SEQUENCE_STRUCT.pack_into(self._buffer, SEQUENCE_OFFSET, self._sequence)
+            STATE_STRUCT.pack_into(self._buffer, STATE_OFFSET, *self._state[:3], True, *self._state[4:])
+            self._sequence = (self._sequence + 1) & 0xFFFFFFFF
+            SEQUENCE_STRUCT.pack_into(self._buffer, SEQUENCE_OFFSET, self._sequence)
+        del self._buffer
+        self._segment.close()
+        self._segment.unlink()
+
+
+def _is_running(pid):
+    """ Returns whether the process with the given ID is still running. """
+    if pid == 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Someone else's process
+    return True
+
+
+class WindVector():
+    __slots__ = ["vector"]
+
+    def __init__(self, vector):
+        self.vector = vector
+
+
+class LidarSamples():
+    __slots__ = ["samples"]
+
+    def __init__(self, samples):
+        self.samples = samples
+
+    def cast(self, start_pos):
+        return self.samples
+
+
+class Snapshot():
+    """ A published simulation state, with just enough of a ZipSimulation's attributes for Visualizer.draw(). """
+    __slots__ = ["world_id", "loop_count", "status", "closed", "vehicle", "lateral_airspeed", "wind", "lidar",
+                 "dropped_packages", "delivery_sites", "trees"]
+
+
+class SnapshotReader():
+    """ The viewer's side. Reads the latest state published to a segment. """
+
+    def __init__(self, segment):
+        self._segment = segment
+        self._world_id = None
+        self._delivery_sites = []
+        self._trees = []
+
+    @classmethod
+    def attach(cls, name):
+        """ Returns a reader for the named segment, or None if nothing is publishing to it yet. """
+        try:
+            return cls(attach_segment(name))
+        except FileNotFoundError:
+            return None
+
+    def read(self):
+        """ Returns a Snapshot of the latest tick, or None if the sim was in the middle of publishing one. """
+        buffer = self._segment.buf
+        sequence = SEQUENCE_STRUCT.unpack_from(buffer, SEQUENCE_OFFSET)[0]
+        if sequence & 1 or sequence == 0:
+            return None
+        data = bytes(buffer)
+        if SEQUENCE_STRUCT.unpack_from(buffer, SEQUENCE_OFFSET)[0] != sequence:
+            return None
+
+        state = STATE_STRUCT.unpack_from(data, STATE_OFFSET)
+        world_id, loop_count, status, closed, num_packages, vehicle_x, vehicle_y, lateral_airspeed, wind_x, wind_y = \
+            state[:10]
+        if world_id != self._world_id:
+            # Only build a new world when it changes, so that the visualizer keeps its cached drawing of it.
+            self._world_id = world_id
+            num_delivery_sites, num_trees = WORLD_STRUCT.unpack_from(data, WORLD_OFFSET)
+            positions = [POSITION_STRUCT.unpack_from(data, POSITIONS_OFFSET + i * POSITION_STRUCT.size)
+                         for i in range(num_delivery_sites + num_trees)]
+            self._delivery_sites = [DeliverySite(p) for p in positions[:num_delivery_sites]]
+            self._trees = [Tree(p) for p in positions[num_delivery_sites:]]
+
+        snapshot = Snapshot()
+        snapshot.world_id = world_id
+        snapshot.loop_count = loop_count
+        snapshot.status = None if status == RUNNING else status
+        snapshot.closed = bool(closed)
+        snapshot.vehicle = Zip()
+        snapshot.vehicle.position = (vehicle_x, vehicle_y)
+        snapshot.lateral_airspeed = lateral_airspeed
+        snapshot.wind = WindVector((wind_x, wind_y))
+        snapshot.lidar = LidarSamples(list(state[10:]))
+        snapshot.dropped_packages = []
+        for i in range(num_packages):
+            x, y, fall_duration = PACKAGE_STRUCT.unpack_from(data, PACKAGES_OFFSET + i * PACKAGE_STRUCT.size)
+            snapshot.dropped_packages.append(Package((x, y), (0.0, 0.0), fall_duration))
+        snapshot.delivery_sites = self._delivery_sites
+        snapshot.trees = self._trees
+        return snapshot
+
+    def close(self):
+        self._segment.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watches a Zip Sim that was run with --publish")
+    parser.add_argument('name', help='The name the sim publishes to')
+    parser.add_argument('--chase-y', action="store_true", help='Have the camera follow the zip in the y axis')
+    parser.add_argument('--show-lidar', action="store_true", help='Shows lidar in the visualization')
+    args = parser.parse_args()
+
+    pygame = import_pygame()
+    visualizer = Visualizer(chase_y=args.chase_y, show_lidar=args.show_lidar)
+    reader = None
+    while True:
+        if reader is None:
+            reader = SnapshotReader.attach(args.name)
+            if reader is None:
+                pygame.display.set_caption("Zip Sim viewer - waiting for {}".format(args.name))
+                pygame.time.wait(1000 // ATTACH_RATE)
+                if any(e.type == pygame.QUIT for e in pygame.event.get()):
+                    break
+                continue
+            pygame.display.set_caption("Zip Sim viewer - {}".format(args.name))
+
+        snapshot = reader.read()
+        if snapshot is not None:
+            visualizer.draw(snapshot)
+            if snapshot.closed:
+                # Keep showing how the episode ended, and wait for the next one.
+                reader.close()
+                reader = None
+        if not visualizer.wait_for_step():
+            break
+
+    if reader is not None:
+        reader.close()
+    visualizer.close()
+
+
+if __name__ == "__main__":
+    main()
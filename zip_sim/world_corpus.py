@@ -0,0 +1,141 @@
+"""
+Pre-generates the worlds of a range of seeds into one file, so that benchmarks that fly the same seeds over and over
+don't pay for world generation every time.
+
+The file is a header followed by one fixed-size record per seed, in seed order, so that a world is found by its seed
+without any searching. Each record holds the delivery site and tree positions, the initial wind, and the state of
+the seed's random number generator after generating them, so that the wind's random walk carries on exactly as if
+the world had just been generated.
+
+    python world_corpus.py --seeds 0 5000 worlds.zwc
+    python zip_sim.py --world-corpus worlds.zwc --seed 1234 python my_pilot.py
+
+A corpus only holds worlds made by one generator, and is only used by sims that generate worlds the same way.
+"""
+import argparse
+import functools
+import multiprocessing
+import os
+import random
+import struct
+
+import numpy as np
+
+from zip_sim import WORLD_GENERATORS, WORLD_SIZES, DeliverySite, Tree, Wind, create_world
+
+CORPUS_MAGIC = b"ZWLD"
+CORPUS_VERSION = 2
+# magic, format version, first seed, number of seeds, record size, name of the world generator. Padded so that the
+# records are aligned.
+HEADER_STRUCT = struct.Struct("<4sBqII16s")
+HEADER_SIZE = 64
+
+# The state of a random.Random: the Mersenne Twister's 624 words and its position in them, and the spare gaussian
+# left over from the last gauss() call, if there is one.
+RNG_STATE_LENGTH = 625
+
+
+def record_dtype(generator):
+    """ Returns the dtype of a record, which has room for as many delivery sites and trees as the generator's worlds
+    can have. """
+    max_num_sites, max_num_trees = WORLD_SIZES[generator]
+    return np.dtype([("num_sites", "<u2"),
+                     ("num_trees", "<u2"),
+                     ("site_position", "<f8", (max_num_sites, 2)),
+                     ("tree_position", "<f8", (max_num_trees, 2)),
+                     ("wind_speed", "<f8"),
+                     ("wind_direction", "<f8"),
+                     ("rng_state", "<u4", (RNG_STATE_LENGTH,)),
+                     ("has_gauss_next", "u1"),
+                     ("gauss_next", "<f8")])
+
+
+def world_record(seed, generator="rejection"):
+    """ Generates the world for a seed. Returns its record, as bytes. """
+    delivery_sites, trees, wind, rng = create_world(seed, generator=generator)
+    record = np.zeros((), dtype=record_dtype(generator))
+    record["num_sites"] = len(delivery_sites)
+    record["num_trees"] = len(trees)
+    if delivery_sites:
+        record["site_position"][:len(delivery_sites)] = [s.position for s in delivery_sites]
+    if trees:
+        record["tree_position"][:len(trees)] = [t.position for t in trees]
+    record["wind_speed"], record["wind_direction"] = wind.state()
+    _, internal_state, gauss_next = rng.getstate()
+    record["rng_state"] = internal_state
+    record["has_gauss_next"] = gauss_next is not None
+    record["gauss_next"] = gauss_next or 0.0
+    return record.tobytes()
+
+
+class WorldCorpus():
+    """ A corpus file, mapped into memory. """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            header = f.read(HEADER_STRUCT.size)
+        magic, version, self.first_seed, self.num_seeds, record_size, generator = HEADER_STRUCT.unpack(header)
+        # The name of the generator in WORLD_GENERATORS the worlds were made with
+        self.generator = generator.rstrip(b"\0").decode()
+        if magic != CORPUS_MAGIC or version != CORPUS_VERSION or self.generator not in WORLD_SIZES or \
+                record_size != record_dtype(self.generator).itemsize:
+            raise ValueError("{} isn't a version {} Zip Sim world corpus".format(path, CORPUS_VERSION))
+        self._records = np.memmap(path, dtype=record_dtype(self.generator), mode="r", offset=HEADER_SIZE,
+                                  shape=(self.num_seeds,))
+
+    def __contains__(self, seed):
+        return 0 <= seed - self.first_seed < self.num_seeds
+
+    def load(self, seed):
+        """ Returns the (delivery_sites, trees, wind, rng) of the world for a seed, like create_world(), or None if
+        the seed isn't in the corpus. """
+        if seed not in self:
+            return None
+        record = self._records[seed - self.first_seed]
+        delivery_sites = [DeliverySite(tuple(p)) for p in record["site_position"][:record["num_sites"]].tolist()]
+        trees = [Tree(tuple(p)) for p in record["tree_position"][:record["num_trees"]].tolist()]
+        rng = random.Random()
+        rng.setstate((3, tuple(record["rng_state"].tolist()),
+                      float(record["gauss_next"]) if record["has_gauss_next"] else None))
+        wind = Wind.restore(rng, float(record["wind_speed"]), float(record["wind_direction"]))
+        return delivery_sites, trees, wind, rng
+
+
+@functools.lru_cache(maxsize=None)
+def load_corpus(path):
+    """ Returns the WorldCorpus for a file, only mapping each file once per process. """
+    return WorldCorpus(path)
+
+
+def build_corpus(path, first_seed, stop_seed, jobs=None, generator="rejection"):
+    """ Generates the worlds for the seeds from first_seed up to stop_seed across a process pool, and writes them to
+    a corpus file. """
+    num_seeds = stop_seed - first_seed
+    # Written under another name first, so that an interrupted build never leaves a corpus that's missing worlds.
+    partial_path = path + ".partial"
+    with open(partial_path, "wb") as f, multiprocessing.Pool(jobs) as pool:
+        f.write(HEADER_STRUCT.pack(CORPUS_MAGIC, CORPUS_VERSION, first_seed, num_seeds,
+                                   record_dtype(generator).itemsize, generator.encode()).ljust(HEADER_SIZE, b"\0"))
+        for record in pool.imap(functools.partial(world_record, generator=generator), range(first_seed, stop_seed),
+                                chunksize=64):
+            f.write(record)
+    os.replace(partial_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-generates the Zip Sim worlds for a range of seeds")
+    parser.add_argument('path', help='The corpus file to write')
+    parser.add_argument('--seeds', type=int, nargs=2, metavar=("START", "STOP"), required=True,
+                        help='Generate every seed from START up to (but not including) STOP')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        help='Number of worlds to generate at once (defaults to the number of CPUs)')
+    parser.add_argument('--world-generator', choices=sorted(WORLD_GENERATORS), default="rejection",
+                        help='How to generate the worlds (see zip_sim.WORLD_GENERATORS)')
+    args = parser.parse_args()
+    if args.seeds[1] <= args.seeds[0]:
+        parser.error("STOP has to be after START")
+    build_corpus(args.path, *args.seeds, jobs=args.jobs, generator=args.world_generator)
+
+
+if __name__ == "__main__":
+    main()
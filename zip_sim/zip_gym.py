@@ -0,0 +1,135 @@
+"""
+A vectorized reinforcement learning environment over zip_sim, in the style of Gymnasium's VectorEnv.
+
+Every call to step() advances many worlds at once with BatchZipSimulation, with no pilot processes, pipes or message
+packing in between. The observation of each world is a row of float32s:
+
+    recovery x error, recovery y error, wind x, wind y, 31 lidar samples
+
+which are the telemetry fields a pilot process would get. The action of each world is (lateral airspeed, drop
+flag), with a package dropped when the flag is over 0.5.
+
+Rewards are made of the outcomes the sim reports at exit: every delivery, every ZIPAA violation, and how the flight
+ended (see STATUS_REWARDS). A package is credited as soon as it's dropped, where it's going to land, so the rewards
+of an episode add up to exactly its final score. The outcomes themselves are in the infos, for training on some other
+score.
+
+Worlds that finish are reset in the same step, with the next seed in line: the observation returned for them is the
+first of the new episode, and infos["final_obs"] holds the last one of the episode that ended.
+
+    env = ZipVectorEnv(num_envs=256)
+    observations, infos = env.reset(seed=0)
+    while training:
+        observations, rewards, terminations, truncations, infos = env.step(policy(observations))
+
+Gymnasium is optional. With it installed, the environment is a gymnasium.vector.VectorEnv with observation and
+action spaces; without it, it works just the same for trainers that don't need them.
+"""
+import random
+
+import numpy as np
+
+from zip_sim import (RECOVERED, PARALANDED, CRASHED, LIDAR_ANGLES, LIDAR_MAX_DISTANCE, MAX_WINDSPEED_M_S, WORLD_LENGTH,
+                     WORLD_WIDTH_HALF)
+from batch_sim import RUNNING, BatchZipSimulation
+
+try:
+    import gymnasium
+    from gymnasium import spaces
+    # Newer versions of Gymnasium spell out how a vector environment resets.
+    AUTORESET_MODE = getattr(gymnasium.vector, "AutoresetMode", None)
+    AUTORESET_MODE = "SameStep" if AUTORESET_MODE is None else AUTORESET_MODE.SAME_STEP
+except ImportError:
+    gymnasium = None
+    AUTORESET_MODE = "SameStep"
+
+# Rewards for each outcome of an episode
+DELIVERY_REWARD = 1.0
+ZIPAA_VIOLATION_REWARD = -1.0
+STATUS_REWARDS = {RECOVERED: 1.0, PARALANDED: 0.0, CRASHED: -1.0}
+
+NUM_OBSERVATIONS = 4 + len(LIDAR_ANGLES)
+MAX_LATERAL_AIRSPEED = 30.0
+
+
+class ZipVectorEnv(gymnasium.vector.VectorEnv if gymnasium is not None else object):
+    """ num_envs worlds of the sim, stepped together, each reset as soon as its episode is over. """
+
+    metadata = {"autoreset_mode": AUTORESET_MODE}
+
+    def __init__(self, num_envs, corpus=None, world_generator="rejection", delivery_reward=DELIVERY_REWARD,
+                 zipaa_violation_reward=ZIPAA_VIOLATION_REWARD, status_rewards=STATUS_REWARDS, wind_model="walk"):
+        self.num_envs = num_envs
+        self.delivery_reward = delivery_reward
+        self.zipaa_violation_reward = zipaa_violation_reward
+        self._status_rewards = np.zeros(max(status_rewards) + 1)
+        for status, reward in status_rewards.items():
+            self._status_rewards[status] = reward
+        self._next_seed = 0
+        self._score = np.zeros(num_envs)
+        self.sim = BatchZipSimulation(self._take_seeds(num_envs), corpus, world_generator, wind_model)
+        if gymnasium is not None:
+            self.single_observation_space = spaces.Box(
+                np.array([-WORLD_LENGTH, -WORLD_WIDTH_HALF, -MAX_WINDSPEED_M_S, -MAX_WINDSPEED_M_S] +
+                         [0.0] * len(LIDAR_ANGLES), dtype=np.float32),
+                np.array([WORLD_LENGTH, WORLD_WIDTH_HALF, MAX_WINDSPEED_M_S, MAX_WINDSPEED_M_S] +
+                         [LIDAR_MAX_DISTANCE] * len(LIDAR_ANGLES), dtype=np.float32))
+            self.single_action_space = spaces.Box(np.array([-MAX_LATERAL_AIRSPEED, 0.0], dtype=np.float32),
+                                                  np.array([MAX_LATERAL_AIRSPEED, 1.0], dtype=np.float32))
+            self.observation_space = spaces.Box(np.tile(self.single_observation_space.low, (num_envs, 1)),
+                                                np.tile(self.single_observation_space.high, (num_envs, 1)))
+            self.action_space = spaces.Box(np.tile(self.single_action_space.low, (num_envs, 1)),
+                                           np.tile(self.single_action_space.high, (num_envs, 1)))
+
+    def _take_seeds(self, count):
+        """ Returns the next count seeds in line. """
+        seeds = range(self._next_seed, self._next_seed + count)
+        self._next_seed += count
+        return seeds
+
+    def reset(self, seed=None, options=None):
+        """ Starts new episodes in every world, with seeds counting up from seed (a random one if None). Returns the
+        observations and infos. """
+        if seed is None:
+            seed = random.SystemRandom().getrandbits(32)
+        self._next_seed = seed
+        self.sim.reset(self._take_seeds(self.num_envs))
+        self._score[:] = 0.0
+        return self._observe(self.sim.telemetry()), {"seed": np.array(self.sim.seeds)}
+
+    def step(self, actions):
+        """ Advances every world by one tick. actions has a (lateral airspeed, drop flag) row per world. Returns the
+        observations, rewards, terminations, truncations and infos. """
+        actions = np.asarray(actions)
+        observations = self._observe(self.sim.step(actions[:, 0], actions[:, 1] > 0.5))
+
+        deliveries, zipaa_violations = self.sim.result()
+        score = self.delivery_reward * deliveries + self.zipaa_violation_reward * zipaa_violations
+        rewards = score - self._score
+        self._score = score
+        status = self.sim.status.copy()
+        terminations = status != RUNNING
+        rewards[terminations] += self._status_rewards[status[terminations]]
+
+        infos = {"seed": np.array(self.sim.seeds), "status": status, "deliveries": deliveries,
+                 "zipaa_violations": zipaa_violations}
+        if terminations.any():
+            infos["final_obs"] = observations.copy()
+            finished = np.flatnonzero(terminations)
+            self.sim.reset_worlds(finished, self._take_seeds(len(finished)))
+            self._score[finished] = 0.0
+            observations[finished] = self._observe(self.sim.telemetry())[finished]
+        return observations, rewards.astype(np.float32), terminations, np.zeros(self.num_envs, dtype=bool), infos
+
+    def _observe(self, telemetry):
+        """ Returns the observations of every world, from its BatchTelemetry. """
+        observations = np.empty((self.num_envs, NUM_OBSERVATIONS), dtype=np.float32)
+        observations[:, 0] = telemetry.recovery_x_error
+        observations[:, 1] = telemetry.recovery_y_error
+        observations[:, 2] = telemetry.wind_vector_x
+        observations[:, 3] = telemetry.wind_vector_y
+        observations[:, 4:] = telemetry.lidar_samples
+        return observations
+
+    def close(self, **kwargs):
+        pass
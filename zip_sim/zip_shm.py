@@ -0,0 +1,175 @@
+"""
+Shared-memory transport between zip_sim and a pilot process, as an alternative to the stdin/stdout pipes.
+
+The sim and the pilot share one small segment holding a telemetry slot and a command slot, each guarded by a sequence
+number that's bumped after the slot is written. The side waiting for the other spins on the sequence number for a
+moment (on machines with more than one CPU), then sleeps on a pipe. Like a futex, the pipe is only used when someone
+is asleep on it: before sleeping, the waiter raises a sleeping flag next to the sequence number and checks the
+sequence number once more, and the writing side only puts a byte in the pipe if it sees the flag after publishing.
+Python can't order the flag and the sequence number with a memory fence, so a sleeper also wakes up to check on its
+own every SLEEP_TIMEOUT_MS, in case both sides missed each other. A waiter that was woken needlessly just finds the
+sequence number unchanged and goes back to sleep. When either side exits, the other sees its pipe close.
+
+The sim passes the segment name and the pilot's ends of the pipes to the pilot in the ZIP_SIM_SHM environment
+variable. A pilot uses it like this:
+
+    with PilotChannel.from_environment() as channel:
+        while True:
+            telemetry = channel.read_telemetry()
+            if telemetry is None:
+                break  # The sim is done
+            channel.write_command(lateral_airspeed, drop_package_commanded)
+"""
+import os
+import select
+import struct
+import subprocess
+import sys
+from multiprocessing import resource_tracker, shared_memory
+
+from zip_sim import TELEMETRY_STRUCT, COMMAND_STRUCT
+
+ENVIRONMENT_VARIABLE = "ZIP_SIM_SHM"
+
+# Layout of the segment
+SEQUENCE_STRUCT = struct.Struct("<I")
+TELEMETRY_SEQUENCE_OFFSET = 0
+COMMAND_SEQUENCE_OFFSET = 4
+# Each sequence number's sleeping flag, set while the side waiting for it is asleep on its pipe
+SLEEPING_OFFSET = 8
+TELEMETRY_OFFSET = 16
+COMMAND_OFFSET = 64
+SEGMENT_SIZE = COMMAND_OFFSET + COMMAND_STRUCT.size
+assert TELEMETRY_OFFSET + TELEMETRY_STRUCT.size <= COMMAND_OFFSET
+
+# How many times to check for the other side before going to sleep. Each check takes a fraction of a microsecond.
+# With a single CPU, spinning only keeps the other side from running.
+SPIN_COUNT = 500 if (os.cpu_count() or 1) > 1 else 0
+# How long a sleeper waits for the pipe before checking the sequence number again anyway
+SLEEP_TIMEOUT_MS = 10
+
+
+def attach_segment(name):
+    """ Attaches to a shared memory segment that another process owns and will unlink. """
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        # Before Python 3.13, attaching registers the segment to be destroyed when this process exits. The owner
+        # will do that, so undo it.
+        segment = shared_memory.SharedMemory(name)
+        resource_tracker.unregister(segment._name, "shared_memory")
+        return segment
+
+
+class Channel():
+    """ The half of the transport common to both sides. Waits on one pipe and wakes the other side with the other. """
+
+    def __init__(self, segment, wait_fd, notify_fd):
+        self._segment = segment
+        self._buffer = segment.buf
+        self._wait_fd = wait_fd
+        self._notify_fd = notify_fd
+        # Never block on a full pipe. A full pipe is sure to wake the other side anyway.
+        os.set_blocking(notify_fd, False)
+        self._poll = select.poll()
+        self._poll.register(wait_fd, select.POLLIN)
+        self._sequence = 0
+
+    def _publish(self, sequence_offset):
+        """ Announces that a slot has been written, waking the other side if it's asleep. """
+        buffer = self._buffer
+        SEQUENCE_STRUCT.pack_into(buffer, sequence_offset, self._sequence)
+        if buffer[SLEEPING_OFFSET + sequence_offset]:
+            try:
+                os.write(self._notify_fd, b"\0")
+            except (BlockingIOError, BrokenPipeError):
+                pass  # The other side is either sure to wake up, or gone.
+
+    def _wait(self, sequence_offset):
+        """ Waits for the other side to publish the current sequence number. Returns False if the other side went
+        away first. """
+        buffer = self._buffer
+        sequence = self._sequence
+        for _ in range(SPIN_COUNT):
+            if SEQUENCE_STRUCT.unpack_from(buffer, sequence_offset)[0] == sequence:
+                return True
+        sleeping_offset = SLEEPING_OFFSET + sequence_offset
+        try:
+            while True:
+                # Raise the flag before the last check, so that anything published after the check sees it.
+                buffer[sleeping_offset] = 1
+                if SEQUENCE_STRUCT.unpack_from(buffer, sequence_offset)[0] == sequence:
+                    return True
+                if self._poll.poll(SLEEP_TIMEOUT_MS) and not os.read(self._wait_fd, 4096):
+                    # The other side closed its pipe. It may have published on its way out.
+                    return SEQUENCE_STRUCT.unpack_from(buffer, sequence_offset)[0] == sequence
+        finally:
+            buffer[sleeping_offset] = 0
+
+    def close(self):
+        del self._buffer
+        self._segment.close()
+        os.close(self._wait_fd)
+        os.close(self._notify_fd)
+
+
+class SharedMemoryPilot(Channel):
+    """ The sim's side of the transport. Launches the pilot process and is used just like a PilotProcess. """
+
+    def __init__(self, command):
+        segment = shared_memory.SharedMemory(create=True, size=SEGMENT_SIZE)
+        segment.buf[:SEGMENT_SIZE] = bytes(SEGMENT_SIZE)
+        telemetry_read_fd, telemetry_write_fd = os.pipe()
+        command_read_fd, command_write_fd = os.pipe()
+        super().__init__(segment, command_read_fd, telemetry_write_fd)
+        environment = dict(os.environ)
+        environment[ENVIRONMENT_VARIABLE] = "{}:{}:{}".format(segment.name, telemetry_read_fd, command_write_fd)
+        # The pilot's stdout goes to stderr so that it can't mix with the sim's results.
+        self._process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=sys.stderr, env=environment,
+                                         pass_fds=(telemetry_read_fd, command_write_fd))
+        # Only the pilot holds its ends, so that each side sees the pipe close when the other goes away.
+        os.close(telemetry_read_fd)
+        os.close(command_write_fd)
+
+    def command(self, telemetry):
+        """ Sends the telemetry tuple to the pilot. Returns its (lateral_airspeed, drop_package_commanded), or None
+        if the pilot has exited. """
+        self._sequence = (self._sequence + 1) & 0xFFFFFFFF
+        TELEMETRY_STRUCT.pack_into(self._buffer, TELEMETRY_OFFSET, *telemetry)
+        self._publish(TELEMETRY_SEQUENCE_OFFSET)
+        if not self._wait(COMMAND_SEQUENCE_OFFSET):
+            return None
+        lateral_airspeed, drop_package_commanded_byte, _ = COMMAND_STRUCT.unpack_from(self._buffer, COMMAND_OFFSET)
+        return lateral_airspeed, bool(drop_package_commanded_byte)
+
+    def close(self):
+        super().close()
+        self._process.wait()
+        self._segment.unlink()
+
+
+class PilotChannel(Channel):
+    """ The pilot's side of the transport. """
+
+    @classmethod
+    def from_environment(cls):
+        name, telemetry_read_fd, command_write_fd = os.environ[ENVIRONMENT_VARIABLE].split(":")
+        return cls(attach_segment(name), int(telemetry_read_fd), int(command_write_fd))
+
+    def read_telemetry(self):
+        """ Waits for the next telemetry message. Returns its fields as a tuple, or None once the sim is done. """
+        self._sequence = (self._sequence + 1) & 0xFFFFFFFF
+        if not self._wait(TELEMETRY_SEQUENCE_OFFSET):
+            return None
+        return TELEMETRY_STRUCT.unpack_from(self._buffer, TELEMETRY_OFFSET)
+
+    def write_command(self, lateral_airspeed, drop_package_commanded):
+        COMMAND_STRUCT.pack_into(self._buffer, COMMAND_OFFSET, lateral_airspeed, int(bool(drop_package_commanded)),
+                                 b"")
+        self._publish(COMMAND_SEQUENCE_OFFSET)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,14 +1,26 @@
 import argparse
+import array
+import bisect
+import collections
+import functools
+import importlib
+import importlib.util
 import math
 import os
 import random
+import select
 import sys
 import subprocess
 import struct
+import time
+import traceback
+import weakref
 
-# Suppress hello from pygame so that stdout is clean
-os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
-import pygame  # noqa
+import numpy as np
+
+# pygame is only imported once something needs to be drawn (see import_pygame()), so that headless runs don't pay
+# for it.
+pygame = None
 
 # The time step of the simulation. 60Hz is chosen to work well on most displays that are 60Hz.
 DT_SEC = 1 / 60.0
@@ -18,6 +30,15 @@ VISUALIZER_RATES = [m / DT_SEC for m in (0.0625, 0.125, 0.25, 0.5, 1.0, 2.0, 4.0
 INITIAL_VISUALIZER_RATE_INDEX = 4
 # How fast to poll the UI when paused, since it's no longer coupled to the sim rate.
 PAUSED_RATE = 30
+# In turbo mode, the sim runs as fast as it can and only this many frames per second are drawn.
+TURBO_FRAME_RATE = 60
+# How often the turbo mode's ticks per second readout is updated.
+TICK_RATE_PERIOD_SEC = 0.5
+# The terrain, trees, delivery sites and distribution center never move, so they're drawn once into strips this long
+# (in meters along the world X axis) and the strips are reused every frame. Only the few strips nearest the camera are
+# kept.
+STATIC_STRIP_LENGTH = 100.0
+STATIC_STRIP_CACHE_SIZE = 4
 
 # The world size in meters. It's a bit weird because the world wraps around itself. The world's coordinate system is
 # always considered to be in the positive quadrant (coordinates in the world frame are always >= 0).
@@ -52,11 +73,24 @@ RECOVERY_Y_MAX = WORLD_WIDTH - 7.5
 NUM_DELIVERY_SITES = 10
 TYPICAL_NUM_TREES = 20
 MAX_NUM_TREES = 100
+# How many delivery sites and trees the stress-test worlds in WORLD_GENERATORS ask for. Only as many delivery sites
+# as fit MIN_DELIVERY_DISTANCE apart are placed, which is usually 12 to 16.
+CROWDED_NUM_DELIVERY_SITES = 20
+DENSE_NUM_TREES = 500
 
 # The vehicle always moves with constant forward airspeed. Its groundspeed varies based on the wind.
 VEHICLE_AIRSPEED = 30.0
 MAX_WINDSPEED_M_S = 20.0
 
+# The ways the wind can be driven: Wind's random walk, drawn a tick at a time from the world's random number
+# generator, or the same walk precomputed as a WindTrace, from a NumPy generator of its own.
+WIND_MODELS = ["walk", "trace"]
+# A WindTrace is generated this many ticks at a time, which lasts the slowest flight to the recovery point, flown
+# into a headwind at MAX_WINDSPEED_M_S the whole way.
+WIND_TRACE_TICKS = math.ceil(RECOVERY_X / (VEHICLE_AIRSPEED - MAX_WINDSPEED_M_S) / DT_SEC)
+# Mixed into the seed of a WindTrace's random number generator, so that its stream is its own
+WIND_TRACE_STREAM = 1
+
 # Coordinates to keep generated delivery sites within.
 DELIVERY_SITE_X_BOUNDS = (100.0, WORLD_LENGTH - 100.0)  # Avoid distribution center
 DELIVERY_SITE_Y_BOUNDS = (-WORLD_WIDTH_HALF + 5.0, WORLD_WIDTH_HALF - 5.0)  # Avoid wrap-around
@@ -66,6 +100,9 @@ MIN_DELIVERY_DISTANCE = 100.0
 TREE_X_BOUNDS = (50.0, WORLD_LENGTH - 50.0)  # Avoid distribution center
 # Minimum distance from trees to delivery sites. Trees are allowed to overlap.
 MIN_TREE_DISTANCE = 10.0
+# How many random positions the grid-accelerated generator tries for each delivery site or tree before giving up on
+# it, rather than searching forever in a world that's too crowded to fit it.
+MAX_PLACEMENT_ATTEMPTS = 100
 
 # The max distance the lidar works to. Any ray that travels farther will be reported as 0.
 LIDAR_MAX_DISTANCE = 255
@@ -91,6 +128,16 @@ TREE_LIDAR_RADIUS = 3.0
 # 31 lidar samples [31 bytes]
 TELEMETRY_STRUCT = struct.Struct(">Hhffb31B")
 COMMAND_STRUCT = struct.Struct(">fB3s")
+# Floats in the API messages are single precision
+FLOAT32_STRUCT = struct.Struct(">f")
+
+# How long pilots take to answer is counted in bins this many to a decade, from a microsecond up.
+LATENCY_BINS_PER_DECADE = 10
+LATENCY_MIN_SEC = 1e-6
+# What a pilot with a deadline answers when it didn't answer in time
+PILOT_LATE = object()
+# What becomes of a pilot that misses its deadline: it's taken to hold its last command, or to have crashed.
+LATE_PILOT_POLICIES = ["hold", "crash"]
 
 # Return codes for why the simulation ended
 RECOVERED = 0
@@ -98,9 +145,45 @@ PARALANDED = 1
 CRASHED = 2
 SIM_QUIT = 3
 
+# What a pilot can answer instead of a command to end the episode as if the sim had been quit, as a replay of a quit
+# episode does (see recording.py)
+PILOT_QUIT = "quit"
+
 
+def import_pygame():
+    global pygame
+    if pygame is None:
+        # Suppress hello from pygame so that stdout is clean
+        os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
+        import pygame as pygame_module
+        pygame = pygame_module
+    return pygame
+
+
+@functools.lru_cache(maxsize=None)
 def load_image(name):
-    return pygame.image.load(os.path.join(os.path.dirname(__file__), "art", name))
+    image = import_pygame().image.load(os.path.join(os.path.dirname(__file__), "art", name))
+    # Images in the display's pixel format blit several times faster, but converting them needs a display.
+    if pygame.display.get_surface() is not None:
+        image = image.convert_alpha()
+    return image
+
+
+def on_screen(sprites, width=SCREEN_WIDTH, height=SCREEN_HEIGHT):
+    """ Culls a list of (image, position) sprites down to the ones that land on a surface of the given size. """
+    return [(image, pos) for image, pos in sprites
+            if -image.get_width() < pos[0] < width and -image.get_height() < pos[1] < height]
+
+
+class Sprite():
+    """ A class attribute holding an image that's only loaded the first time it's used. """
+    __slots__ = ["_name"]
+
+    def __init__(self, name):
+        self._name = name
+
+    def __get__(self, instance, owner):
+        return load_image(self._name)
 
 
 class Entity():
@@ -114,6 +197,13 @@ class Entity():
         v_x, v_y = delta
         self.position = ((self.position[0] + v_x) % WORLD_LENGTH, (self.position[1] + v_y) % WORLD_WIDTH)
 
+    def sprites(self, camera):
+        """ Returns the (image, position) pairs to blit to draw this entity. """
+        return []
+
+    def draw(self, camera, surface):
+        surface.blits(self.sprites(camera), doreturn=False)
+
     def distance_to(self, position):
         delta_x = abs(self.position[0] - position[0])
         delta_y = abs(self.position[1] - position[1])
@@ -150,8 +240,8 @@ class Camera(Entity):
 class Package(Entity):
     __slots__ = ["_velocity", "_fall_duration"]
 
-    _parachute_image = load_image("package_parachute.png")
-    _package_image = load_image("package.png")
+    _parachute_image = Sprite("package_parachute.png")
+    _package_image = Sprite("package.png")
 
     def __init__(self, position, velocity, fall_duration=PACKAGE_FALL_SEC):
         super().__init__(position)
@@ -163,13 +253,19 @@ class Package(Entity):
         self._fall_duration -= dt
         self.move((dt * self._velocity[0], dt * self._velocity[1]))
 
-    def draw(self, camera, surface):
-        for projected_pos in camera.project(self.position):
-            if self._fall_duration > 0:
-                surface.blit(self._parachute_image, (projected_pos[0] - 4, projected_pos[1] - 4))
+    def landing_position(self):
+        """ Returns where the package will come to rest, without moving it. """
+        landed = Entity(self.position)
+        landed.move((self._fall_duration * self._velocity[0], self._fall_duration * self._velocity[1]))
+        return landed.position
 
-            else:
-                surface.blit(self._package_image, (projected_pos[0] - 4, projected_pos[1] - 4))
+    @property
+    def fall_duration(self):
+        return self._fall_duration
+
+    def sprites(self, camera):
+        image = self._parachute_image if self._fall_duration > 0 else self._package_image
+        return [(image, (pos[0] - 4, pos[1] - 4)) for pos in camera.project(self.position)]
 
 
 class Circle(Entity):
@@ -191,7 +287,7 @@ class Circle(Entity):
 
 class Zip(Circle):
     __slots__ = []
-    _image = load_image("zip.png")
+    _image = Sprite("zip.png")
 
     def __init__(self):
         super().__init__(position=(0.0, 0.0), radius=1.6)
@@ -203,21 +299,19 @@ class Zip(Circle):
         v_x, v_y = self.get_velocity(lateral_airspeed, windspeed_vector)
         self.move((dt * v_x, dt * v_y))
 
-    def draw(self, camera, surface):
-        for projected_pos in camera.project(self.position):
-            surface.blit(self._image, (projected_pos[0] - 16, projected_pos[1] - 16))
+    def sprites(self, camera):
+        return [(self._image, (pos[0] - 16, pos[1] - 16)) for pos in camera.project(self.position)]
 
 
 class DeliverySite(Circle):
     __slots__ = []
-    _image = load_image("delivery_site.png")
+    _image = Sprite("delivery_site.png")
 
     def __init__(self, position):
         super().__init__(position, radius=DELIVERY_SITE_RADIUS)
 
-    def draw(self, camera, surface):
-        for projected_pos in camera.project(self.position):
-            surface.blit(self._image, (projected_pos[0] - 64, projected_pos[1] - 64))
+    def sprites(self, camera):
+        return [(self._image, (pos[0] - 64, pos[1] - 64)) for pos in camera.project(self.position)]
 
     def make_lidar_object(self):
         return Circle(self.position, radius=DELIVERY_SITE_LIDAR_RADIUS)
@@ -225,45 +319,316 @@ class DeliverySite(Circle):
 
 class Tree(Circle):
     __slots__ = []
-    _image = load_image("tree.png")
+    _image = Sprite("tree.png")
 
     def __init__(self, position):
         super().__init__(position, radius=TREE_COLLISION_RADIUS)
 
-    def draw(self, camera, surface):
-        for projected_pos in camera.project(self.position):
-            surface.blit(self._image, (projected_pos[0] - 32, projected_pos[1] - 32))
+    def sprites(self, camera):
+        return [(self._image, (pos[0] - 32, pos[1] - 32)) for pos in camera.project(self.position)]
 
     def make_lidar_object(self):
         return Circle(self.position, radius=TREE_LIDAR_RADIUS)
 
 
+class SpatialIndex():
+    """ A static index of entities sorted along the world X axis, for finding the ones near a stretch of the world. """
+    __slots__ = ["entities", "_x"]
+
+    def __init__(self, entities):
+        self.entities = sorted(entities, key=lambda e: e.position[0])
+        self._x = [e.position[0] for e in self.entities]
+
+    def span(self, x_min, x_max):
+        """ Returns the (start, stop) slice of entities with x_min < x <= x_max. Doesn't wrap around. """
+        return bisect.bisect_right(self._x, x_min), bisect.bisect_right(self._x, x_max)
+
+    def near(self, x, distance):
+        """ Returns the entities within distance of x along the X axis, wrapping around the end of the world. """
+        x_min = x - distance
+        x_max = x + distance
+        nearby = self.entities[bisect.bisect_left(self._x, x_min):bisect.bisect_right(self._x, x_max)]
+        if x_min < 0.0:
+            nearby += self.entities[bisect.bisect_left(self._x, x_min + WORLD_LENGTH):]
+        if x_max >= WORLD_LENGTH:
+            nearby += self.entities[:bisect.bisect_right(self._x, x_max - WORLD_LENGTH)]
+        return nearby
+
+
 class Wind():
-    __slots__ = ["_speed", "_direction"]
+    __slots__ = ["_speed", "_direction", "_rng"]
 
-    def __init__(self):
-        self._speed = random.uniform(0.0, MAX_WINDSPEED_M_S)
-        self._direction = random.uniform(0.0, 2 * math.pi)
+    def __init__(self, rng=random):
+        self._rng = rng
+        self._speed = rng.uniform(0.0, MAX_WINDSPEED_M_S)
+        self._direction = rng.uniform(0.0, 2 * math.pi)
+
+    @classmethod
+    def restore(cls, rng, speed, direction):
+        """ Re-creates a wind from its state(), continuing its random walk from the given random number generator. """
+        wind = cls.__new__(cls)
+        wind._rng = rng
+        wind._speed = speed
+        wind._direction = direction
+        return wind
+
+    def state(self):
+        return self._speed, self._direction
 
     def update(self, dt):
         # TODO: Scale sigma?
-        self._speed = max(0.0, min(MAX_WINDSPEED_M_S, self._speed + random.gauss(0.0, dt * 10)))
-        self._direction = (self._direction + random.gauss(0.0, dt)) % (2 * math.pi)
+        self._speed = max(0.0, min(MAX_WINDSPEED_M_S, self._speed + self._rng.gauss(0.0, dt * 10)))
+        self._direction = (self._direction + self._rng.gauss(0.0, dt)) % (2 * math.pi)
 
     @property
     def vector(self):
         return (self._speed * math.cos(self._direction), self._speed * math.sin(self._direction))
 
 
+class WindTape():
+    """ The states a wind goes through, one per tick, recorded as they're first needed. The wind's random walk only
+    depends on how many ticks it has been updated, so a wind can be rewound to any tick on the tape for free and run
+    forward again through exactly the same weather. Like a WindTrace, it only keeps the ticks from the earliest one
+    any of its players is at. """
+    __slots__ = ["_wind", "_states", "_start", "_players", "_forget_at"]
+
+    def __init__(self, wind):
+        # Takes over the wind, which is kept at the end of the tape from then on
+        self._wind = wind
+        self._states = [wind.state()]
+        # The tick of the first state kept
+        self._start = 0
+        # The winds playing the tape, including those held by snapshots
+        self._players = weakref.WeakSet()
+        # How many states the tape holds before it next forgets the ones no player can get back to. Doubles with what's
+        # kept, so that forgetting costs next to nothing a tick.
+        self._forget_at = WIND_TRACE_TICKS
+
+    def __len__(self):
+        """ Returns the number of ticks of the tape kept. """
+        return len(self._states)
+
+    def _forget(self):
+        """ Forgets the states before the earliest tick any player is at. """
+        if self._players:
+            forget = min(min(p._tick for p in self._players) - self._start, len(self._states))
+            if forget > 0:
+                del self._states[:forget]
+                self._start += forget
+        self._forget_at = max(2 * len(self._states), WIND_TRACE_TICKS)
+
+    def play(self, tick=0):
+        """ Returns a wind that plays the tape from the given tick on. """
+        return TapedWind(self, tick)
+
+    def state(self, tick):
+        """ Returns the (speed, direction) of the wind the given number of ticks after the start of the tape. """
+        states = self._states
+        while tick - self._start >= len(states):
+            if len(states) >= self._forget_at:
+                self._forget()
+                continue
+            self._wind.update(DT_SEC)
+            states.append(self._wind.state())
+        return states[tick - self._start]
+
+
+class TapedWind(Wind):
+    """ A wind that plays back a WindTape, one tick every update(). """
+    __slots__ = ["_tape", "_tick", "__weakref__"]
+
+    def __init__(self, tape, tick=0):
+        self._rng = None
+        self._tape = tape
+        self._tick = tick
+        self._speed, self._direction = tape.state(tick)
+        tape._players.add(self)
+
+    def update(self, dt):
+        # The tape is recorded DT_SEC apart, the only time step the sim takes.
+        self._tick += 1
+        self._speed, self._direction = self._tape.state(self._tick)
+
+
+def clamped_walk(start, steps, low, high):
+    """ Returns every position of a random walk from start, taking the given steps and clamped to between low and high
+    after each one, as an array. Computed with cumulative sums and extrema over the steps, a pass per time the walk
+    goes from being held up by one bound to being held down by the other. """
+    walk = np.empty(len(steps))
+    i = 0
+    value = start
+    held_up = True
+    while i < len(steps):
+        free = value + np.cumsum(steps[i:])
+        # Held at one bound, the walk is the free walk shifted by how far past the bound it has ever gone.
+        if held_up:
+            clamped = free - np.minimum.accumulate(np.minimum(free - low, 0.0))
+            escaped = clamped > high
+        else:
+            clamped = free - np.maximum.accumulate(np.maximum(free - high, 0.0))
+            escaped = clamped < low
+        stop = np.argmax(escaped) if escaped.any() else len(clamped)
+        walk[i:i + stop] = clamped[:stop]
+        if stop == len(clamped):
+            break
+        i += stop
+        walk[i] = value = high if held_up else low
+        i += 1
+        held_up = not held_up
+    return walk
+
+
+class WindTrace():
+    """ The whole random walk of a wind, generated ahead of time from a NumPy random number generator of its own, a
+    block of WIND_TRACE_TICKS at a time, rather than a gaussian draw at a time from the world's. It walks the way
+    Wind does, but since nothing else draws from its generator, it's the same for a seed however the sim is run.
+
+    It has the same state(tick) and play() as a WindTape, so snapshots share it just the same. Only the ticks from
+    the earliest one any of its players is at are kept, so that a trace played for ever doesn't grow for ever. A
+    trace that's looked up without playing it (see batch_sim.py) keeps every tick. """
+    __slots__ = ["_rng", "_speed", "_direction", "_x", "_y", "_start", "_players"]
+
+    def __init__(self, seed=None):
+        # NumPy only seeds from non-negative integers, so negative seeds are taken as their absolute value, as
+        # random.seed() does for Wind
+        self._rng = np.random.default_rng(None if seed is None else [abs(seed), WIND_TRACE_STREAM])
+        self._speed = array.array("d", [self._rng.uniform(0.0, MAX_WINDSPEED_M_S)])
+        self._direction = array.array("d", [self._rng.uniform(0.0, 2 * math.pi)])
+        self._x = array.array("d")
+        self._y = array.array("d")
+        # The tick of the first one kept
+        self._start = 0
+        # The winds playing the trace, including those held by snapshots
+        self._players = weakref.WeakSet()
+        self._extend()
+
+    def __len__(self):
+        """ Returns the number of ticks of the trace kept. """
+        return len(self._speed)
+
+    def _extend(self):
+        self._forget()
+        speed = clamped_walk(self._speed[-1], self._rng.normal(0.0, DT_SEC * 10, WIND_TRACE_TICKS), 0.0,
+                             MAX_WINDSPEED_M_S)
+        direction = (self._direction[-1] + np.cumsum(self._rng.normal(0.0, DT_SEC, WIND_TRACE_TICKS))) % (2 * math.pi)
+        self._speed.frombytes(speed.tobytes())
+        self._direction.frombytes(direction.tobytes())
+        # Wind.vector, for the new ticks and the one before them
+        start = len(self._x)
+        self._x.frombytes((self._speed[start:] * np.cos(self._direction[start:])).tobytes())
+        self._y.frombytes((self._speed[start:] * np.sin(self._direction[start:])).tobytes())
+
+    def _forget(self):
+        """ Forgets the ticks before the earliest one any player is at, keeping the last tick to walk on from. """
+        if not self._players:
+            return
+        forget = min(min(p._tick for p in self._players) - self._start, len(self._speed) - 1)
+        if forget > 0:
+            for ticks in (self._speed, self._direction, self._x, self._y):
+                del ticks[:forget]
+            self._start += forget
+
+    def play(self, tick=0):
+        """ Returns a wind that plays the trace from the given tick on. """
+        return TracedWind(self, tick)
+
+    def state(self, tick):
+        """ Returns the (speed, direction) of the wind the given number of ticks after the start of the trace. """
+        while tick - self._start >= len(self._speed):
+            self._extend()
+        return self._speed[tick - self._start], self._direction[tick - self._start]
+
+    def vector(self, tick):
+        """ Returns the wind's (x, y) vector the given number of ticks after the start of the trace. """
+        while tick - self._start >= len(self._x):
+            self._extend()
+        return self._x[tick - self._start], self._y[tick - self._start]
+
+    def vectors(self, start, stop):
+        """ Returns arrays of the wind's X and Y from tick start up to (but not including) tick stop. """
+        while stop - self._start > len(self._x):
+            self._extend()
+        start -= self._start
+        stop -= self._start
+        return np.frombuffer(self._x[start:stop]), np.frombuffer(self._y[start:stop])
+
+
+class TracedWind(TapedWind):
+    """ A wind that plays back a WindTrace, one tick every update(), with the vector the trace worked out. """
+    __slots__ = []
+
+    @property
+    def vector(self):
+        return self._tape.vector(self._tick)
+
+
 class Terrain():
     __slots__ = []
-    _image = load_image("terrain.png")
+    _image = Sprite("terrain.png")
+
+    def sprites(self, camera):
+        return [(self._image, (pos[0] - 250, pos[1] - 1000))
+                for x in range(0, int(WORLD_LENGTH), 100) for pos in camera.project((x, 0.0))]
 
     def draw(self, camera, surface):
-        # There's probably a better way to do this, but as long as it works...
-        for x in range(0, int(WORLD_LENGTH), 100):
-            for projected_pos in camera.project((x, 0.0)):
-                surface.blit(self._image, (projected_pos[0] - 250, projected_pos[1] - 1000))
+        surface.blits(self.sprites(camera), doreturn=False)
+
+
+class DistributionCenter():
+    __slots__ = []
+    _image = Sprite("distribution_center.png")
+
+    def sprites(self, camera):
+        return [(self._image, (pos[0] - 250, pos[1] - 100)) for pos in camera.project((0.0, 0.0))]
+
+
+class StaticLayer():
+    """ Draws everything that never moves (the terrain, distribution center, trees and delivery sites) from strips
+    of the world that are composited once, then blitted whole every frame. """
+    __slots__ = ["_sprites", "_strips", "_trees", "_delivery_sites"]
+
+    def __init__(self):
+        self._sprites = [Terrain(), DistributionCenter()]
+        self._strips = collections.OrderedDict()
+        self._trees = None
+        self._delivery_sites = None
+
+    def draw(self, camera, surface, trees, delivery_sites):
+        if trees is not self._trees or delivery_sites is not self._delivery_sites:
+            # A new world
+            self._strips.clear()
+            self._trees = trees
+            self._delivery_sites = delivery_sites
+        camera_x = camera.position[0]
+        view_half = SCREEN_HEIGHT_HALF / camera.scale(1.0)
+        num_strips = math.ceil(WORLD_LENGTH / STATIC_STRIP_LENGTH)
+        first = math.floor((camera_x - view_half) / STATIC_STRIP_LENGTH)
+        last = math.floor((camera_x + view_half) / STATIC_STRIP_LENGTH)
+        blits = []
+        for index in range(first, last + 1):
+            index %= num_strips
+            strip = self._strip(index)
+            # Strips are drawn as if the camera were over world Y = 0, and shifted (wrapping) to where it really is.
+            for pos in camera.project(((index + 1) * STATIC_STRIP_LENGTH, 0.0)):
+                blits.append((strip, (pos[0] - SCREEN_WIDTH_HALF, pos[1])))
+        surface.blits(blits, doreturn=False)
+
+    def _strip(self, index):
+        strip = self._strips.get(index)
+        if strip is not None:
+            self._strips.move_to_end(index)
+            return strip
+        strip_rows = round(STATIC_STRIP_LENGTH / SCALE)
+        strip = pygame.Surface((SCREEN_WIDTH, strip_rows)).convert()
+        # A camera that puts the far end of the strip at its top row
+        camera = Camera(position=((index + 1) * STATIC_STRIP_LENGTH - SCREEN_HEIGHT_HALF * SCALE, 0.0))
+        for entities in (self._sprites, self._trees, self._delivery_sites):
+            strip.blits(on_screen([s for e in entities for s in e.sprites(camera)], height=strip_rows),
+                        doreturn=False)
+        self._strips[index] = strip
+        if len(self._strips) > STATIC_STRIP_CACHE_SIZE:
+            self._strips.popitem(last=False)
+        return strip
 
 
 def cast_lidar_ray(angle, circles):
@@ -307,48 +672,101 @@ def cast_lidar(start_pos, objects):
     return [cast_lidar_ray(angle, relative_objects) for angle in LIDAR_ANGLES]
 
 
-if __name__ == "__main__":
-
-    parser = argparse.ArgumentParser(description='"8-bit" Zip Sim')
-    parser.add_argument('pilot', nargs=argparse.REMAINDER, help='A pilot process to run')
-    parser.add_argument('--headless', action="store_true", help='Run without visualization')
-    visualizer_group = parser.add_argument_group("Visualization options")
-    visualizer_group.add_argument('--chase-y', action="store_true", help='Have the camera follow the zip in the y axis')
-    visualizer_group.add_argument('--show-lidar', action="store_true", help='Shows lidar in the visualization')
-    visualizer_group.add_argument('--start-paused', action="store_true", help='Start the simulation paused')
-    parser.add_argument('--seed', type=int, help='Seed to use for random number generation')
-    args = parser.parse_args()
-
-    random.seed(args.seed)
-    headless = args.headless
-    api_mode = len(args.pilot) > 0
-
-    if api_mode:
-        pilot = subprocess.Popen(args.pilot, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-        loop_count = 0  # To count iterations to compute the telemetry timestamp
-
-    if not headless:
-        pygame.init()
-        pygame.display.set_caption("Zip Sim")
-        screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-        clock = pygame.time.Clock()
-        camera = Camera(position=(CAMERA_AHEAD_M, 0.0))
-        distribution_center_image = load_image("distribution_center.png")
-        terrain = Terrain()
-        reticle_image = load_image("reticle.png")
-        chase_y = args.chase_y
-        show_lidar = args.show_lidar
-        visualizer_paused = args.start_paused
-        visualizer_rate_index = INITIAL_VISUALIZER_RATE_INDEX
-
+# Pre-computed with the math module (not numpy) so that the ray directions are bit-for-bit the same as
+# cast_lidar_ray's.
+LIDAR_RAY_A = np.array([math.sin(angle) for angle in LIDAR_ANGLES])
+LIDAR_RAY_B = np.array([-math.cos(angle) for angle in LIDAR_ANGLES])
+
+
+def cast_lidar_rays(o_x, o_y, radius):
+    """ Casts every lidar ray against every circle at once, mirroring cast_lidar_ray operation for operation.
+
+    The circles are given as arrays of positions relative to the vehicle. Returns the distance along every ray (last
+    axis) to every circle (first axis), which is infinite where the ray misses, and whether the vehicle is inside each
+    circle.
+    """
+    inside = o_x * o_x + o_y * o_y <= radius * radius
+    # Put the circles along the first axis, and the rays along the last.
+    o_x = o_x[:, np.newaxis]
+    o_y = o_y[:, np.newaxis]
+    radius = radius[:, np.newaxis]
+    a = LIDAR_RAY_A
+    b = LIDAR_RAY_B
+    signed_c = -(a * o_x + b * o_y)
+    num_wraps = np.rint(signed_c / (b * WORLD_WIDTH))
+    signed_c -= num_wraps * b * WORLD_WIDTH
+    hit = np.abs(signed_c) < radius
+    # Most rays miss most circles, so only work out the intersections of the ones that hit.
+    circle, ray = np.nonzero(hit)
+    a = a[ray]
+    b = b[ray]
+    radius = radius[circle, 0]
+    signed_c = signed_c[circle, ray]
+    gnarly_math = np.sqrt(radius * radius - signed_c * signed_c)
+    x = a * signed_c + b * gnarly_math + o_x[circle, 0]
+    y = b * signed_c - a * gnarly_math + o_y[circle, 0] + num_wraps[circle, ray] * WORLD_WIDTH
+    d = np.full(hit.shape, np.inf)
+    d[circle, ray] = np.sqrt(x * x + y * y)
+    return d, inside
+
+
+def lidar_samples(nearest, blind):
+    """ Turns the distance to the nearest circle along each ray into lidar samples the way cast_lidar_ray does. Rays
+    of a blind lidar (one inside an object) read 0. """
+    # cast_lidar_ray keeps the rounded distance of the closest hit, provided it's nearer than the max distance
+    samples = np.where(nearest < LIDAR_MAX_DISTANCE + 1, np.rint(nearest), 0).astype(np.int64)
+    samples[samples > LIDAR_MAX_DISTANCE] = 0
+    samples[np.broadcast_to(blind, samples.shape)] = 0
+    return samples
+
+
+class LidarEngine():
+    """ Casts the lidar against circles held in contiguous arrays. Produces exactly the same samples as cast_lidar().
+    """
+    __slots__ = ["_index", "_reach", "_x", "_y", "_radius", "_wrap_x"]
+
+    def __init__(self, objects, wrap_x=False):
+        """ Like cast_lidar(), the lidar doesn't see around the end of the world, unless asked to wrap_x. """
+        self._wrap_x = wrap_x
+        self._index = SpatialIndex(objects)
+        objects = self._index.entities
+        self._x = np.array([o.position[0] for o in objects], dtype=np.float64)
+        self._y = np.array([o.position[1] for o in objects], dtype=np.float64)
+        self._radius = np.array([o.radius for o in objects], dtype=np.float64)
+        # Any point on a circle farther ahead than this is out of lidar range, so the circle can't affect the result.
+        # There's an extra meter of slack to be safe against round-off.
+        self._reach = LIDAR_MAX_DISTANCE + 2 + max(self._radius, default=0.0)
+
+    def cast(self, start_pos):
+        # Only look at objects that are ahead of the vehicle and in range, and shift their positions to be in the
+        # vehicle's frame. The objects are sorted along the X axis, so this is just a slice.
+        start, stop = self._index.span(start_pos[0], start_pos[0] + self._reach)
+        o_x = self._x[start:stop] - start_pos[0]
+        o_y = self._y[start:stop]
+        radius = self._radius[start:stop]
+        if self._wrap_x and start_pos[0] + self._reach > WORLD_LENGTH:
+            # Also look at the objects at the start of the world, as if they came after its end.
+            wrap_stop = self._index.span(-1.0, start_pos[0] + self._reach - WORLD_LENGTH)[1]
+            o_x = np.concatenate((o_x, self._x[:wrap_stop] + (WORLD_LENGTH - start_pos[0])))
+            o_y = np.concatenate((o_y, self._y[:wrap_stop]))
+            radius = np.concatenate((radius, self._radius[:wrap_stop]))
+        o_y = (o_y - start_pos[1] + WORLD_WIDTH_HALF) % WORLD_WIDTH - WORLD_WIDTH_HALF
+        d, inside = cast_lidar_rays(o_x, o_y, radius)
+        if inside.any():
+            return [0] * len(LIDAR_ANGLES)  # We're inside an object. Pretend that the lidar is blind.
+        return lidar_samples(d.min(axis=0, initial=np.inf), False).tolist()
+
+
+def generate_world(rng):
+    """ Randomly generates the delivery sites and trees of a world, drawing from the given random number generator. """
     # Randomly generate delivery sites that aren't too close to each other.
     delivery_sites = []
     for _ in range(NUM_DELIVERY_SITES):
         while True:
             # Round the position to the nearest tenth of a meter. This keeps the sprites from jumping around while
             # drawing due to floating point round-off to the nearest pixel.
-            site_pos = (round(random.uniform(*DELIVERY_SITE_X_BOUNDS) % WORLD_LENGTH, 1),
-                        round(random.uniform(*DELIVERY_SITE_Y_BOUNDS) % WORLD_WIDTH, 1))
+            site_pos = (round(rng.uniform(*DELIVERY_SITE_X_BOUNDS) % WORLD_LENGTH, 1),
+                        round(rng.uniform(*DELIVERY_SITE_Y_BOUNDS) % WORLD_WIDTH, 1))
             if min((s.distance_to(site_pos) for s in delivery_sites),
                    default=MIN_DELIVERY_DISTANCE) >= MIN_DELIVERY_DISTANCE:
                 delivery_sites.append(DeliverySite(site_pos))
@@ -356,180 +774,956 @@ if __name__ == "__main__":
 
     # Randomly generate trees that aren't too close to delivery sites.
     trees = []
-    tree_density = random.gauss(TYPICAL_NUM_TREES, MAX_NUM_TREES / 3)
+    tree_density = rng.gauss(TYPICAL_NUM_TREES, MAX_NUM_TREES / 3)
     num_trees = round(min(MAX_NUM_TREES, tree_density) if tree_density >= TYPICAL_NUM_TREES
-                      else random.triangular(0, TYPICAL_NUM_TREES, TYPICAL_NUM_TREES))
+                      else rng.triangular(0, TYPICAL_NUM_TREES, TYPICAL_NUM_TREES))
     for _ in range(num_trees):
         while True:
             # Round the position to the nearest tenth of a meter. This keeps the sprites from jumping around while
             # drawing due to floating point round-off to the nearest pixel.
-            tree_pos = (round(random.uniform(*TREE_X_BOUNDS), 1),
-                        round(random.uniform(0, WORLD_WIDTH), 1))
+            tree_pos = (round(rng.uniform(*TREE_X_BOUNDS), 1),
+                        round(rng.uniform(0, WORLD_WIDTH), 1))
             if min((s.distance_to(tree_pos) for s in delivery_sites), default=MIN_TREE_DISTANCE) >= MIN_TREE_DISTANCE:
                 trees.append(Tree(tree_pos))
                 break
     # Trees can overlap, so sort them so they render over each other properly.
     trees.sort(key=lambda x: x.position[0], reverse=True)
+    return delivery_sites, trees
 
-    # A list of objects that reflect lidar points
-    lidar_objects = [t.make_lidar_object() for t in trees] + [d.make_lidar_object() for d in delivery_sites]
 
-    vehicle = Zip()
+class PointGrid():
+    """ A grid of points for quickly finding whether any are near a position. Wraps around in the world Y axis. """
+    __slots__ = ["_cells", "_cell_length", "_cell_width", "_num_rows"]
 
-    # Set to an exit code when it's time to leave the main loop
-    result = None
+    def __init__(self, cell_size):
+        self._cells = {}
+        self._cell_length = cell_size
+        # Rows are stretched a little to tile the width of the world exactly, so that the wrap-around lines up.
+        self._num_rows = max(1, int(WORLD_WIDTH // cell_size))
+        self._cell_width = WORLD_WIDTH / self._num_rows
 
-    wind = Wind()
-    lateral_airspeed = 0.0
-    # Used to de-bounce commands to drop a package
-    was_package_dropped = False
-    # Number of packages still in the zip
-    num_packages = len(delivery_sites)
-    # List of package objects that have been dropped
-    dropped_packages = []
+    def add(self, position):
+        key = (int(position[0] // self._cell_length), int(position[1] // self._cell_width) % self._num_rows)
+        self._cells.setdefault(key, []).append(position)
 
-    while result is None:
-        drop_package_commanded = False
-        if api_mode:
-            lidar_samples = cast_lidar(vehicle.position, lidar_objects)
-            pilot.stdin.write(TELEMETRY_STRUCT.pack(int(loop_count * DT_SEC * 1e3) & 0xFFFF,
-                                                    round(RECOVERY_X - vehicle.position[0]),
-                                                    wind.vector[0],
-                                                    wind.vector[1],
-                                                    round((-vehicle.position[1] + WORLD_WIDTH_HALF) % WORLD_WIDTH -
-                                                          WORLD_WIDTH_HALF),
-                                                    *lidar_samples))
-            pilot.stdin.flush()
-            loop_count += 1
-            cmd = pilot.stdout.read(COMMAND_STRUCT.size)
-            if len(cmd) != COMMAND_STRUCT.size:
-                result = CRASHED  # The pilot process must have exited
+    def any_within(self, position, distance):
+        """ Returns whether any point is closer than distance to the position. """
+        x, y = position
+        column = int(x // self._cell_length)
+        row = int(y // self._cell_width)
+        reach_x = math.ceil(distance / self._cell_length)
+        reach_y = math.ceil(distance / self._cell_width)
+        rows = {r % self._num_rows for r in range(row - reach_y, row + reach_y + 1)}
+        for c in range(column - reach_x, column + reach_x + 1):
+            for r in rows:
+                for p_x, p_y in self._cells.get((c, r), ()):
+                    delta_x = abs(p_x - x)
+                    delta_y = abs(p_y - y)
+                    if delta_y > WORLD_WIDTH_HALF:
+                        delta_y = WORLD_WIDTH - delta_y
+                    if delta_x * delta_x + delta_y * delta_y < distance * distance:
+                        return True
+        return False
+
+
+def scatter_positions(rng, length=WORLD_LENGTH, delivery_site_density=NUM_DELIVERY_SITES / WORLD_LENGTH,
+                      tree_density=None, site_x_bounds=None, tree_x_bounds=None, existing_sites=(), existing_trees=()):
+    """ Randomly places the delivery sites and trees of a stretch of world of the given length, in time proportional
+    to the number of things placed. Returns the (delivery site positions, tree positions). The densities are per
+    meter along the world X axis. Without a tree density, the number of trees is drawn the same way generate_world()
+    does, scaled to the length. The positions aren't wrapped in the world X axis, so the stretch may be any length.
+
+    Candidate positions are thrown at random and checked against a grid of what's already placed, so each check only
+    looks at the few neighbors that could be too close. A site or tree that can't be placed in MAX_PLACEMENT_ATTEMPTS
+    tries is left out, so a world that's asked to be denser than fits comes out as dense as it can be.
+
+    By default, sites and trees keep the same distance from the ends of the stretch as they do from the distribution
+    center. A stretch that continues on from another can be given other bounds, and the positions of the sites and
+    trees already placed nearby (in the frame of this stretch) to keep clear of. """
+    if site_x_bounds is None:
+        site_x_bounds = (DELIVERY_SITE_X_BOUNDS[0], length - (WORLD_LENGTH - DELIVERY_SITE_X_BOUNDS[1]))
+    if tree_x_bounds is None:
+        tree_x_bounds = (TREE_X_BOUNDS[0], length - (WORLD_LENGTH - TREE_X_BOUNDS[1]))
+
+    # Grid cells no bigger than the minimum distance apart, so that each cell holds about one delivery site
+    site_grid = PointGrid(MIN_DELIVERY_DISTANCE / math.sqrt(2))
+    for site_pos in existing_sites:
+        site_grid.add(site_pos)
+    tree_grid = None
+    if existing_trees:
+        tree_grid = PointGrid(MIN_TREE_DISTANCE)
+        for tree_pos in existing_trees:
+            tree_grid.add(tree_pos)
+    site_positions = []
+    for _ in range(round(delivery_site_density * length)):
+        for _ in range(MAX_PLACEMENT_ATTEMPTS):
+            # Round the position to the nearest tenth of a meter. This keeps the sprites from jumping around while
+            # drawing due to floating point round-off to the nearest pixel.
+            site_pos = (round(rng.uniform(*site_x_bounds), 1),
+                        round(rng.uniform(*DELIVERY_SITE_Y_BOUNDS) % WORLD_WIDTH, 1))
+            if not site_grid.any_within(site_pos, MIN_DELIVERY_DISTANCE) and \
+                    (tree_grid is None or not tree_grid.any_within(site_pos, MIN_TREE_DISTANCE)):
+                site_grid.add(site_pos)
+                site_positions.append(site_pos)
                 break
-            lateral_airspeed_input, drop_package_commanded_byte, _ = COMMAND_STRUCT.unpack(cmd)
-            lateral_airspeed = max(-30.0, min(30.0, lateral_airspeed_input))
-            drop_package_commanded = bool(drop_package_commanded_byte)
-        elif not headless:
-            keys = pygame.key.get_pressed()
-            lateral_airspeed -= lateral_airspeed / 0.5 * DT_SEC
-            if keys[pygame.K_LEFT]:
-                lateral_airspeed = min(30.0, lateral_airspeed + DT_SEC * 200.0)
-            if keys[pygame.K_RIGHT]:
-                lateral_airspeed = max(-30.0, lateral_airspeed - DT_SEC * 200.0)
-            if keys[pygame.K_SPACE]:
-                drop_package_commanded = True
-
-        vehicle.update(DT_SEC, lateral_airspeed, wind.vector)
 
+    if tree_density is None:
+        typical_density = rng.gauss(TYPICAL_NUM_TREES, MAX_NUM_TREES / 3)
+        num_trees = round(min(MAX_NUM_TREES, typical_density) if typical_density >= TYPICAL_NUM_TREES
+                          else rng.triangular(0, TYPICAL_NUM_TREES, TYPICAL_NUM_TREES)) * length / WORLD_LENGTH
+    else:
+        num_trees = tree_density * length
+    # Trees only need to keep clear of delivery sites, so they're checked against a finer grid of the same sites.
+    clearance_grid = PointGrid(MIN_TREE_DISTANCE)
+    for site_pos in site_positions + list(existing_sites):
+        clearance_grid.add(site_pos)
+    tree_positions = []
+    for _ in range(round(num_trees)):
+        for _ in range(MAX_PLACEMENT_ATTEMPTS):
+            tree_pos = (round(rng.uniform(*tree_x_bounds), 1),
+                        round(rng.uniform(0, WORLD_WIDTH), 1))
+            if not clearance_grid.any_within(tree_pos, MIN_TREE_DISTANCE):
+                tree_positions.append(tree_pos)
+                break
+    return site_positions, tree_positions
+
+
+def scatter_world(rng, num_delivery_sites=NUM_DELIVERY_SITES, num_trees=None):
+    """ Randomly generates the delivery sites and trees of a world with scatter_positions(), an alternative to
+    generate_world() that stays fast in crowded worlds. By default, it draws the same random numbers as
+    generate_world(), so it makes the same worlds unless a site or tree runs out of attempts. Given more delivery
+    sites or a number of trees, it makes worlds as crowded as asked, or as will fit. """
+    site_positions, tree_positions = scatter_positions(rng, WORLD_LENGTH, num_delivery_sites / WORLD_LENGTH,
+                                                       None if num_trees is None else num_trees / WORLD_LENGTH)
+    # Trees can overlap, so sort them so they render over each other properly.
+    trees = sorted((Tree(p) for p in tree_positions), key=lambda x: x.position[0], reverse=True)
+    return [DeliverySite(p) for p in site_positions], trees
+
+
+# The ways a world can be generated, by name. The dense and crowded worlds are for stress tests, with many more trees
+# than generate_world() makes, and with more delivery sites as well.
+WORLD_GENERATORS = {"rejection": generate_world,
+                    "scatter": scatter_world,
+                    "scatter-dense": functools.partial(scatter_world, num_trees=DENSE_NUM_TREES),
+                    "scatter-crowded": functools.partial(scatter_world, num_delivery_sites=CROWDED_NUM_DELIVERY_SITES,
+                                                         num_trees=DENSE_NUM_TREES)}
+# The most (delivery sites, trees) the worlds of each generator can have, for the code that lays worlds out in arrays
+# of a fixed size. A generator added to WORLD_GENERATORS needs its size here too.
+WORLD_SIZES = {"rejection": (NUM_DELIVERY_SITES, MAX_NUM_TREES),
+               "scatter": (NUM_DELIVERY_SITES, MAX_NUM_TREES),
+               "scatter-dense": (NUM_DELIVERY_SITES, DENSE_NUM_TREES),
+               "scatter-crowded": (CROWDED_NUM_DELIVERY_SITES, DENSE_NUM_TREES)}
+
+
+def create_world(seed, corpus=None, generator="rejection", wind_model="walk"):
+    """ Returns the (delivery_sites, trees, wind, rng) of the world for a seed, with rng left where the wind's random
+    walk continues from. The world is loaded from the corpus (see world_corpus.py) if it has the seed and was built
+    with the same generator, and generated otherwise. The wind is driven by the given one of WIND_MODELS. """
+    world = None
+    if corpus is not None and seed is not None and corpus.generator == generator:
+        world = corpus.load(seed)
+    if world is None:
+        rng = random.Random(seed)
+        delivery_sites, trees = WORLD_GENERATORS[generator](rng)
+        world = delivery_sites, trees, Wind(rng), rng
+    if wind_model == "trace":
+        # The world's own wind is left unused, so that the world is the same either way.
+        delivery_sites, trees, _, rng = world
+        world = delivery_sites, trees, WindTrace(seed).play(), rng
+    return world
+
+
+class SimulationSnapshot():
+    """ The state of a ZipSimulation at one tick, from ZipSimulation.snapshot(). The world isn't copied, since it never
+    changes during an episode, and neither are packages that have landed. """
+    __slots__ = ["seed", "world", "wind", "vehicle_position", "status", "lateral_airspeed",
+                 "was_package_dropped", "num_packages", "dropped_packages", "num_landed_packages", "packages_by_site",
+                 "num_deliveries", "num_zipaa_violations", "loop_count", "extra"]
+
+
+class ZipSimulation():
+    """ A single episode of the sim: the world, the wind, the vehicle and its packages. Advanced one tick at a time
+    with step(), so that many episodes can be run in one process. """
+
+    def __init__(self, seed=None, corpus=None, world_generator="rejection", wind_model="walk"):
+        self.seed = seed
+        # Pre-generated worlds to load instead of generating them, if there are any
+        self.corpus = corpus
+        # The name of the generator in WORLD_GENERATORS to generate worlds with
+        self.world_generator = world_generator
+        # How the wind is driven, one of WIND_MODELS
+        self.wind_model = wind_model
+        self.reset()
+
+    def reset(self, seed=None):
+        """ Starts a new episode, regenerating the world from the seed. Returns the first telemetry tuple. """
+        if seed is not None:
+            self.seed = seed
+
+        self.delivery_sites, self.trees, self.wind, self._rng = self._create_world()
+        self._index_world()
+
+        self.vehicle = Zip()
+        # Set to an exit code when the episode is over
+        self.status = None
+        self.lateral_airspeed = 0.0
+        # Used to de-bounce commands to drop a package
+        self.was_package_dropped = False
+        # Number of packages still in the zip
+        self.num_packages = len(self.delivery_sites)
+        # List of package objects that have been dropped
+        self.dropped_packages = []
+        # Packages are scored as they land, counting packages per delivery site. They all take as long to fall, so
+        # the ones still falling are always the last ones dropped, after the first _num_landed_packages.
+        self._num_landed_packages = 0
+        self._packages_by_site = {}
+        self._num_deliveries = 0
+        self._num_zipaa_violations = 0
+        # To count iterations to compute the telemetry timestamp
+        self.loop_count = 0
+        return self.telemetry()
+
+    def _create_world(self):
+        """ Returns the (delivery_sites, trees, wind, rng) to start a new episode with. """
+        return create_world(self.seed, self.corpus, self.world_generator, self.wind_model)
+
+    def _index_world(self):
+        """ Prepares the lidar and collision checks for the current delivery sites and trees. """
+        # A list of objects that reflect lidar points
+        self.lidar = LidarEngine([t.make_lidar_object() for t in self.trees] +
+                                 [d.make_lidar_object() for d in self.delivery_sites])
+        # Trees are only ever checked for collisions near the vehicle
+        self._tree_index = SpatialIndex(self.trees)
+        # and delivery sites only for packages landing near them.
+        self._site_index = SpatialIndex(self.delivery_sites)
+
+    def telemetry(self):
+        """ Returns the fields of the telemetry message for the current tick, in TELEMETRY_STRUCT order. """
+        vehicle_x, vehicle_y = self.vehicle.position
+        wind_x, wind_y = self.wind.vector
+        return (int(self.loop_count * DT_SEC * 1e3) & 0xFFFF,
+                round(RECOVERY_X - vehicle_x),
+                wind_x,
+                wind_y,
+                round((-vehicle_y + WORLD_WIDTH_HALF) % WORLD_WIDTH - WORLD_WIDTH_HALF),
+                *self._cast_lidar())
+
+    def step(self, lateral_airspeed, drop_package_commanded):
+        """ Advances the simulation by one tick. Returns the telemetry tuple for the next tick. """
+        self.fly(lateral_airspeed, drop_package_commanded)
+        self._update_wind()
+        return self.telemetry()
+
+    def fly(self, lateral_airspeed, drop_package_commanded):
+        """ Advances the vehicle and its packages by one tick, in the wind as it is. Doesn't update the wind. """
+        self.lateral_airspeed = lateral_airspeed = max(-30.0, min(30.0, lateral_airspeed))
+        self.loop_count += 1
+
+        self._move_vehicle(lateral_airspeed)
+        self._check_collisions()
+        self._update_packages(lateral_airspeed, drop_package_commanded)
+
+        if self._is_finished():
+            vehicle_y = self.vehicle.position[1]
+            self.status = RECOVERED if vehicle_y <= RECOVERY_Y_MIN or vehicle_y >= RECOVERY_Y_MAX else PARALANDED
+
+    # The phases of a tick are methods of their own so that they can be timed separately (see profiling.py).
+
+    def _cast_lidar(self):
+        return self.lidar.cast(self.vehicle.position)
+
+    def _move_vehicle(self, lateral_airspeed):
+        self.vehicle.update(DT_SEC, lateral_airspeed, self.wind.vector)
+
+    def _check_collisions(self):
         # Check for collisions with trees
-        for t in trees:
-            if t.contains(vehicle.position):
-                result = CRASHED
+        for t in self._tree_index.near(self.vehicle.position[0], TREE_COLLISION_RADIUS):
+            if t.contains(self.vehicle.position):
+                self.status = CRASHED
                 break
 
-        for p in dropped_packages:
+    def _update_packages(self, lateral_airspeed, drop_package_commanded):
+        dropped_packages = self.dropped_packages
+        landed = self._num_landed_packages
+        for p in dropped_packages[landed:]:
             p.update(DT_SEC)
+        while landed < len(dropped_packages) and dropped_packages[landed].fall_duration == 0:
+            deliveries, zipaa_violations = self._count_package(dropped_packages[landed].position,
+                                                               self._packages_by_site)
+            self._num_deliveries += deliveries
+            self._num_zipaa_violations += zipaa_violations
+            landed += 1
+        self._num_landed_packages = landed
 
         # Drop a package if commanded to. The package is dropped after updating physics so that we can
         # append it right on to the end of the dropped packages list. This adds some "realism" since a
         # real mechanism would release the package some time after being commanded to.
-        if drop_package_commanded and not was_package_dropped and num_packages > 0:
-            num_packages -= 1
-            dropped_packages.append(Package(vehicle.position, vehicle.get_velocity(lateral_airspeed, wind.vector)))
+        if drop_package_commanded and not self.was_package_dropped and self.num_packages > 0:
+            self.num_packages -= 1
+            self.dropped_packages.append(Package(self.vehicle.position,
+                                                 self.vehicle.get_velocity(lateral_airspeed, self.wind.vector)))
+
+        self.was_package_dropped = drop_package_commanded
+
+    def _update_wind(self):
+        self.wind.update(DT_SEC)
+
+    def _is_finished(self):
+        """ Returns whether the flight is over, with the vehicle either recovered or paralanded. """
+        return self.vehicle.position[0] >= RECOVERY_X
+
+    def result(self):
+        """ Returns the number of deliveries and ZIPAA violations so far, counting packages still falling where they
+        will land. Can be called on any tick. """
+        num_deliveries = self._num_deliveries
+        num_zipaa_violations = self._num_zipaa_violations
+        falling = self.dropped_packages[self._num_landed_packages:]
+        if falling:
+            packages_by_site = dict(self._packages_by_site)
+            for p in falling:
+                deliveries, zipaa_violations = self._count_package(p.landing_position(), packages_by_site)
+                num_deliveries += deliveries
+                num_zipaa_violations += zipaa_violations
+        return num_deliveries, num_zipaa_violations
+
+    def _count_package(self, position, packages_by_site):
+        """ Counts a package at position in packages_by_site, against every delivery site it's in. Returns the number
+        of deliveries and ZIPAA violations that adds. """
+        deliveries = 0
+        zipaa_violations = 0
+        for s in self._site_index.near(position[0], DELIVERY_SITE_RADIUS):
+            if s.contains(position):
+                count = packages_by_site.get(s, 0) + 1
+                packages_by_site[s] = count
+                if count == 1:
+                    deliveries += 1
+                else:
+                    zipaa_violations += 1
+        return deliveries, zipaa_violations
+
+    def snapshot(self):
+        """ Returns a SimulationSnapshot of the episode as it is now, that restore() can return to any number of times,
+        for trying out different commands from the same state. """
+        if not isinstance(self.wind, TapedWind):
+            # Put the wind on tape, so that snapshots don't have to copy the state of its random number generator.
+            self.wind = WindTape(self.wind).play()
+        snapshot = SimulationSnapshot()
+        snapshot.seed = self.seed
+        snapshot.world = (self.delivery_sites, self.trees, self.lidar, self._tree_index, self._site_index)
+        # A wind of its own, paused where the sim's is, so that the tape keeps the ticks from there on.
+        snapshot.wind = self.wind._tape.play(self.wind._tick)
+        snapshot.vehicle_position = self.vehicle.position
+        snapshot.status = self.status
+        snapshot.lateral_airspeed = self.lateral_airspeed
+        snapshot.was_package_dropped = self.was_package_dropped
+        snapshot.num_packages = self.num_packages
+        snapshot.dropped_packages = self._copy_packages(self.dropped_packages)
+        snapshot.num_landed_packages = self._num_landed_packages
+        snapshot.packages_by_site = dict(self._packages_by_site)
+        snapshot.num_deliveries = self._num_deliveries
+        snapshot.num_zipaa_violations = self._num_zipaa_violations
+        snapshot.loop_count = self.loop_count
+        snapshot.extra = None
+        return snapshot
+
+    def restore(self, snapshot):
+        """ Puts the episode back the way it was when the snapshot was taken. """
+        self.seed = snapshot.seed
+        self.delivery_sites, self.trees, self.lidar, self._tree_index, self._site_index = snapshot.world
+        self.wind = snapshot.wind._tape.play(snapshot.wind._tick)
+        self.vehicle.position = snapshot.vehicle_position
+        self.status = snapshot.status
+        self.lateral_airspeed = snapshot.lateral_airspeed
+        self.was_package_dropped = snapshot.was_package_dropped
+        self.num_packages = snapshot.num_packages
+        self.dropped_packages = self._copy_packages(snapshot.dropped_packages)
+        self._num_landed_packages = snapshot.num_landed_packages
+        self._packages_by_site = dict(snapshot.packages_by_site)
+        self._num_deliveries = snapshot.num_deliveries
+        self._num_zipaa_violations = snapshot.num_zipaa_violations
+        self.loop_count = snapshot.loop_count
+
+    @staticmethod
+    def _copy_packages(packages):
+        # Packages that have landed never move again, so they can be shared.
+        return [p if p.fall_duration == 0 else Package(p.position, p._velocity, p._fall_duration) for p in packages]
+
+
+class Visualizer():
+    """ Draws the simulation with pygame, and reads the keyboard for manual flying. """
+
+    def __init__(self, chase_y=False, show_lidar=False, start_paused=False, turbo=False):
+        import_pygame()
+        pygame.init()
+        pygame.display.set_caption("Zip Sim")
+        self._screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+        self._clock = pygame.time.Clock()
+        self._camera = Camera(position=(CAMERA_AHEAD_M, 0.0))
+        self._static_layer = StaticLayer()
+        self._reticle_image = load_image("reticle.png")
+        self._chase_y = chase_y
+        self._show_lidar = show_lidar
+        self._paused = start_paused
+        self._rate_index = INITIAL_VISUALIZER_RATE_INDEX
+        self._turbo = turbo
+        self._font = pygame.font.Font(None, 24)
+        # In turbo mode, whether this tick gets drawn, and when the next frame is due
+        self._frame_due = True
+        self._next_frame_time = 0.0
+        # Measures the effective simulation rate for turbo mode's readout
+        self._ticks = 0
+        self._tick_rate_start = time.perf_counter()
+        self._tick_rate = 0.0
+
+    def keyboard_command(self, lateral_airspeed):
+        """ Returns the (lateral_airspeed, drop_package_commanded) the arrow keys and space bar ask for. """
+        keys = pygame.key.get_pressed()
+        lateral_airspeed -= lateral_airspeed / 0.5 * DT_SEC
+        if keys[pygame.K_LEFT]:
+            lateral_airspeed = min(30.0, lateral_airspeed + DT_SEC * 200.0)
+        if keys[pygame.K_RIGHT]:
+            lateral_airspeed = max(-30.0, lateral_airspeed - DT_SEC * 200.0)
+        return lateral_airspeed, bool(keys[pygame.K_SPACE])
+
+    def draw(self, sim):
+        self._ticks += 1
+        if self._turbo:
+            # Skip drawing any ticks that come faster than the display can show them.
+            now = time.perf_counter()
+            self._frame_due = self._paused or now >= self._next_frame_time
+            if not self._frame_due:
+                return
+            self._next_frame_time = now + 1.0 / TURBO_FRAME_RATE
+
+        camera = self._camera
+        screen = self._screen
+        vehicle = sim.vehicle
+
+        # Update the camera to be fixed above the vehicle in the x axis.
+        camera.position = (vehicle.position[0] + CAMERA_AHEAD_M, vehicle.position[1] if self._chase_y else 0.0)
+
+        self._static_layer.draw(camera, screen, sim.trees, sim.delivery_sites)
+
+        if self._show_lidar:
+            # We could try to be clever and avoid casting the lidar twice if in API mode, but there's no real need
+            # since we have plenty of CPU cycles when running in real-time.
+            lidar_samples = sim.lidar.cast(vehicle.position)
+            for angle, d in zip(LIDAR_ANGLES, lidar_samples):
+                x = d * math.cos(angle)
+                y = d * math.sin(angle)
+                for pos in camera.project(vehicle.position):
+                    pygame.draw.line(screen, "red", pos, (round(pos[0] - camera.scale(y)),
+                                                          round(pos[1] - camera.scale(x))))
+
+        sprites = [s for p in sim.dropped_packages for s in p.sprites(camera)]
+        sprites.extend(vehicle.sprites(camera))
+        # Compute where a package would drop and draw a reticle there
+        reticle = Entity(vehicle.position)
+        reticle.move((v * PACKAGE_FALL_SEC for v in vehicle.get_velocity(sim.lateral_airspeed, sim.wind.vector)))
+        sprites.extend((self._reticle_image, (pos[0] - 8, pos[1] - 8)) for pos in camera.project(reticle.position))
+        screen.blits(on_screen(sprites), doreturn=False)
+
+        if self._turbo:
+            self._draw_tick_rate()
+
+        pygame.display.flip()
+
+    def _draw_tick_rate(self):
+        now = time.perf_counter()
+        if now - self._tick_rate_start >= TICK_RATE_PERIOD_SEC:
+            self._tick_rate = self._ticks / (now - self._tick_rate_start)
+            self._ticks = 0
+            self._tick_rate_start = now
+        text = "{:.0f} ticks/s ({:.1f}x)".format(self._tick_rate, self._tick_rate * DT_SEC)
+        self._screen.blit(self._font.render(text, True, "white", "black"), (4, 4))
+
+    def wait_for_step(self):
+        """ Handles UI events and paces the simulation. Returns False if the user asked to quit. """
+        if self._turbo and not self._frame_due:
+            return True  # Events are only handled along with drawn frames, to keep the sim running flat out.
+        # This loop is a little gnarly since python lacks a do-while loop. We want to run at least once no
+        # matter what, and run repeatedly if the simulation is paused.
+        while True:
+            for e in pygame.event.get():
+                if e.type == pygame.QUIT or (e.type == pygame.KEYDOWN and e.key == pygame.K_ESCAPE):
+                    return False
+                if e.type in [pygame.KEYDOWN]:
+                    if e.key == pygame.K_p:
+                        self._paused = not self._paused
+                    if e.key == pygame.K_t:
+                        self._turbo = not self._turbo
+                        self._ticks = 0
+                        self._tick_rate_start = time.perf_counter()
+                    if e.key == pygame.K_s and self._paused:
+                        return True  # Run another cycle before reading any more events
+                    if e.key == pygame.K_COMMA:
+                        self._rate_index = max(0, self._rate_index - 1)
+                    if e.key == pygame.K_PERIOD:
+                        self._rate_index = min(len(VISUALIZER_RATES) - 1, self._rate_index + 1)
+            # There's two things going on here. First, if single-stepped, we don't want to delay the loop.
+            # Otherwise, we want to delay the loop a consistent amount if paused, or at the time-warped rate if
+            # unpaused. This keeps the UI snappy while single-stepping.
+            if self._paused:
+                self._clock.tick(PAUSED_RATE)
+            elif self._turbo:
+                return True
+            else:
+                self._clock.tick(VISUALIZER_RATES[self._rate_index])
+                return True
 
-        was_package_dropped = drop_package_commanded
+    def close(self):
+        pygame.quit()
 
-        wind.update(DT_SEC)
 
-        vehicle_x, vehicle_y = vehicle.position
-        if vehicle_x >= RECOVERY_X:
-            result = RECOVERED if vehicle_y <= RECOVERY_Y_MIN or vehicle_y >= RECOVERY_Y_MAX else PARALANDED
-            break
+class PilotProcess():
+    """ A pilot running as a separate process, speaking the binary API over its stdin and stdout. """
+
+    def __init__(self, command, deadline=None):
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        # How long to wait for each answer, in seconds, or None to wait for as long as it takes
+        self.deadline = deadline
+        # Answers read so far but not yet used, and the number of answers still to come for ticks the pilot was late
+        # for, which are thrown away when they do.
+        self._answers = bytearray()
+        self._num_late_answers = 0
+
+    def command(self, telemetry):
+        """ Sends the telemetry tuple to the pilot. Returns its (lateral_airspeed, drop_package_commanded), None if
+        the pilot has exited, or PILOT_LATE if it didn't answer within the deadline. """
+        if not self.send(telemetry):
+            return None
+        if self.deadline is None:
+            cmd = self._process.stdout.read(COMMAND_STRUCT.size)
+        else:
+            cmd = self._read_by(time.perf_counter() + self.deadline)
+            if cmd is PILOT_LATE:
+                return cmd
+        if cmd is None or len(cmd) != COMMAND_STRUCT.size:
+            return None
+        lateral_airspeed, drop_package_commanded_byte, _ = COMMAND_STRUCT.unpack(cmd)
+        return lateral_airspeed, bool(drop_package_commanded_byte)
+
+    def _read_by(self, deadline):
+        """ Reads the answer to the latest telemetry, waiting until the deadline at the most. Returns the packed
+        command, None if the pilot has exited, or PILOT_LATE. """
+        fd = self.fileno()
+        answers = self._answers
+        while True:
+            while len(answers) >= COMMAND_STRUCT.size:
+                cmd = bytes(answers[:COMMAND_STRUCT.size])
+                del answers[:COMMAND_STRUCT.size]
+                if self._num_late_answers == 0:
+                    return cmd
+                self._num_late_answers -= 1
+            if not select.select([fd], [], [], max(0.0, deadline - time.perf_counter()))[0]:
+                self._num_late_answers += 1
+                return PILOT_LATE
+            data = os.read(fd, 4096)
+            if not data:
+                return None
+            answers += data
+
+    def send(self, telemetry):
+        """ Sends the telemetry tuple to the pilot without waiting for its answer. Returns False if the pilot has
+        exited. """
+        try:
+            self._process.stdin.write(TELEMETRY_STRUCT.pack(*telemetry))
+            self._process.stdin.flush()
+        except BrokenPipeError:
+            return False
+        return True
+
+    def fileno(self):
+        """ The file descriptor the pilot's answers are read from, for waiting on several pilots at once. """
+        return self._process.stdout.fileno()
+
+    def close(self):
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self._process.stdout.close()
+        self._process.wait()
+
+
+def round_to_float32(value):
+    """ Rounds a float the way sending it through the API would. """
+    try:
+        return FLOAT32_STRUCT.unpack(FLOAT32_STRUCT.pack(value))[0]
+    except OverflowError:
+        return value  # Far out of range of anything meaningful, so there's no rounding to speak of.
+
+
+@functools.lru_cache(maxsize=None)
+def import_pilot_module(name):
+    if name.endswith(".py") or os.sep in name:
+        spec = importlib.util.spec_from_file_location(os.path.splitext(os.path.basename(name))[0], name)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    return importlib.import_module(name)
+
+
+def load_pilot(spec):
+    """ Loads a Python pilot from a "MODULE[:NAME]" spec, where MODULE is a module name or a path to a .py file.
+    NAME is a callable, or a class that's instantiated to make one, and defaults to "pilot". """
+    module_name, _, attribute = spec.partition(":")
+    pilot = getattr(import_pilot_module(module_name), attribute or "pilot")
+    return pilot() if isinstance(pilot, type) else pilot
+
+
+class PythonPilot():
+    """ A pilot that's a Python callable running in the sim's process, which saves a pipe round trip per tick.
+
+    It's called as pilot(timestamp, recovery_x_error, wind_vector_x, wind_vector_y, recovery_y_error, lidar_samples)
+    with the values a PilotProcess would decode from the telemetry message, and returns (lateral_airspeed,
+    drop_package_commanded). Floats are rounded to single precision both ways, just like the API, so that a pilot
+    flies exactly the same in-process as out.
+    """
+
+    def __init__(self, pilot):
+        self._pilot = pilot
+
+    def command(self, telemetry):
+        """ Returns the pilot's (lateral_airspeed, drop_package_commanded), or None if the pilot raised. """
+        timestamp, recovery_x_error, wind_vector_x, wind_vector_y, recovery_y_error, *lidar_samples = telemetry
+        try:
+            lateral_airspeed, drop_package_commanded = self._pilot(timestamp, recovery_x_error,
+                                                                   round_to_float32(wind_vector_x),
+                                                                   round_to_float32(wind_vector_y),
+                                                                   recovery_y_error, tuple(lidar_samples))
+            # An answer that isn't a number and a flag fails like the pilot itself did.
+            return round_to_float32(lateral_airspeed), bool(drop_package_commanded)
+        except Exception:
+            # The equivalent of a pilot process dying.
+            traceback.print_exc()
+            return None
+
+    def close(self):
+        pass
+
+
+class LatencyHistogram():
+    """ Counts how long a pilot takes to answer, in logarithmic bins, so that it takes the same memory however long
+    the flight. """
+
+    def __init__(self, budget=DT_SEC):
+        self.counts = collections.Counter()
+        self.count = 0
+        self.max = 0.0
+        # The real-time budget, and the exact number of answers that took longer
+        self.budget = budget
+        self.num_over_budget = 0
+
+    @staticmethod
+    def bin_edge(i):
+        """ Returns the upper edge of bin i, in seconds. """
+        return LATENCY_MIN_SEC * 10.0 ** (i / LATENCY_BINS_PER_DECADE)
+
+    def add(self, seconds):
+        i = 0
+        if seconds > LATENCY_MIN_SEC:
+            i = math.ceil(math.log10(seconds / LATENCY_MIN_SEC) * LATENCY_BINS_PER_DECADE)
+        self.counts[i] += 1
+        self.count += 1
+        self.max = max(self.max, seconds)
+        if seconds > self.budget:
+            self.num_over_budget += 1
+
+    def percentile(self, p):
+        """ Returns the latency that p percent of the answers took at most, to within the width of a bin. """
+        target = p / 100.0 * self.count
+        total = 0
+        for i in sorted(self.counts):
+            total += self.counts[i]
+            if total >= target:
+                return min(self.bin_edge(i), self.max)
+        return self.max
+
+    def report(self):
+        """ Returns a line summing up the latencies, followed by a histogram of them (leaving out empty bins). """
+        if self.count == 0:
+            return "No pilot answers timed"
+        lines = ["Pilot latency: p50 {:.3f} ms, p99 {:.3f} ms, max {:.3f} ms, {} of {} ticks over {:.1f} ms".format(
+            self.percentile(50) * 1e3, self.percentile(99) * 1e3, self.max * 1e3, self.num_over_budget, self.count,
+            self.budget * 1e3)]
+        largest = max(self.counts.values())
+        for i, count in sorted(self.counts.items()):
+            lines.append("  {:>9.3f} - {:>9.3f} ms {:>8} {}".format(
+                self.bin_edge(i - 1) * 1e3 if i > 0 else 0.0, self.bin_edge(i) * 1e3, count,
+                "#" * math.ceil(40 * count / largest)))
+        return "\n".join(lines)
+
+
+class TimedPilot():
+    """ Wraps a pilot, timing every answer. With a deadline (in seconds), an answer that comes too late is dealt
+    with according to the late policy: "hold" flies the pilot's previous command again, and "crash" ends the flight
+    as if the pilot had died. Pilot processes are only waited on until the deadline; Python pilots can't be cut
+    short, so their answers are thrown away after the fact if they took too long. The first answer waits for the
+    pilot to start up as well, so it's timed on its own and has no deadline. """
+
+    def __init__(self, pilot, deadline=None, late_policy="hold"):
+        self._pilot = pilot
+        self.deadline = deadline
+        self.late_policy = late_policy
+        self.startup = None
+        self.latency = LatencyHistogram()
+        self.num_late = 0
+        # The tick the pilot missed its deadline on, if that crashed it
+        self.missed_deadline = None
+        self._tick = 0
+        self._last_command = (0.0, False)
+
+    def command(self, telemetry):
+        start = time.perf_counter()
+        cmd = self._pilot.command(telemetry)
+        elapsed = time.perf_counter() - start
+        tick = self._tick
+        self._tick += 1
+        if tick == 0:
+            self.startup = elapsed
+            if isinstance(self._pilot, PilotProcess):
+                self._pilot.deadline = self.deadline
+        else:
+            self.latency.add(elapsed)
+        if cmd is None:
+            return None
+        if cmd is PILOT_LATE or (tick > 0 and self.deadline is not None and elapsed > self.deadline):
+            self.num_late += 1
+            if self.late_policy == "crash":
+                self.missed_deadline = tick
+                return None
+            return self._last_command
+        self._last_command = cmd
+        return cmd
+
+    def report(self):
+        lines = []
+        if self.startup is not None:
+            lines.append("Pilot startup: {:.3f} ms".format(self.startup * 1e3))
+        lines.append(self.latency.report())
+        if self.deadline is not None:
+            lines.append("{} of {} answers missed the {:.1f} ms deadline".format(
+                self.num_late, self.latency.count, self.deadline * 1e3))
+        if self.missed_deadline is not None:
+            lines.append("The pilot crashed by missing its deadline at tick {}".format(self.missed_deadline))
+        return "\n".join(lines)
+
+    def close(self):
+        self._pilot.close()
+
+
+class KeyboardPilot():
+    """ A human pilot, flying with the arrow keys and space bar through the visualizer. """
+
+    def __init__(self, visualizer):
+        self._visualizer = visualizer
+        self._lateral_airspeed = 0.0
+
+    def command(self, telemetry):
+        self._lateral_airspeed, drop_package_commanded = self._visualizer.keyboard_command(self._lateral_airspeed)
+        return self._lateral_airspeed, drop_package_commanded
+
+    def close(self):
+        pass
+
+
+def run(sim, pilot=None, visualizer=None, publisher=None):
+    """ Runs the simulation until it finishes, drawing it if there's a visualizer and publishing every tick if
+    there's a publisher (see viewer.py). Without a pilot, the vehicle just flies straight. Returns the simulation's
+    exit code. """
+    telemetry = sim.telemetry()
+    if publisher is not None:
+        publisher.publish(sim, telemetry)
+    while sim.status is None:
+        lateral_airspeed = sim.lateral_airspeed
+        drop_package_commanded = False
+        if pilot is not None:
+            cmd = pilot.command(telemetry)
+            if cmd is None:
+                sim.status = CRASHED  # The pilot process must have exited
+                break
+            if cmd is PILOT_QUIT:
+                sim.status = SIM_QUIT
+                break
+            lateral_airspeed, drop_package_commanded = cmd
 
-        if not headless:
-            # Update the camera to be fixed above the vehicle in the x axis.
-            camera.position = (vehicle.position[0] + CAMERA_AHEAD_M, vehicle.position[1] if chase_y else 0.0)
-
-            terrain.draw(camera, screen)
-            # Draw distribution center
-            for pos in camera.project((0, 0)):
-                screen.blit(distribution_center_image, (pos[0] - 250, pos[1] - 100))
-
-            for t in trees:
-                t.draw(camera, screen)
-            for s in delivery_sites:
-                s.draw(camera, screen)
-            for p in dropped_packages:
-                p.draw(camera, screen)
-
-            if show_lidar:
-                # We could try to be clever and avoid casting the lidar twice if in API mode, but there's no real need
-                # since we have plenty of CPU cycles when running in real-time.
-                lidar_samples = cast_lidar(vehicle.position, lidar_objects)
-                for angle, d in zip(LIDAR_ANGLES, lidar_samples):
-                    x = d * math.cos(angle)
-                    y = d * math.sin(angle)
-                    for pos in camera.project(vehicle.position):
-                        pygame.draw.line(screen, "red", pos, (round(pos[0] - camera.scale(y)),
-                                                              round(pos[1] - camera.scale(x))))
-
-            vehicle.draw(camera, screen)
-
-            # Compute where a package would drop and draw a reticle there
-            reticle = Entity(vehicle.position)
-            reticle.move((v * PACKAGE_FALL_SEC for v in vehicle.get_velocity(lateral_airspeed, wind.vector)))
-            for pos in camera.project(reticle.position):
-                screen.blit(reticle_image, (pos[0] - 8, pos[1] - 8))
-
-            pygame.display.flip()
-
-            # This loop is a little gnarly since python lacks a do-while loop. We want to run at least once no
-            # matter what, and run repeatedly if the simulation is paused.
-            wait_for_step = True
-            while wait_for_step:
-                for e in pygame.event.get():
-                    if e.type == pygame.QUIT or (e.type == pygame.KEYDOWN and e.key == pygame.K_ESCAPE):
-                        result = SIM_QUIT
-                        wait_for_step = False
-                        break
-                    if e.type in [pygame.KEYDOWN]:
-                        if e.key == pygame.K_p:
-                            visualizer_paused = not visualizer_paused
-                        if e.key == pygame.K_s and visualizer_paused:
-                            wait_for_step = False
-                            break  # Run another cycle before reading any more events
-                        if e.key == pygame.K_COMMA:
-                            visualizer_rate_index = max(0, visualizer_rate_index - 1)
-                        if e.key == pygame.K_PERIOD:
-                            visualizer_rate_index = min(len(VISUALIZER_RATES) - 1, visualizer_rate_index + 1)
-                if wait_for_step:
-                    # There's two things going on here. First, if single-stepped, we don't want to delay the loop.
-                    # Otherwise, we want to delay the loop a consistent amount if paused, or at the time-warped rate if
-                    # unpaused. This keeps the UI snappy while single-stepping.
-                    if visualizer_paused:
-                        clock.tick(PAUSED_RATE)
-                    else:
-                        clock.tick(VISUALIZER_RATES[visualizer_rate_index])
-                        wait_for_step = False
-
-    if not headless:
-        pygame.quit()
+        telemetry = sim.step(lateral_airspeed, drop_package_commanded)
+        if publisher is not None:
+            publisher.publish(sim, telemetry)
+
+        # The episode ends as soon as the vehicle reaches the recovery point, but a crash is still drawn.
+        if visualizer is not None and sim.status in (None, CRASHED):
+            visualizer.draw(sim)
+            if not visualizer.wait_for_step():
+                sim.status = SIM_QUIT
+    return sim.status
+
+
+def main():
+    parser = argparse.ArgumentParser(description='"8-bit" Zip Sim')
+    parser.add_argument('pilot', nargs=argparse.REMAINDER, help='A pilot process to run')
+    parser.add_argument('--pilot-module', metavar="MODULE[:NAME]",
+                        help='A Python pilot to run in-process instead of a pilot process (see load_pilot)')
+    parser.add_argument('--transport', choices=["pipe", "shm"], default="pipe",
+                        help='How to talk to the pilot process: over its stdin and stdout, or through shared memory '
+                             '(see zip_shm.py)')
+    parser.add_argument('--pilot-deadline-ms', type=float, metavar="MS",
+                        help='How long the pilot has to answer each tick. 16.7 ms is real time.')
+    parser.add_argument('--late-pilot', choices=LATE_PILOT_POLICIES, default="hold",
+                        help='What a pilot that misses its deadline does: holds its last command, or crashes '
+                             '(default: %(default)s)')
+    parser.add_argument('--headless', action="store_true", help='Run without visualization')
+    visualizer_group = parser.add_argument_group("Visualization options")
+    visualizer_group.add_argument('--chase-y', action="store_true", help='Have the camera follow the zip in the y axis')
+    visualizer_group.add_argument('--show-lidar', action="store_true", help='Shows lidar in the visualization')
+    visualizer_group.add_argument('--start-paused', action="store_true", help='Start the simulation paused')
+    visualizer_group.add_argument('--turbo', action="store_true",
+                                  help='Run the simulation as fast as possible, only drawing as many frames as the '
+                                       'display can show (toggle with T)')
+    visualizer_group.add_argument('--publish', metavar="NAME",
+                                  help='Publish every tick to shared memory for viewer.py to watch, e.g. while '
+                                       'running headless')
+    parser.add_argument('--seed', type=int, help='Seed to use for random number generation')
+    parser.add_argument('--world-corpus', metavar="FILE",
+                        help='Load the world for the seed from a file of pre-generated worlds (see world_corpus.py)')
+    parser.add_argument('--world-generator', choices=sorted(WORLD_GENERATORS), default="rejection",
+                        help='How to generate the world: the original rejection sampling, or the grid-accelerated '
+                             'scatter_world(), optionally making dense or crowded worlds for stress tests (see '
+                             'WORLD_GENERATORS) (default: %(default)s)')
+    parser.add_argument('--wind', choices=WIND_MODELS, default="walk",
+                        help="How to drive the wind: the original random walk drawn from the world's random number "
+                             "generator a tick at a time, or the same walk precomputed from a generator of its own "
+                             "(see WindTrace) (default: %(default)s)")
+    parser.add_argument('--corridor', type=int, metavar="TICKS",
+                        help='Fly an endless world that is generated around the vehicle as it goes (see corridor.py), '
+                             'for TICKS ticks, or until the pilot crashes or quits if 0')
+    profiling_group = parser.add_argument_group("Profiling options")
+    profiling_group.add_argument('--profile', action="store_true",
+                                 help='Time each phase of the main loop and print a table of them at exit (see '
+                                      'profiling.py)')
+    profiling_group.add_argument('--profile-trace', metavar="FILE",
+                                 help='Also write a Chrome trace of every timed call to FILE (implies --profile)')
+    recording_group = parser.add_argument_group("Recording options")
+    recording_group.add_argument('--record', metavar="FILE", help='Record the episode to a file (see recording.py)')
+    recording_group.add_argument('--replay', metavar="FILE",
+                                 help='Re-fly a recorded episode without its pilot, checking that it plays out the '
+                                      'same way')
+    args = parser.parse_args()
 
-    # Count delivered packages, looking for double deliveries
-    package_count_by_site = {}
-    for p in dropped_packages:
-        # Make sure the package is at rest
-        p.update(PACKAGE_FALL_SEC)
-        for s in delivery_sites:
-            if s.contains(p.position):
-                try:
-                    package_count_by_site[s] += 1
-                except KeyError:
-                    package_count_by_site[s] = 1
-
-    if api_mode:
-        pilot.stdin.close()
-        pilot.stdout.close()
-        pilot.wait()
-    print("Deliveries: {}".format(len(package_count_by_site)))
-    print("ZIPAA Violations: {}".format(sum((x - 1 for x in package_count_by_site.values() if x > 1))))
-    sys.exit(result)
+    if args.replay:
+        if args.pilot or args.pilot_module or args.record:
+            parser.error("--replay flies the recorded commands, so it can't take a pilot or --record")
+        from recording import replay
+        return replay(args.replay, headless=args.headless, chase_y=args.chase_y, show_lidar=args.show_lidar,
+                      start_paused=args.start_paused, turbo=args.turbo)
+
+    if args.transport == "shm" and len(args.pilot) == 0:
+        parser.error("--transport shm needs a pilot process")
+    pilot = None
+    if len(args.pilot) > 0:
+        if args.pilot_module:
+            parser.error("give either a pilot process or --pilot-module, not both")
+        if args.transport == "shm":
+            if args.pilot_deadline_ms is not None:
+                parser.error("--pilot-deadline-ms needs the pipe transport")
+            from zip_shm import SharedMemoryPilot
+            pilot = SharedMemoryPilot(args.pilot)
+        else:
+            pilot = PilotProcess(args.pilot)
+    elif args.pilot_module:
+        pilot = PythonPilot(load_pilot(args.pilot_module))
+
+    profiler = None
+    if args.profile or args.profile_trace:
+        from profiling import Profiler, SIMULATION_PHASES, PILOT_PHASES, VISUALIZER_PHASES, PUBLISHER_PHASES
+        profiler = Profiler(trace=args.profile_trace is not None)
+
+    # The pilot itself, before it's wrapped in anything
+    raw_pilot = pilot
+    timed_pilot = None
+    if pilot is not None:
+        deadline = None if args.pilot_deadline_ms is None else args.pilot_deadline_ms / 1e3
+        pilot = timed_pilot = TimedPilot(pilot, deadline, args.late_pilot)
+    elif args.pilot_deadline_ms is not None:
+        parser.error("--pilot-deadline-ms needs a pilot process or --pilot-module")
+
+    visualizer = None
+    if not args.headless:
+        visualizer = Visualizer(chase_y=args.chase_y, show_lidar=args.show_lidar, start_paused=args.start_paused,
+                                turbo=args.turbo)
+        if pilot is None:
+            pilot = KeyboardPilot(visualizer)
+
+    if args.corridor is not None and (args.record or args.world_corpus or args.publish):
+        parser.error("--corridor worlds can't be recorded, published or loaded from a world corpus")
+
+    recorder = None
+    if args.record:
+        if pilot is None:
+            parser.error("--record needs a pilot to record")
+        from recording import MIN_SEED, MAX_SEED, EpisodeRecorder, RecordingPilot
+        if args.seed is None:
+            # The recording has to say which world it was flown in.
+            args.seed = random.SystemRandom().getrandbits(63)
+        elif not MIN_SEED <= args.seed <= MAX_SEED:
+            parser.error("--record can only record seeds from {} to {}".format(MIN_SEED, MAX_SEED))
+        recorder = EpisodeRecorder(args.record, args.seed, args.world_generator, args.wind)
+        pilot = RecordingPilot(pilot, recorder)
+
+    publisher = None
+    if args.publish:
+        max_num_sites, max_num_trees = WORLD_SIZES[args.world_generator]
+        if max_num_sites > NUM_DELIVERY_SITES or max_num_trees > MAX_NUM_TREES:
+            parser.error("--publish only has room for worlds the size of the rejection and scatter worlds")
+        from viewer import SnapshotPublisher
+        try:
+            publisher = SnapshotPublisher(args.publish)
+        except FileExistsError as e:
+            parser.error(str(e))
+
+    corpus = None
+    if args.world_corpus:
+        from world_corpus import load_corpus
+        corpus = load_corpus(args.world_corpus)
+
+    if args.corridor is not None:
+        from corridor import CorridorSimulation
+        sim = CorridorSimulation(args.seed, max_ticks=args.corridor or None, wind_model=args.wind)
+    else:
+        sim = ZipSimulation(args.seed, corpus, args.world_generator, args.wind)
+
+    if profiler is not None:
+        profiler.instrument(sim, SIMULATION_PHASES)
+        profiler.instrument(raw_pilot if raw_pilot is not None else pilot, PILOT_PHASES)
+        profiler.instrument(visualizer, VISUALIZER_PHASES)
+        profiler.instrument(publisher, PUBLISHER_PHASES)
+        profiler.start()
+    run(sim, pilot, visualizer, publisher)
+
+    if visualizer is not None:
+        visualizer.close()
+    if publisher is not None:
+        publisher.close()
+
+    deliveries, zipaa_violations = sim.result()
+
+    if pilot is not None:
+        pilot.close()
+    if recorder is not None:
+        recorder.close(sim.status, deliveries, zipaa_violations)
+    if timed_pilot is not None:
+        print(timed_pilot.report(), file=sys.stderr)
+    if profiler is not None:
+        print(profiler.report(), file=sys.stderr)
+        if args.profile_trace:
+            profiler.write_trace(args.profile_trace)
+    print("Deliveries: {}".format(deliveries))
+    print("ZIPAA Violations: {}".format(zipaa_violations))
+    return sim.status
+
+
+if __name__ == "__main__":
+    # Python pilots may import zip_sim themselves. Make sure they get this module, not a second copy of it.
+    sys.modules.setdefault("zip_sim", sys.modules[__name__])
+    sys.exit(main())